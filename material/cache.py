@@ -0,0 +1,67 @@
+from dataclasses import dataclass
+
+import bpy
+import gpu
+
+from .parser import F64Material, f64_material_parse
+from .texture import texture_cache_prune
+from .ubo import UBO_SIZE
+from ..utils.profiler import f64render_profiler
+
+# Parsed material + GPU state, shared by all objects using the same material
+@dataclass
+class MaterialCacheEntry:
+    f64mat: F64Material
+    version: tuple # (epoch, update counter) at parse time
+    mat_data: bytes # last uploaded UBO content
+    ubo: gpu.types.GPUUniformBuf
+
+f64render_materialCache: dict[int, MaterialCacheEntry] = {} # keyed by 'session_uid'
+f64render_mat_epoch = 0 # bumped if all materials need to be parsed again (e.g. ucode change)
+f64render_mat_versions: dict[int, int] = {} # update counter per material
+
+def material_cache_mark_dirty(mat: bpy.types.Material):
+  uid = mat.session_uid
+  f64render_mat_versions[uid] = f64render_mat_versions.get(uid, 0) + 1
+
+# Marks all materials using the given image as changed, so they pick up the newly uploaded texture
+def material_cache_mark_image_dirty(image_uid: int):
+  for uid, entry in f64render_materialCache.items():
+    if entry.f64mat is not None and image_uid in (entry.f64mat.tex0_image, entry.f64mat.tex1_image):
+      f64render_mat_versions[uid] = f64render_mat_versions.get(uid, 0) + 1
+
+def material_cache_mark_all_dirty():
+  global f64render_mat_epoch
+  f64render_mat_epoch += 1
+  material_cache_prune_textures()
+
+# Frees the textures of deleted images, and of images no existing material uses anymore
+def material_cache_prune_textures():
+  materials = {mat.session_uid for mat in bpy.data.materials}
+  used = set()
+  for uid, entry in f64render_materialCache.items():
+    if uid in materials and entry.f64mat is not None:
+      used.update((entry.f64mat.tex0_image, entry.f64mat.tex1_image))
+  texture_cache_prune(used & {image.session_uid for image in bpy.data.images})
+
+def material_cache_clear():
+  f64render_materialCache.clear()
+  f64render_mat_versions.clear()
+
+# Returns the cache entry of a material, (re-)parsing it if it changed since the last call
+def material_cache_get(mat: bpy.types.Material) -> MaterialCacheEntry:
+  uid = mat.session_uid
+  version = (f64render_mat_epoch, f64render_mat_versions.get(uid, 0))
+
+  entry = f64render_materialCache.get(uid)
+  if entry is None:
+    mat_data = bytes(UBO_SIZE)
+    entry = f64render_materialCache[uid] = MaterialCacheEntry(None, None, mat_data, gpu.types.GPUUniformBuf(mat_data))
+
+  if entry.version != version:
+    with f64render_profiler.scope("material parse"):
+      entry.f64mat = f64_material_parse(mat.f3d_mat, entry.f64mat)
+    entry.version = version
+    f64render_profiler.count("material parses")
+
+  return entry
@@ -7,6 +7,7 @@ import time
 from .tile import get_tile_conf
 from .cc import get_cc_settings
 from .blender import get_blender_settings
+from .texture import texture_cache_get, get_tex_quantize, TEX_QUANTIZE_NONE
 
 GEO_MODE_ATTRS = [
   "g_zbuffer",
@@ -53,10 +54,6 @@ DRAW_FLAG_TEX0_MONO    = (1 << 1)
 DRAW_FLAG_TEX1_MONO    = (1 << 2)
 DRAW_FLAG_DECAL        = (1 << 3)
 DRAW_FLAG_ALPHA_BLEND  = (1 << 4)
-DRAW_FLAG_TEX0_4BIT    = (1 << 5)
-DRAW_FLAG_TEX1_4BIT    = (1 << 6)
-DRAW_FLAG_TEX0_3BIT    = (1 << 7)
-DRAW_FLAG_TEX1_3BIT    = (1 << 8)
 
 @dataclass
 class F64Material:
@@ -88,6 +85,8 @@ class F64Material:
     queue: int = 0
     tex0Buff: gpu.types.GPUTexture = None
     tex1Buff: gpu.types.GPUTexture = None
+    tex0_image: int = None # 'session_uid' of the image behind 'tex0Buff'
+    tex1_image: int = None
 
 
 # parses a non-f3d material for the fallback renderer
@@ -128,7 +127,20 @@ def f64_parse_blend_mode(f3d_mat: any, f64mat: F64Material) -> str:
     ):
         f64mat.flags |= DRAW_FLAG_ALPHA_BLEND
 
-def f64_material_parse(f3d_mat: any, prev_f64mat: F64Material) -> F64Material:
+# Image + quantization used for tex0/tex1 of a material, None if the texture is not set
+def get_material_textures(f3d_mat: any) -> list[tuple[bpy.types.Image, int] | None]:
+  textures = []
+  for tex in (f3d_mat.tex0, f3d_mat.tex1):
+    if not tex.tex_set:
+      textures.append(None)
+    elif tex.tex:
+      textures.append((tex.tex, get_tex_quantize(tex.tex_format)))
+    else:
+      textures.append((bpy.data.images["f64render_missing_texture"], TEX_QUANTIZE_NONE))
+  return textures
+
+# 'upload_textures' can be disabled if no GPU is used (e.g. CPU rendering), only 'tex*_image' is set then
+def f64_material_parse(f3d_mat: any, prev_f64mat: F64Material, upload_textures: bool = True) -> F64Material:
   from fast64_internal.utility import s_rgb_alpha_1_tuple, gammaCorrect
   from fast64_internal.f3d.f3d_material import all_combiner_uses
   cc_uses = all_combiner_uses(f3d_mat)
@@ -184,31 +196,22 @@ def f64_material_parse(f3d_mat: any, prev_f64mat: F64Material) -> F64Material:
   if f3d_mat.rdp_settings.zmode == 'ZMODE_DEC':
     f64mat.flags |= DRAW_FLAG_DECAL
 
-  # Note: doing 'gpu.texture.from_image' seems to cost nothing, caching is not needed
+  # textures are shared between materials, uploads only happen if the image itself changed.
+  # Format quantization (I4/IA4/IA8) is applied once during the upload.
   if f3d_mat.tex0.tex_set:
-    if f3d_mat.tex0.tex:
-      f64mat.tex0Buff = gpu.texture.from_image(f3d_mat.tex0.tex)
-      if f3d_mat.tex0.tex_format == 'I4' or f3d_mat.tex0.tex_format == 'I8':
-        f64mat.flags |= DRAW_FLAG_TEX0_MONO
-      if f3d_mat.tex0.tex_format == 'I4' or f3d_mat.tex0.tex_format == 'IA8':
-        f64mat.flags |= DRAW_FLAG_TEX0_4BIT
-      if f3d_mat.tex0.tex_format == 'IA4':
-        f64mat.flags |= DRAW_FLAG_TEX0_3BIT
-    else:
-      f64mat.tex0Buff = gpu.texture.from_image(bpy.data.images["f64render_missing_texture"])
+    tex0 = f3d_mat.tex0.tex or bpy.data.images["f64render_missing_texture"]
+    quantize = get_tex_quantize(f3d_mat.tex0.tex_format) if f3d_mat.tex0.tex else TEX_QUANTIZE_NONE
+    if upload_textures: f64mat.tex0Buff = texture_cache_get(tex0, quantize)
+    f64mat.tex0_image = tex0.session_uid
+    if not f3d_mat.tex0.tex or f3d_mat.tex0.tex_format == 'I4' or f3d_mat.tex0.tex_format == 'I8':
       f64mat.flags |= DRAW_FLAG_TEX0_MONO
 
   if f3d_mat.tex1.tex_set:
-    if f3d_mat.tex1.tex:
-      f64mat.tex1Buff = gpu.texture.from_image(f3d_mat.tex1.tex)
-      if f3d_mat.tex1.tex_format == 'I4' or f3d_mat.tex1.tex_format == 'I8':
-        f64mat.flags |= DRAW_FLAG_TEX1_MONO
-      if f3d_mat.tex1.tex_format == 'I4' or f3d_mat.tex1.tex_format == 'IA8':
-        f64mat.flags |= DRAW_FLAG_TEX1_4BIT
-      if f3d_mat.tex1.tex_format == 'IA4':
-        f64mat.flags |= DRAW_FLAG_TEX1_3BIT
-    else:
-      f64mat.tex1Buff = gpu.texture.from_image(bpy.data.images["f64render_missing_texture"])
+    tex1 = f3d_mat.tex1.tex or bpy.data.images["f64render_missing_texture"]
+    quantize = get_tex_quantize(f3d_mat.tex1.tex_format) if f3d_mat.tex1.tex else TEX_QUANTIZE_NONE
+    if upload_textures: f64mat.tex1Buff = texture_cache_get(tex1, quantize)
+    f64mat.tex1_image = tex1.session_uid
+    if not f3d_mat.tex1.tex or f3d_mat.tex1.tex_format == 'I4' or f3d_mat.tex1.tex_format == 'I8':
       f64mat.flags |= DRAW_FLAG_TEX1_MONO
 
 
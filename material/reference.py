@@ -0,0 +1,162 @@
+import numpy as np
+
+from .parser import F64Material
+from .variant import G_CYC_2CYCLE
+
+# CPU reference of the color-combiner and blender in 'shader/main3d.frag.glsl'.
+# Everything works on whole arrays of pixels (N x 4) for a single material at once.
+# The input encoding is the same as the packed 'F64Material.cc' / 'F64Material.blender' arrays.
+
+GAMMA_FACTOR = 2.2
+
+# CC color inputs (see 'CC1_C' in cc.py)
+CC_C_0, CC_C_1, CC_C_COMB, CC_C_TEX0, CC_C_TEX1, CC_C_PRIM, CC_C_SHADE, CC_C_ENV = range(8)
+CC_C_CENTER, CC_C_SCALE, CC_C_COMB_ALPHA, CC_C_TEX0_ALPHA, CC_C_TEX1_ALPHA = range(8, 13)
+CC_C_PRIM_ALPHA, CC_C_SHADE_ALPHA, CC_C_ENV_ALPHA, CC_C_LOD_FRAC, CC_C_PRIM_LOD_FRAC = range(13, 18)
+CC_C_NOISE, CC_C_K4, CC_C_K5 = range(18, 21)
+
+# CC alpha inputs (see 'CC1_A' in cc.py)
+CC_A_0, CC_A_1, CC_A_COMB, CC_A_TEX0, CC_A_TEX1, CC_A_PRIM, CC_A_SHADE, CC_A_ENV = range(8)
+CC_A_LOD_FRAC, CC_A_PRIM_LOD_FRAC = range(8, 10)
+
+# Blender inputs (see 'BL_INP' in blender.py)
+BLENDER_0, BLENDER_1, BLENDER_CLR_IN, BLENDER_CLR_MEM, BLENDER_CLR_BL, BLENDER_CLR_FOG = range(6)
+BLENDER_A_IN, BLENDER_A_FOG, BLENDER_A_SHADE, BLENDER_1MA, BLENDER_A_MEM = range(6, 11)
+
+def gamma_to_linear(color: np.ndarray) -> np.ndarray:
+  return np.power(color, GAMMA_FACTOR)
+
+def linear_to_gamma(color: np.ndarray) -> np.ndarray:
+  return np.power(color, 1.0 / GAMMA_FACTOR)
+
+def noise(pos: np.ndarray) -> np.ndarray:
+  val = np.sin(pos[:, 0] * 12.9898 + pos[:, 1] * 78.233) * 43758.5453
+  return val - np.floor(val)
+
+# Texels as the combiner sees them: sampled (linear) values converted to gamma space, I4/I8 expanded to 'rrrr'
+def tex_prepare(texels: np.ndarray, mono: bool) -> np.ndarray:
+  texels = np.array(texels, dtype=np.float32)
+  texels[:, :3] = linear_to_gamma(texels[:, :3])
+  if mono:
+    texels[:] = texels[:, :1]
+  return texels
+
+# Constant (per material) values, these match what the UBO contains for a draw
+class CCConstants:
+  def __init__(self, f64mat: F64Material, prim: tuple = None, env: tuple = None):
+    self.prim = np.asarray(prim if prim is not None else f64mat.color_prim, dtype=np.float32)
+    self.env = np.asarray(env if env is not None else f64mat.color_env, dtype=np.float32)
+    ck = np.asarray(f64mat.ck, dtype=np.float32)
+    self.ck_center, self.ck_scale = ck[0:4], ck[4:8]
+    self.prim_lod_frac = np.float32(f64mat.lod_prim[1])
+    self.k4, self.k5 = np.float32(f64mat.convert[4]), np.float32(f64mat.convert[5])
+
+def cc_fetch_color(val: int, consts: CCConstants, shade, comb, tex0, tex1, noise_val) -> np.ndarray:
+  count = len(shade)
+  def const(v): return np.broadcast_to(np.asarray(v, dtype=np.float32), (count, 3))
+
+  if val == CC_C_COMB:           return comb[:, :3]
+  if val == CC_C_TEX0:           return tex0[:, :3]
+  if val == CC_C_TEX1:           return tex1[:, :3]
+  if val == CC_C_PRIM:           return const(consts.prim[:3])
+  if val == CC_C_SHADE:          return shade[:, :3]
+  if val == CC_C_ENV:            return const(consts.env[:3])
+  if val == CC_C_CENTER:         return const(consts.ck_center[:3])
+  if val == CC_C_SCALE:          return const(consts.ck_scale[:3])
+  if val == CC_C_COMB_ALPHA:     return np.repeat(comb[:, 3:4], 3, axis=1)
+  if val == CC_C_TEX0_ALPHA:     return np.repeat(tex0[:, 3:4], 3, axis=1)
+  if val == CC_C_TEX1_ALPHA:     return np.repeat(tex1[:, 3:4], 3, axis=1)
+  if val == CC_C_PRIM_ALPHA:     return const(consts.prim[3])
+  if val == CC_C_SHADE_ALPHA:    return np.repeat(linear_to_gamma(shade[:, 3:4]), 3, axis=1)
+  if val == CC_C_ENV_ALPHA:      return const(consts.env[3])
+  if val == CC_C_PRIM_LOD_FRAC:  return const(consts.prim_lod_frac)
+  if val == CC_C_NOISE:          return np.repeat(noise_val[:, None], 3, axis=1)
+  if val == CC_C_K4:             return const(consts.k4)
+  if val == CC_C_K5:             return const(consts.k5)
+  if val == CC_C_1:              return const(1.0)
+  return const(0.0) # default: CC_C_0 (and LOD_FRAC, not emulated yet)
+
+def cc_fetch_alpha(val: int, consts: CCConstants, shade, comb, tex0, tex1) -> np.ndarray:
+  count = len(shade)
+  def const(v): return np.full(count, v, dtype=np.float32)
+
+  if val == CC_A_COMB:          return comb[:, 3]
+  if val == CC_A_TEX0:          return tex0[:, 3]
+  if val == CC_A_TEX1:          return tex1[:, 3]
+  if val == CC_A_PRIM:          return const(consts.prim[3])
+  if val == CC_A_SHADE:         return shade[:, 3]
+  if val == CC_A_ENV:           return const(consts.env[3])
+  if val == CC_A_PRIM_LOD_FRAC: return const(consts.prim_lod_frac)
+  if val == CC_A_1:             return const(1.0)
+  return const(0.0) # default: CC_A_0 (and LOD_FRAC, not emulated yet)
+
+# Wraps around below -0.5 and above 1.5, see 'cc_overflowValue'
+def cc_overflow(value: np.ndarray) -> np.ndarray:
+  return np.mod(value + 0.5, 2.0) - 0.5
+
+def _cc_cycle(cc: np.ndarray, consts: CCConstants, shade, comb, tex0, tex1, noise_val) -> np.ndarray:
+  inputs = np.empty((4, len(shade), 4), dtype=np.float32)
+  for i in range(4):
+    inputs[i, :, :3] = cc_fetch_color(int(cc[i]), consts, shade, comb, tex0, tex1, noise_val)
+    inputs[i, :, 3] = cc_fetch_alpha(int(cc[4 + i]), consts, shade, comb, tex0, tex1)
+  return (inputs[0] - inputs[1]) * inputs[2] + inputs[3]
+
+# Evaluates the 1-/2-cycle combiner, returns the result in linear space (same as 'ccValue' in the shader).
+# 'shade' is the (flat or smooth) vertex color, 'tex0'/'tex1' are prepared via 'tex_prepare'.
+def cc_evaluate(
+  f64mat: F64Material, shade: np.ndarray, tex0: np.ndarray = None, tex1: np.ndarray = None,
+  screen_pos: np.ndarray = None, prim: tuple = None, env: tuple = None,
+) -> np.ndarray:
+  shade = np.asarray(shade, dtype=np.float32)
+  count = len(shade)
+  tex0 = np.zeros((count, 4), dtype=np.float32) if tex0 is None else np.asarray(tex0, dtype=np.float32)
+  tex1 = np.zeros((count, 4), dtype=np.float32) if tex1 is None else np.asarray(tex1, dtype=np.float32)
+  noise_val = noise(screen_pos * 0.25) if screen_pos is not None else np.zeros(count, dtype=np.float32)
+
+  consts = CCConstants(f64mat, prim, env)
+  cc = np.asarray(f64mat.cc)
+
+  value = np.zeros((count, 4), dtype=np.float32)
+  value = cc_overflow(_cc_cycle(cc[0:8], consts, shade, value, tex0, tex1, noise_val))
+  if f64mat.othermode_h & G_CYC_2CYCLE:
+    value = _cc_cycle(cc[8:16], consts, shade, value, tex0, tex1, noise_val)
+
+  value = np.clip(cc_overflow(value), 0.0, 1.0)
+  value[:, :3] = gamma_to_linear(value[:, :3])
+  return value
+
+def blender_fetch(val: int, color_fb, color_cc, shade, blender_a) -> np.ndarray:
+  count = len(color_cc)
+  if val == BLENDER_1:       return np.ones((count, 4), dtype=np.float32)
+  if val == BLENDER_CLR_IN:  return color_cc
+  if val == BLENDER_CLR_MEM: return color_fb
+  if val == BLENDER_CLR_BL:  return np.zeros((count, 4), dtype=np.float32) # @TODO in shader
+  if val == BLENDER_CLR_FOG: return color_cc # @TODO in shader
+  if val == BLENDER_A_IN:    return np.repeat(color_cc[:, 3:4], 4, axis=1)
+  if val == BLENDER_A_FOG:   return np.ones((count, 4), dtype=np.float32)
+  if val == BLENDER_A_SHADE: return np.repeat(shade[:, 3:4], 4, axis=1)
+  if val == BLENDER_1MA:     return 1.0 - np.repeat(blender_a[:, 3:4], 4, axis=1)
+  if val == BLENDER_A_MEM:   return np.repeat(color_fb[:, 3:4], 4, axis=1)
+  return np.zeros((count, 4), dtype=np.float32) # default: BLENDER_0
+
+def _blender_cycle(bl: tuple, color_fb, color_cc, shade) -> np.ndarray:
+  zero = np.zeros_like(color_cc)
+  p = blender_fetch(bl[0], color_fb, color_cc, shade, zero)
+  a = blender_fetch(bl[1], color_fb, color_cc, shade, zero)
+  m = blender_fetch(bl[2], color_fb, color_cc, shade, a)
+  b = blender_fetch(bl[3], color_fb, color_cc, shade, a)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return (p * a + m * b) / (a + b)
+
+# Evaluates both blender cycles like 'blendColor', 'cc_value' is the result of 'cc_evaluate'.
+# 'framebuffer' is the previous color (alpha is ignored), 'shade' the interpolated vertex color.
+def blender_evaluate(f64mat: F64Material, cc_value: np.ndarray, framebuffer: np.ndarray, shade: np.ndarray) -> np.ndarray:
+  color_cc = np.array(cc_value, dtype=np.float32)
+  color_cc[:, 3] = np.power(color_cc[:, 3], 1.0 / GAMMA_FACTOR)
+  color_fb = np.array(framebuffer, dtype=np.float32)
+  color_fb[:, 3] = 0.0
+  shade = np.asarray(shade, dtype=np.float32)
+
+  res = _blender_cycle(f64mat.blender[0:4], color_fb, color_cc, shade)
+  res[:, 3] = gamma_to_linear(color_cc[:, 3]) # preserve for 'A_IN'
+  return _blender_cycle(f64mat.blender[4:8], color_fb, res, shade)
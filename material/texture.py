@@ -0,0 +1,101 @@
+from dataclasses import dataclass
+
+import bpy
+import gpu
+import numpy as np
+
+# Quantization applied to an image at upload time, emulates the reduced precision of N64 formats
+TEX_QUANTIZE_NONE = 0
+TEX_QUANTIZE_4BIT = 1 # I4, IA8
+TEX_QUANTIZE_3BIT = 2 # IA4 (3-bit intensity, 1-bit alpha)
+
+# Returns the quantization needed for a fast64 texture format, CI and RGBA formats are used as is
+def get_tex_quantize(tex_format: str) -> int:
+  if tex_format == 'I4' or tex_format == 'IA8': return TEX_QUANTIZE_4BIT
+  if tex_format == 'IA4': return TEX_QUANTIZE_3BIT
+  return TEX_QUANTIZE_NONE
+
+def srgb_to_linear(color: np.ndarray) -> np.ndarray:
+  return np.where(color <= 0.04045, color / 12.92, ((color + 0.055) / 1.055) ** 2.4)
+
+# Same as 'quantize4Bit' / 'quantize3Bit' previously done in the fragment shader for each fetch.
+# Note: like before, this happens on linear values as the GPU would sample them from an sRGB texture.
+def quantize_pixels(pixels: np.ndarray, quantize: int) -> np.ndarray:
+  if quantize == TEX_QUANTIZE_4BIT:
+    return np.round(pixels * 16.0) / 16.0 # (16 seems more accurate than 15)
+  if quantize == TEX_QUANTIZE_3BIT:
+    pixels = pixels.copy()
+    pixels[:, :3] = np.round(pixels[:, :3] * 8.0) / 8.0
+    pixels[:, 3] = pixels[:, 3] >= 0.5
+    return pixels
+  return pixels
+
+# Reads the pixels of an image (N x 4, bottom row first) as the shader would sample them
+def image_read_pixels(image: bpy.types.Image, quantize: int = TEX_QUANTIZE_NONE) -> np.ndarray:
+  width, height = image.size
+  pixels = np.empty(width * height * 4, dtype=np.float32)
+  image.pixels.foreach_get(pixels)
+  pixels = pixels.reshape((-1, 4))
+
+  # byte images store sRGB values, float images are already linear
+  if not image.is_float and image.colorspace_settings.name == 'sRGB':
+    pixels[:, :3] = srgb_to_linear(pixels[:, :3])
+
+  return quantize_pixels(pixels, quantize).astype(np.float32)
+
+# Uploads an image with its pixels quantized on the CPU
+def texture_from_image_quantized(image: bpy.types.Image, quantize: int) -> gpu.types.GPUTexture:
+  width, height = image.size
+  pixels = image_read_pixels(image, quantize)
+  buffer = gpu.types.Buffer('FLOAT', pixels.size, pixels.ravel())
+  return gpu.types.GPUTexture((width, height), format='RGBA16F', data=buffer)
+
+# GPU texture of an image, shared by all materials using it
+@dataclass
+class TextureCacheEntry:
+    texture: gpu.types.GPUTexture
+    version: tuple # (update counter, image state) at upload time
+    size: int # estimated VRAM in bytes
+
+f64render_textureCache: dict[tuple, TextureCacheEntry] = {} # keyed by 'session_uid' of the image + quantization
+f64render_tex_versions: dict[int, int] = {} # update counter per image
+
+# Marks an image as changed (e.g. painted on or reloaded), it will be uploaded again on the next use
+def texture_cache_mark_dirty(image: bpy.types.Image):
+  uid = image.session_uid
+  f64render_tex_versions[uid] = f64render_tex_versions.get(uid, 0) + 1
+
+# Frees the textures of all images not in 'keep' ('session_uid's), e.g. deleted or no longer used ones
+def texture_cache_prune(keep: set[int]):
+  for key in [key for key in f64render_textureCache if key[0] not in keep]:
+    del f64render_textureCache[key]
+  for uid in [uid for uid in f64render_tex_versions if uid not in keep]:
+    del f64render_tex_versions[uid]
+
+def texture_cache_clear():
+  f64render_textureCache.clear()
+  f64render_tex_versions.clear()
+
+# Returns the number of cached textures and their estimated VRAM usage in bytes
+def texture_cache_stats() -> tuple[int, int]:
+  return len(f64render_textureCache), sum(entry.size for entry in f64render_textureCache.values())
+
+# Returns the GPU texture of an image, only uploading it if the image changed since the last call.
+# Besides depsgraph updates, this checks the size/path/dirty-state which covers reloads and the first paint stroke.
+def texture_cache_get(image: bpy.types.Image, quantize: int = TEX_QUANTIZE_NONE) -> gpu.types.GPUTexture:
+  uid = image.session_uid
+  version = (f64render_tex_versions.get(uid, 0), tuple(image.size), image.filepath_raw, image.is_dirty)
+
+  key = (uid, quantize)
+  entry = f64render_textureCache.get(key)
+  if entry is None or entry.version != version:
+    # images without pixel data (e.g. missing files) get blender's placeholder texture, there is nothing to quantize
+    if quantize == TEX_QUANTIZE_NONE or image.size[0] == 0 or image.size[1] == 0:
+      texture = gpu.texture.from_image(image)
+      size = texture.width * texture.height * (16 if image.is_float else 4)
+    else:
+      texture = texture_from_image_quantized(image, quantize)
+      size = texture.width * texture.height * 8
+    entry = f64render_textureCache[key] = TextureCacheEntry(texture, version, size)
+
+  return entry.texture
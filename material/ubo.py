@@ -0,0 +1,91 @@
+import struct
+import numpy as np
+
+from .parser import F64Material
+
+# Layout of 'UBO_Material' in shader/structs.glsl
+UNIFORM_BUFFER_STRUCT = struct.Struct(
+  "8i"              # blender
+  "16f"             # tile settings (mask/shift/low/high)
+  "16i"             # color-combiner settings
+  "i i i i"         # geoMode, other-low, other-high, flags
+  "4f 4f 3f f 3f f" # light (first light direction W is alpha-clip)
+  "4f 4f 4f"        # prim, env, ambient
+  "2f 2f"           # prim_lod, prim-depth
+  "8f 6f"           # ck center/scale, k0-k5,
+)
+
+UBO_SIZE = (UNIFORM_BUFFER_STRUCT.size + 15) & ~15 # force 16-byte alignment
+
+# Same layout as a numpy record, used to build the UBOs of all draws at once
+UBO_DTYPE = np.dtype([
+  ("blender",     np.int32,   (8,)),
+  ("tile_conf",   np.float32, (16,)),
+  ("cc",          np.int32,   (16,)),
+  ("modes",       np.int32,   (4,)),    # geoMode, other-low, other-high, flags
+  ("light_color", np.float32, (2, 4)),
+  ("light_dir",   np.float32, (2, 4)),  # first light direction W is alpha-clip
+  ("prim",        np.float32, (4,)),
+  ("env",         np.float32, (4,)),
+  ("ambient",     np.float32, (4,)),
+  ("ck",          np.float32, (8,)),
+  ("prim_lod",    np.float32, (2,)),
+  ("prim_depth",  np.float32, (2,)),
+  ("convert",     np.float32, (6,)),
+  ("padding",     np.uint8,   (UBO_SIZE - UNIFORM_BUFFER_STRUCT.size,)),
+])
+assert UBO_DTYPE.itemsize == UBO_SIZE
+
+# Picks the value of the last draw (up to and including the current one) that set it,
+# draws before the first one setting it get the default value.
+def _inherit(values: np.ndarray, is_set: np.ndarray, default) -> np.ndarray:
+  last_set = np.where(is_set, np.arange(len(is_set)), -1)
+  last_set = np.maximum.accumulate(last_set)
+  table = np.concatenate([values, np.asarray(default, dtype=values.dtype)[None]]) # index -1 -> default
+  return table[last_set]
+
+# Builds the UBO content for all draws of a frame in one go.
+# 'materials' contains each material once, 'draw_mat_idx' references them in draw order.
+# Prim/env/ck/convert are inherited from previous draws if not set by the material itself.
+def ubo_build_batch(
+  materials: list[F64Material], draw_mat_idx: np.ndarray,
+  light_color: tuple, light_dir: tuple, ambient_color: tuple,
+  default_prim: tuple, default_env: tuple,
+) -> np.ndarray:
+  # per material values, expanded to per draw values afterwards
+  mat = np.zeros(len(materials), dtype=UBO_DTYPE)
+  for i, f64mat in enumerate(materials):
+    rec = mat[i]
+    rec["blender"] = f64mat.blender
+    rec["tile_conf"] = f64mat.tile_conf
+    rec["cc"] = f64mat.cc
+    rec["modes"] = (f64mat.geo_mode, f64mat.othermode_l, f64mat.othermode_h, f64mat.flags)
+    rec["light_color"][0] = f64mat.color_light if f64mat.set_light else light_color[0]
+    rec["light_dir"][0, 3] = f64mat.alphaClip
+    rec["prim"] = f64mat.color_prim
+    rec["env"] = f64mat.color_env
+    rec["ambient"] = f64mat.color_ambient if f64mat.set_ambient else ambient_color
+    rec["ck"] = f64mat.ck
+    rec["prim_lod"] = f64mat.lod_prim
+    rec["prim_depth"] = f64mat.prim_depth
+    rec["convert"] = f64mat.convert
+
+  mat_flags = np.array([
+    (m.set_prim, m.set_env, m.set_ck, m.set_convert) for m in materials
+  ], dtype=bool).reshape(-1, 4)
+
+  ubo = mat[draw_mat_idx]
+  set_prim, set_env, set_ck, set_convert = mat_flags[draw_mat_idx].T
+
+  ubo["light_color"][:, 1] = light_color[1]
+  ubo["light_dir"][:, 0, :3] = light_dir[0]
+  ubo["light_dir"][:, 1, :3] = light_dir[1]
+
+  if len(ubo) > 0:
+    ubo["prim"]     = _inherit(ubo["prim"],     set_prim,    default_prim)
+    ubo["prim_lod"] = _inherit(ubo["prim_lod"], set_prim,    (0, 0))
+    ubo["env"]      = _inherit(ubo["env"],      set_env,     default_env)
+    ubo["ck"]       = _inherit(ubo["ck"],       set_ck,      (0,) * 8)
+    ubo["convert"]  = _inherit(ubo["convert"],  set_convert, (0,) * 6)
+
+  return ubo
@@ -0,0 +1,34 @@
+from .parser import F64Material
+
+# Othermode-H bits, see 'shader/defines.glsl'
+G_CYC_2CYCLE  = (1 << 20)
+G_TF_BILERP   = (2 << 12)
+
+# Key of the specialized shader a material can use, materials with the same key share the shader
+def get_variant_key(f64mat: F64Material) -> tuple:
+  return (
+    tuple(int(x) for x in f64mat.cc),
+    tuple(int(x) for x in f64mat.blender),
+    (f64mat.othermode_h & G_CYC_2CYCLE) != 0,
+    (f64mat.othermode_h & G_TF_BILERP) == G_TF_BILERP,
+  )
+
+def _ivec4(values) -> str:
+  return f"ivec4({', '.join(str(v) for v in values)})"
+
+# Defines that bake the CC/blender settings of a variant into the fragment shader (see 'main3d.frag.glsl')
+def get_variant_defines(key: tuple) -> dict[str, str]:
+  cc, blender, cycle_2, filter_3point = key
+  return {
+    "VARIANT_CC": "1",
+    "CC0_COLOR": _ivec4(cc[0:4]),
+    "CC0_ALPHA": _ivec4(cc[4:8]),
+    "CC1_COLOR": _ivec4(cc[8:12]),
+    "CC1_ALPHA": _ivec4(cc[12:16]),
+    "VARIANT_BLENDER": "1",
+    "BLENDER_CYCLE0": _ivec4(blender[0:4]),
+    "BLENDER_CYCLE1": _ivec4(blender[4:8]),
+    "VARIANT_OTHER_MODE_H": "1",
+    "CYCLE_2": "true" if cycle_2 else "false",
+    "FILTER_3POINT": "true" if filter_3point else "false",
+  }
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+
+from .mesh import MeshBuffers
+
+# Estimated memory of a mesh in bytes, this includes the numpy arrays and the GPU buffers.
+# The GPU vertex/index buffers use the same layout (float32 / int32) as the arrays they are filled with.
+def mesh_buffers_size(buffers: MeshBuffers) -> int:
+  size_gpu = (buffers.vert.nbytes + buffers.norm.nbytes + buffers.color.nbytes
+            + buffers.uv.nbytes + buffers.indices.nbytes)
+  return size_gpu + size_gpu + buffers.index_offsets.nbytes
+
+# LRU cache of mesh buffers with a memory budget.
+# Entries are ordered by the last time they got drawn, eviction starts with the oldest one.
+# Anything used in the current frame is never evicted, even if the budget is exceeded.
+class MeshCache:
+  def __init__(self):
+    self.entries: OrderedDict[tuple, MeshBuffers] = OrderedDict()
+    self.sizes: dict[tuple, int] = {}
+    self.last_frame: dict[tuple, int] = {}
+    self.frame = 0
+    self.total_size = 0
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self, key):
+    return key in self.entries
+
+  def __getitem__(self, key) -> MeshBuffers:
+    return self.entries[key]
+
+  def __setitem__(self, key, buffers: MeshBuffers):
+    if key in self.entries:
+      del self[key]
+    self.entries[key] = buffers
+    self.sizes[key] = mesh_buffers_size(buffers)
+    self.last_frame[key] = self.frame
+    self.total_size += self.sizes[key]
+
+  def __delitem__(self, key):
+    del self.entries[key]
+    del self.last_frame[key]
+    self.total_size -= self.sizes.pop(key)
+
+  def keys(self):
+    return self.entries.keys()
+
+  def values(self):
+    return self.entries.values()
+
+  def clear(self):
+    self.entries.clear()
+    self.sizes.clear()
+    self.last_frame.clear()
+    self.total_size = 0
+
+  # Lookup that counts towards the hit/miss statistics, returns None if not cached
+  def get(self, key) -> MeshBuffers | None:
+    buffers = self.entries.get(key)
+    if buffers is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+    return buffers
+
+  # Marks an entry as drawn in the current frame
+  def touch(self, key):
+    self.entries.move_to_end(key)
+    self.last_frame[key] = self.frame
+
+  def next_frame(self):
+    self.frame += 1
+
+  # Evicts least-recently-drawn entries until the budget is met, returns the removed keys
+  def evict(self, budget_bytes: int) -> list[tuple]:
+    evicted = []
+    while self.total_size > budget_bytes and len(self.entries) > 0:
+      key = next(iter(self.entries))
+      if self.last_frame[key] == self.frame:
+        break # everything after this is in use
+      del self[key]
+      evicted.append(key)
+
+    self.evictions += len(evicted)
+    return evicted
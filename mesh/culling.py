@@ -0,0 +1,20 @@
+import numpy as np
+
+# Corners of an axis-aligned bounding-box as homogeneous coordinates, 'aabb' is [min, max]
+def aabb_corners(aabb: np.ndarray) -> np.ndarray:
+  corners = np.ones((8, 4), dtype=np.float32)
+  for i in range(8):
+    corners[i, 0] = aabb[(i >> 0) & 1, 0]
+    corners[i, 1] = aabb[(i >> 1) & 1, 1]
+    corners[i, 2] = aabb[(i >> 2) & 1, 2]
+  return corners
+
+# Checks if a bounding-box is (at least partially) inside the view frustum.
+# 'mvp' maps the corners into clip-space, where the frustum planes are simply -w <= x,y,z <= w.
+# A box is only culled if all corners are outside the same plane, so this is conservative.
+def corners_in_frustum(mvp: np.ndarray, corners: np.ndarray) -> bool:
+  clip = corners @ mvp.T
+  xyz, w = clip[:, :3], clip[:, 3:]
+  if np.any(np.all(xyz < -w, axis=0)): return False
+  if np.any(np.all(xyz > w, axis=0)): return False
+  return True
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import pathlib
+import numpy as np
+
+from .mesh import MeshBuffers
+
+# Bump this whenever the layout or content of 'MeshBuffers' changes, old entries are then ignored
+DISK_CACHE_VERSION = 1
+DISK_CACHE_ARRAYS = ("vert", "color", "uv", "norm", "indices", "index_offsets", "bounds")
+
+# Persistent cache of converted meshes, keyed by a hash of the mesh data (see 'mesh_arrays_hash').
+# Each entry is a directory with one '.npy' file per array, which are memory-mapped when loading.
+class MeshDiskCache:
+  def __init__(self, base_dir: str):
+    self.base_path = pathlib.Path(base_dir)
+    self.path = self.base_path / f"v{DISK_CACHE_VERSION}"
+
+  def entry_path(self, key: str) -> pathlib.Path:
+    return self.path / key[:2] / key
+
+  def load(self, key: str) -> MeshBuffers | None:
+    path = self.entry_path(key)
+    if not path.is_dir():
+      return None
+    try:
+      arrays = [np.load(path / f"{name}.npy", mmap_mode='r') for name in DISK_CACHE_ARRAYS]
+    except (OSError, ValueError):
+      self._discard(path) # corrupted (entries are published complete), so the next store can write it again
+      return None
+    return MeshBuffers(*arrays, None)
+
+  # Entries are never overwritten: the same key means the same content, so whoever publishes first wins.
+  # Other threads (see 'mesh_workers') or blender instances may store the same mesh at the same time.
+  def store(self, key: str, buffers: MeshBuffers):
+    path = self.entry_path(key)
+    if path.is_dir():
+      return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write into a temp. directory first, so other blender instances never see partial entries
+    tmp_path = pathlib.Path(tempfile.mkdtemp(dir=path.parent))
+    try:
+      for name in DISK_CACHE_ARRAYS:
+        np.save(tmp_path / f"{name}.npy", np.ascontiguousarray(getattr(buffers, name)))
+      os.replace(tmp_path, path)
+    except OSError as e:
+      shutil.rmtree(tmp_path, ignore_errors=True)
+      if not path.is_dir(): # otherwise another writer published the entry first
+        print("f64render: failed to write mesh cache", e)
+
+  # Moves an entry out of the way before deleting it, so a new entry can be published right away
+  def _discard(self, path: pathlib.Path):
+    try:
+      trash_path = pathlib.Path(tempfile.mkdtemp(dir=path.parent))
+    except OSError:
+      return
+    try:
+      os.replace(path, trash_path / path.name)
+    except OSError:
+      pass # e.g. still memory-mapped on windows, stays until the next 'clear'
+    shutil.rmtree(trash_path, ignore_errors=True)
+
+  # Only deletes the entries, the base directory is user-chosen and may contain other files (e.g. '//')
+  def clear(self):
+    shutil.rmtree(self.path, ignore_errors=True)
+    try:
+      self.base_path.rmdir() # only succeeds if nothing else is left in it
+    except OSError:
+      pass
@@ -3,9 +3,10 @@ from dataclasses import dataclass
 import numpy as np
 import bpy
 import bmesh
-import time
+import hashlib
 import gpu
 from ..material.parser import F64Material
+from .culling import aabb_corners
 
 # Container for all vertex attributes
 @dataclass
@@ -17,68 +18,74 @@ class MeshBuffers:
     norm: np.ndarray
     indices: np.ndarray # global index array, sorted by material
     index_offsets: np.ndarray # offsets for each material in the index array
+    bounds: np.ndarray # corners of the bounding-box (8x4, homogeneous), used for culling
   # render data:
     batch: gpu.types.GPUBatch
-    mat_data: list[np.ndarray]
-    ubo_mat_data: list[gpu.types.GPUUniformBuf]
-    materials: list[F64Material] = None
-    mesh_name: str = "" # multiple obj. can share the same mesh, store to allow deletion by name
+    mesh_uid: int = 0 # 'session_uid' of the mesh, multiple obj. can share the same mesh, store to allow deletion by it
 
-# Converts a blender mesh into buffers to be used by the GPU renderer
-# Note that this can be a slow process, so it should be cached externally
-# This will only handle mesh data itself, materials are not read out here
-def mesh_to_buffers(mesh: bpy.types.Mesh) -> MeshBuffers:
-  tDes = time.process_time()
+# Per-object render state, the mesh itself is shared between objects via 'mesh_key'
+@dataclass
+class ObjRenderInfo:
+    mesh_key: tuple
+    mat_count: int
+    materials: list[F64Material] = None # fallback renderer only, f3d materials are shared (see 'material_cache_get')
+
+# Key into the mesh-cache, objects using the same mesh datablock share their buffers.
+# Modifiers (and edit-mode) make the evaluated mesh unique to the object, so those get their own entry.
+# Names are not unique (e.g. a local and a linked 'Cube'), so the 'session_uid' of the datablocks is used.
+def get_mesh_key(obj: bpy.types.Object) -> tuple:
+  if obj.mode == 'EDIT' or len(obj.modifiers) > 0:
+    return (obj.type, obj.data.session_uid, obj.session_uid)
+  return (obj.type, obj.data.session_uid)
+
+# Raw attributes of a mesh as read from blender, input for 'mesh_arrays_to_buffers'
+@dataclass
+class MeshArrays:
+    positions: np.ndarray # per vertex
+    tri_verts: np.ndarray # vertex index of each triangle corner
+    tri_loops: np.ndarray # face-corner index of each triangle corner
+    normals: np.ndarray # per face-corner
+    uvs: np.ndarray # per face-corner, None if there is no UV layer
+    colors: np.ndarray # per face-corner, None if there is no color layer
+    alpha: np.ndarray # per face-corner, None if there is no alpha layer
+    tri_hidden: np.ndarray # per triangle
+    mat_indices: np.ndarray # per triangle
+    mat_count: int
+
+# Reads out all data needed from a blender mesh, this needs to access blender and must run on the main thread
+def mesh_read_arrays(mesh: bpy.types.Mesh) -> MeshArrays:
   mesh.calc_loop_triangles()
 
-  # Here we want to transform all attributes into un-indexed arrays of per-vertex data
-  # Position + normals are stored per vertex (indexed), colors and uvs are stored per face-corner
-  # All need to be normalized to the same length
-  
   color_layer = mesh.color_attributes.get("Col")
   alpha_layer = mesh.color_attributes.get("Alpha")
   uv_layer = mesh.uv_layers.active.data if mesh.uv_layers.active else None
 
   num_corners = len(mesh.loop_triangles) * 3
-  # print("Faces: ", num_corners, color_layer)
 
-  positions = np.empty((num_corners, 3), dtype=np.float32)
-  normals   = np.empty((num_corners, 3), dtype=np.float32)
-  colors    = np.empty((num_corners, 4), dtype=np.float32)
-  uvs       = np.empty((num_corners, 2), dtype=np.float32)
+  tri_verts = np.empty(num_corners, dtype=np.int32)
+  mesh.loop_triangles.foreach_get('vertices', tri_verts)
+  tri_loops = np.empty(num_corners, dtype=np.int32)
+  mesh.loop_triangles.foreach_get('loops', tri_loops)
 
-  indices   = np.empty((num_corners   ), dtype=np.int32)
-  mesh.loop_triangles.foreach_get('vertices', indices)
-
-  # map vertices to unique face-corner
-  tmp_vec3 = np.empty((len(mesh.vertices), 3), dtype=np.float32)
-  mesh.vertices.foreach_get('co', tmp_vec3.ravel())
-  positions = tmp_vec3[indices]
+  positions = np.empty((len(mesh.vertices), 3), dtype=np.float32)
+  mesh.vertices.foreach_get('co', positions.ravel())
 
   # read normals (these contain pre-calculated normals handling  flat, smooth, custom split normals)
-  corner_norm = np.empty((len(mesh.corner_normals), 3), dtype=np.float32)
-  mesh.corner_normals.foreach_get('vector', corner_norm.ravel())
+  normals = np.empty((len(mesh.corner_normals), 3), dtype=np.float32)
+  mesh.corner_normals.foreach_get('vector', normals.ravel())
 
-  mesh.loop_triangles.foreach_get('loops', indices)
-  normals = corner_norm[indices]
-  
-  if uv_layer: 
+  uvs = colors = alpha = None
+  if uv_layer:
+    uvs = np.empty((len(uv_layer), 2), dtype=np.float32)
     uv_layer.foreach_get('uv', uvs.ravel())
-    uvs = uvs[indices]
-  else:
-    uvs.fill(0.0)
 
   if color_layer:
-    colors_tmp = np.empty((len(color_layer.data), 4), dtype=np.float32)
-    color_layer.data.foreach_get('color_srgb', colors_tmp.ravel())
-    colors = colors_tmp[indices]
+    colors = np.empty((len(color_layer.data), 4), dtype=np.float32)
+    color_layer.data.foreach_get('color_srgb', colors.ravel())
 
     if alpha_layer:
-      alpha_layer.data.foreach_get('color', colors_tmp.ravel())
-      colors[:, 3] = colors_tmp[indices, 0]
-
-  else:
-    colors.fill(1.0)
+      alpha = np.empty((len(alpha_layer.data), 4), dtype=np.float32)
+      alpha_layer.data.foreach_get('color', alpha.ravel())
 
   # create map of hidden polygons (we need to map that to triangles)
   poly_hidden = np.empty(len(mesh.polygons), dtype=np.int32)
@@ -88,24 +95,91 @@ def mesh_to_buffers(mesh: bpy.types.Mesh) -> MeshBuffers:
   mesh.loop_triangles.foreach_get('polygon_index', tri_hidden)
   tri_hidden = poly_hidden[tri_hidden]
 
-  # create index buffers for the mesh by material, the data behind it is unindexed
-  # this is done to do a cheap split by material
-  mat_count = len(mesh.materials)
-
   mat_indices = np.empty(len(mesh.loop_triangles), dtype=np.int8)
   mesh.loop_triangles.foreach_get('material_index', mat_indices) # materials, e.g.: [0, 1, 0, 1, 2, 1, ...]
-  index_array = np.arange(num_corners, dtype=np.int32) # -> [0, 1, 2, 3, 4, 5, ...]
-  index_array = index_array.reshape((-1, 3))           # -> [[0, 1, 2], [3, 4, 5], ...]
+
+  return MeshArrays(positions, tri_verts, tri_loops, normals, uvs, colors, alpha, tri_hidden, mat_indices, len(mesh.materials))
+
+# Hash over all mesh data, two meshes with the same hash produce the same buffers
+def mesh_arrays_hash(arrays: MeshArrays, salt: bytes = b"") -> str:
+  hasher = hashlib.blake2b(salt, digest_size=16)
+  for arr in (arrays.positions, arrays.tri_verts, arrays.tri_loops, arrays.normals, arrays.uvs,
+              arrays.colors, arrays.alpha, arrays.tri_hidden, arrays.mat_indices):
+    if arr is None:
+      hasher.update(b"-")
+    else:
+      hasher.update(str(arr.shape).encode())
+      hasher.update(np.ascontiguousarray(arr).data)
+  hasher.update(str(arrays.mat_count).encode())
+  return hasher.hexdigest()
+
+# Converts the raw mesh data into buffers to be used by the GPU renderer
+# This only uses numpy, so it doesn't need to touch any blender data
+# If 'deduplicate' is set, identical face-corners are merged into one vertex to create an indexed mesh
+def mesh_arrays_to_buffers(arrays: MeshArrays, deduplicate: bool = False) -> MeshBuffers:
+  # Here we want to transform all attributes into un-indexed arrays of per-vertex data
+  # Position + normals are stored per vertex (indexed), colors and uvs are stored per face-corner
+  # All need to be normalized to the same length
+  num_corners = len(arrays.tri_verts)
+  indices = arrays.tri_loops
+
+  # map vertices to unique face-corner
+  positions = arrays.positions[arrays.tri_verts]
+  normals = arrays.normals[indices]
+  
+  if arrays.uvs is not None:
+    uvs = arrays.uvs[indices]
+  else:
+    uvs = np.zeros((num_corners, 2), dtype=np.float32)
+
+  if arrays.colors is not None:
+    colors = arrays.colors[indices]
+    if arrays.alpha is not None:
+      colors[:, 3] = arrays.alpha[indices, 0]
+  else:
+    colors = np.ones((num_corners, 4), dtype=np.float32)
+
+  # create index buffers for the mesh by material, the data behind it is unindexed
+  # this is done to do a cheap split by material
+  mat_count = arrays.mat_count
+  mat_indices = arrays.mat_indices
+
+  if deduplicate:
+    # view all attributes of a corner as one opaque value, so that 'unique' can compare entire vertices
+    packed = np.ascontiguousarray(np.concatenate([positions, normals, colors, uvs], axis=1, dtype=np.float32))
+    packed = packed.view(np.dtype((np.void, packed.itemsize * packed.shape[1]))).ravel()
+    _, unique_idx, corner_to_vert = np.unique(packed, return_index=True, return_inverse=True)
+
+    # 'unique' sorts by value, restore the order of first use to keep vertices of a triangle close in memory
+    order = np.argsort(unique_idx)
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    unique_idx = unique_idx[order]
+
+    positions, normals, colors, uvs = positions[unique_idx], normals[unique_idx], colors[unique_idx], uvs[unique_idx]
+    index_array = remap[corner_to_vert.ravel()].astype(np.int32).reshape((-1, 3))
+  else:
+    index_array = np.arange(num_corners, dtype=np.int32) # -> [0, 1, 2, 3, 4, 5, ...]
+    index_array = index_array.reshape((-1, 3))           # -> [[0, 1, 2], [3, 4, 5], ...]
 
   # remove faces based on 'tri_hidden' (0=visible, 1=hidden)
-  index_array = index_array[tri_hidden == 0]
-  mat_indices = mat_indices[tri_hidden == 0]
+  index_array = index_array[arrays.tri_hidden == 0]
+  mat_indices = mat_indices[arrays.tri_hidden == 0]
   
   index_array = index_array[np.argsort(mat_indices)] # sort index_array by value in use_flat (aka material-index)
   index_offsets = np.bincount(mat_indices, minlength=mat_count)    # now get counts of each material, e.g.: [1, 2] where index is material-index
   index_offsets = np.insert(index_offsets, 0, 0)  # prepend 0 to turn counts into offsets
   index_offsets = np.cumsum(index_offsets) * 3    # converted into accumulated offset / mul. by 3 for triangles
 
-  print(" - Mesh", (time.process_time() - tDes) * 1000)
+  if len(positions) > 0:
+    bounds = aabb_corners(np.array([positions.min(axis=0), positions.max(axis=0)]))
+  else:
+    bounds = aabb_corners(np.zeros((2, 3), dtype=np.float32))
 
-  return MeshBuffers(positions, colors, uvs, normals, index_array, index_offsets, None, None, None, None, None)
\ No newline at end of file
+  return MeshBuffers(positions, colors, uvs, normals, index_array, index_offsets, bounds, None)
+
+# Converts a blender mesh into buffers to be used by the GPU renderer
+# Note that this can be a slow process, so it should be cached externally
+# This will only handle mesh data itself, materials are not read out here
+def mesh_to_buffers(mesh: bpy.types.Mesh, deduplicate: bool = False) -> MeshBuffers:
+  return mesh_arrays_to_buffers(mesh_read_arrays(mesh), deduplicate)
@@ -0,0 +1,51 @@
+import numpy as np
+import bpy
+
+from .mesh import MeshBuffers
+from .culling import aabb_corners
+
+# Checks if an object can be merged into a static batch, meaning nothing is expected to move it
+def obj_is_static(obj: bpy.types.Object) -> bool:
+  if obj.mode == 'EDIT' or len(obj.constraints) > 0:
+    return False
+  while obj is not None:
+    anim = obj.animation_data
+    if anim is not None and (anim.action is not None or len(anim.drivers) > 0):
+      return False
+    obj = obj.parent
+  return True
+
+# Merges the triangles of all parts (mesh, material index, world matrix) into one mesh in world-space
+def merge_static_meshes(parts: list[tuple[MeshBuffers, int, np.ndarray]]) -> MeshBuffers:
+  verts, norms, colors, uvs = [], [], [], []
+  for mesh, mat_idx, matrix in parts:
+    idx = mesh.indices.ravel()[mesh.index_offsets[mat_idx]:mesh.index_offsets[mat_idx+1]]
+    mat3 = matrix[:3, :3]
+    norm_mat = np.linalg.pinv(mat3).T # 'pinv' to not fail on objects scaled to zero
+
+    norm = mesh.norm[idx] @ norm_mat.T
+    norm /= np.maximum(np.linalg.norm(norm, axis=1, keepdims=True), 1e-8)
+
+    verts.append(mesh.vert[idx] @ mat3.T + matrix[:3, 3])
+    norms.append(norm)
+    colors.append(mesh.color[idx])
+    uvs.append(mesh.uv[idx])
+
+  vert = np.concatenate(verts).astype(np.float32)
+  count = len(vert)
+
+  if count > 0:
+    bounds = aabb_corners(np.array([vert.min(axis=0), vert.max(axis=0)]))
+  else:
+    bounds = aabb_corners(np.zeros((2, 3), dtype=np.float32))
+
+  return MeshBuffers(
+    vert,
+    np.concatenate(colors).astype(np.float32),
+    np.concatenate(uvs).astype(np.float32),
+    np.concatenate(norms).astype(np.float32),
+    np.arange(count, dtype=np.int32).reshape((-1, 3)),
+    np.array([0, count], dtype=np.int64),
+    bounds,
+    None
+  )
@@ -0,0 +1,81 @@
+import dataclasses
+import hashlib
+import os
+import pathlib
+import shutil
+import tempfile
+import bpy
+import numpy as np
+
+from ..material.parser import f64_material_parse, node_material_parse, get_material_textures
+
+# Bump this whenever the software renderer changes its output, old previews are then ignored
+PREVIEW_CACHE_VERSION = 1
+
+# Hash over everything that affects a material preview: materials (CC, blender, tile, colors, ...),
+# texture pixels, the preview shape and the resolution.
+def preview_hash(depsgraph: bpy.types.Depsgraph, width: int, height: int) -> str:
+  hasher = hashlib.blake2b(digest_size=16)
+  hasher.update(f"{width}x{height}".encode())
+
+  fast64_rs = depsgraph.scene.fast64.renderSettings
+  hasher.update(repr((tuple(fast64_rs.light0Color), tuple(fast64_rs.light1Color), tuple(fast64_rs.ambientColor),
+    tuple(fast64_rs.light0Direction), tuple(fast64_rs.light1Direction))).encode())
+
+  for obj in depsgraph.objects:
+    if obj.type not in {"MESH", "CURVE", "SURFACE", "FONT"} or obj.data is None: continue
+    hasher.update(repr((obj.name, obj.data.name, tuple(map(tuple, obj.matrix_world)))).encode())
+
+    for slot in obj.material_slots:
+      mat = slot.material
+      if mat is None: continue
+      if not (mat.is_f3d and mat.f3d_mat):
+        hasher.update(repr(node_material_parse(mat).color_prim.tolist()).encode())
+        continue
+
+      f64mat = f64_material_parse(mat.f3d_mat, None, upload_textures=False)
+      for field in dataclasses.fields(f64mat):
+        if field.name in ("tex0Buff", "tex1Buff", "tex0_image", "tex1_image"): continue
+        value = getattr(f64mat, field.name)
+        hasher.update(repr(value.tolist() if isinstance(value, np.ndarray) else value).encode())
+
+      for tex in get_material_textures(mat.f3d_mat):
+        if tex is None:
+          hasher.update(b"-")
+          continue
+        image, quantize = tex
+        hasher.update(repr((tuple(image.size), quantize)).encode())
+        # pixels instead of the file state, so images changed outside of blender and reloaded are noticed
+        pixels = np.empty(image.size[0] * image.size[1] * 4, dtype=np.float32)
+        image.pixels.foreach_get(pixels)
+        hasher.update(pixels.data)
+
+  return hasher.hexdigest()
+
+# Rendered previews on disk, one '.npy' file (height x width x 4) per hash
+class PreviewDiskCache:
+  def __init__(self, base_dir: str):
+    self.path = pathlib.Path(base_dir) / "previews" / f"v{PREVIEW_CACHE_VERSION}"
+
+  def load(self, key: str) -> np.ndarray | None:
+    try:
+      return np.load(self.path / f"{key}.npy")
+    except (OSError, ValueError):
+      return None
+
+  def store(self, key: str, pixels: np.ndarray):
+    self.path.mkdir(parents=True, exist_ok=True)
+    # write into a temp. file first, so other blender instances never see partial entries
+    fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+    try:
+      with os.fdopen(fd, "wb") as f:
+        np.save(f, pixels)
+      os.replace(tmp_path, self.path / f"{key}.npy")
+    except OSError as e:
+      print("f64render: failed to write preview cache", e)
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+  # Removes the previews of all versions, nothing else in the base directory
+  def clear(self):
+    shutil.rmtree(self.path.parent, ignore_errors=True)
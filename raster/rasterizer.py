@@ -0,0 +1,292 @@
+from dataclasses import dataclass, replace
+
+import numpy as np
+
+from ..material.parser import F64Material, DRAW_FLAG_DECAL, DRAW_FLAG_ALPHA_BLEND, DRAW_FLAG_TEX0_MONO, DRAW_FLAG_TEX1_MONO
+from ..material.reference import cc_evaluate, blender_evaluate, tex_prepare
+from ..material.variant import G_TF_BILERP
+from .sampler import sample_filtered, sample_point
+
+# Software version of the 3D shaders (main3d.vert.glsl / main3d.frag.glsl), used where no GPU is available.
+# Only numpy is used here, the blender data is read out beforehand (see 'raster/scene.py').
+
+G_PACKED_NORMALS = (1 << 7)
+G_LIGHTING       = (1 << 13)
+G_TEX_GEN        = (1 << 14)
+G_SHADE_SMOOTH   = (1 << 17)
+G_ZS_PRIM        = (1 << 2)
+
+DECAL_DEPTH_DELTA = 100
+DEPTH_NONE = -0xFFFFFF
+CLEAR_COLOR = np.array([8 / 255, 8 / 255, 8 / 255, 0.0], dtype=np.float32) # same as the viewport (0x080808)
+
+# Triangles of one draw after the vertex stage, all in pixel-space of the final image
+@dataclass
+class RasterDraw:
+    pos: np.ndarray # (T, 3, 2) screen position
+    inv_w: np.ndarray # (T, 3) 1/w, also used as depth (same as 'gl_FragCoord.w')
+    ndc: np.ndarray # (T, 3, 2) position in NDC, used for noise
+    shade: np.ndarray # (T, 3, 4)
+    shade_flat: np.ndarray # (T, 4) shade of the provoking vertex
+    uv: np.ndarray # (T, 3, 4) pixel-space UVs of both textures
+    tile_size: np.ndarray # (4,)
+    f64mat: F64Material # values inherited from previous draws already applied
+    ubo: np.void # UBO record of the draw (see 'UBO_DTYPE')
+    tex0: np.ndarray # (height, width, 4) linear, quantized pixels
+    tex1: np.ndarray
+    color: np.ndarray = None # fixed color for non-f3d materials, skips the combiner
+
+EMPTY_TEXTURE = np.zeros((1, 1, 4), dtype=np.float32)
+
+# Applies the values of a UBO record (inherited prim/env/...) to a material, for use with 'cc_evaluate'
+def material_from_ubo(f64mat: F64Material, ubo: np.void) -> F64Material:
+  return replace(f64mat,
+    color_prim=tuple(ubo["prim"]), color_env=tuple(ubo["env"]),
+    ck=tuple(ubo["ck"]), convert=tuple(ubo["convert"]), lod_prim=tuple(ubo["prim_lod"]),
+  )
+
+# CPU version of 'main3d.vert.glsl' for a range of triangles, culled triangles are removed.
+# Triangles crossing the near-plane are clipped, so the result may have more triangles than 'tris'.
+def vertex_stage(
+  vert: np.ndarray, norm: np.ndarray, color: np.ndarray, uv: np.ndarray, tris: np.ndarray,
+  mvp: np.ndarray, mat_norm: np.ndarray, f64mat: F64Material, ubo: np.void,
+  tex0: np.ndarray, tex1: np.ndarray, size: tuple[int, int], cull: str,
+) -> RasterDraw | None:
+  ubo = ubo.copy()
+  geo_mode = int(ubo["modes"][0])
+
+  # lighting (note: like in the shader, the normal is not transformed here)
+  light = np.repeat(ubo["ambient"][None, :3], len(vert), axis=0).astype(np.float32)
+  for i in range(2):
+    strength = np.maximum(norm @ ubo["light_dir"][i, :3], 0.0)
+    light += ubo["light_color"][i, :3] * strength[:, None]
+  light = np.clip(light, 0.0, 1.0)
+
+  shade = color.astype(np.float32, copy=True)
+  if geo_mode & G_LIGHTING:
+    shade[:, :3] = shade[:, :3] * light if (geo_mode & G_PACKED_NORMALS) else light
+  shade = np.clip(shade, 0.0, 1.0)
+
+  # UVs in pixel-space, same steps as in the shader
+  uv_gen = uv
+  if geo_mode & G_TEX_GEN:
+    norm_screen = norm @ mat_norm.T
+    norm_screen /= np.maximum(np.linalg.norm(norm_screen, axis=1, keepdims=True), 1e-12)
+    uv_gen = norm_screen[:, :2] * 0.5 + 0.5
+
+  tile_conf = ubo["tile_conf"]
+  shift, low = tile_conf[4:8], tile_conf[8:12]
+  tex_size = np.array([tex0.shape[1], tex0.shape[0], tex1.shape[1], tex1.shape[0]], dtype=np.float32)
+  uv_px = np.tile(uv_gen * tex_size[:2], 2) # both UV sets use the size of tex0, same as the shader
+  uv_px[:, 1::2] = tex_size[1::2] - uv_px[:, 1::2] - 1
+  uv_px *= shift
+  uv_px[:, 1::2] = tex_size[1::2] - uv_px[:, 1::2] - 1
+  uv_px = uv_px - (shift * 0.5) - low
+  tile_size = np.abs(tile_conf[12:16]) - np.abs(low)
+
+  clip = np.concatenate([vert, np.ones((len(vert), 1), dtype=np.float32)], axis=1).astype(np.float64) @ mvp.T
+
+  # per corner data, clipped against the near-plane before the perspective divide
+  corners = np.concatenate([clip[tris], shade[tris], uv_px[tris]], axis=2)
+  corners, source = _clip_near(corners)
+  clip, shade_tri, uv_tri = corners[:, :, 0:4], corners[:, :, 4:8], corners[:, :, 8:12]
+  shade_flat = shade[tris[source, 2]] # last vertex is the provoking one, kept for the split triangles
+
+  inv_w = 1.0 / clip[:, :, 3]
+  ndc = clip[:, :, :2] * inv_w[:, :, None]
+  pos = (ndc * 0.5 + 0.5) * np.array(size, dtype=np.float64)
+
+  # back-/front-face culling, counter-clockwise is front (y points up)
+  if cull != 'NONE':
+    edge0, edge1 = pos[:, 1] - pos[:, 0], pos[:, 2] - pos[:, 0]
+    area = edge0[:, 0] * edge1[:, 1] - edge0[:, 1] * edge1[:, 0]
+    culled = area < 0 if cull == 'BACK' else area > 0
+    keep = ~culled
+    pos, inv_w, ndc, shade_tri, shade_flat, uv_tri = pos[keep], inv_w[keep], ndc[keep], shade_tri[keep], shade_flat[keep], uv_tri[keep]
+
+  if len(pos) == 0:
+    return None
+
+  return RasterDraw(
+    pos.astype(np.float32), inv_w.astype(np.float32), ndc.astype(np.float32), shade_tri.astype(np.float32),
+    shade_flat, uv_tri.astype(np.float32), tile_size, f64mat, ubo, tex0, tex1,
+  )
+
+NEAR_W = 1e-5 # clip-space W of the plane triangles are clipped against
+
+# Clips triangles against the plane 'w = NEAR_W', 'corners' (T, 3, C) starts with the clip-space position
+# followed by the varyings, new corners are interpolated linearly in clip-space.
+# A triangle with one corner behind the plane is split into two, with two corners behind it gets shortened.
+# The winding and the triangle order are kept, returns the new corners and the source triangle of each.
+def _clip_near(corners: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+  inside = corners[:, :, 3] > NEAR_W
+  inside_count = inside.sum(axis=1)
+  if np.all(inside_count == 3):
+    return corners, np.arange(len(corners))
+
+  # corners rotated to start at 'first', which keeps the winding
+  def rotate(tris: np.ndarray, first: np.ndarray) -> np.ndarray:
+    order = (first[:, None] + np.arange(3)) % 3
+    return corners[tris[:, None], order].transpose(1, 0, 2)
+
+  def intersect(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    dist_p, dist_q = p[:, 3:4] - NEAR_W, q[:, 3:4] - NEAR_W
+    return p + (q - p) * (dist_p / (dist_p - dist_q))
+
+  full = np.nonzero(inside_count == 3)[0]
+
+  one_out = np.nonzero(inside_count == 2)[0] # (out, a, b) -> (out-a, a, b), (out-a, b, b-out)
+  c_out, a, b = rotate(one_out, np.argmin(inside[one_out], axis=1))
+  out_a, b_out = intersect(a, c_out), intersect(b, c_out)
+  split0, split1 = np.stack([out_a, a, b], axis=1), np.stack([out_a, b, b_out], axis=1)
+
+  two_out = np.nonzero(inside_count == 1)[0] # (in, a, b) -> (in, in-a, in-b)
+  c_in, a, b = rotate(two_out, np.argmax(inside[two_out], axis=1))
+  shortened = np.stack([c_in, intersect(c_in, a), intersect(c_in, b)], axis=1)
+
+  source = np.concatenate([full, one_out, one_out, two_out])
+  order = np.argsort(source, kind='stable')
+  return np.concatenate([corners[full], split0, split1, shortened])[order], source[order]
+
+RASTER_CHUNK_PIXELS = 1 << 18 # max. bounding-box pixels of the triangles set up at once, limits memory per tile
+
+# Pixels covered by the given triangles (T, 3, 2) inside a rect, all triangles are set up at once.
+# Returns the triangle index, pixel coords and barycentric weights of each fragment, in triangle order.
+def _rasterize_triangles(pos: np.ndarray, x0: int, y0: int, x1: int, y1: int):
+  bb_min = np.maximum(np.floor(pos.min(axis=1)).astype(np.int64), (x0, y0))
+  bb_max = np.minimum(np.ceil(pos.max(axis=1)).astype(np.int64), (x1, y1))
+  bb_size = np.maximum(bb_max - bb_min, 0)
+
+  a, b, q = pos[:, 0], pos[:, 1], pos[:, 2]
+  area = (b[:, 0] - a[:, 0]) * (q[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (q[:, 0] - a[:, 0])
+  pixel_count = np.where(area != 0.0, bb_size[:, 0] * bb_size[:, 1], 0)
+
+  # one entry per pixel of each bounding-box, rows first (same as a meshgrid per triangle)
+  tri = np.repeat(np.arange(len(pos)), pixel_count)
+  first_pixel = np.cumsum(pixel_count) - pixel_count
+  local = np.arange(len(tri)) - first_pixel[tri]
+  px = bb_min[tri, 0] + local % bb_size[tri, 0]
+  py = bb_min[tri, 1] + local // bb_size[tri, 0]
+  cx, cy = px + 0.5, py + 0.5 # pixel centers
+
+  (ax, ay), (bx, by), (qx, qy), area = a[tri].T, b[tri].T, q[tri].T, area[tri]
+  w0 = ((bx - cx) * (qy - cy) - (by - cy) * (qx - cx)) / area
+  w1 = ((qx - cx) * (ay - cy) - (qy - cy) * (ax - cx)) / area
+  w2 = 1.0 - w0 - w1
+  inside = (w0 >= 0) & (w1 >= 0) & (w2 >= 0)
+
+  bary = np.stack([w0[inside], w1[inside], w2[inside]], axis=1).astype(np.float32)
+  return tri[inside], px[inside], py[inside], bary
+
+# Runs the fragment stage of one draw for a tile, writes into 'color' and 'depth'
+def _draw_tile(draw: RasterDraw, x0: int, y0: int, color: np.ndarray, depth: np.ndarray):
+  x1, y1 = x0 + color.shape[1], y0 + color.shape[0]
+
+  # only triangles overlapping the tile
+  tri_min, tri_max = draw.pos.min(axis=1), draw.pos.max(axis=1)
+  overlap = (tri_max[:, 0] > x0) & (tri_min[:, 0] < x1) & (tri_max[:, 1] > y0) & (tri_min[:, 1] < y1)
+  tri_indices = np.nonzero(overlap)[0]
+  if len(tri_indices) == 0:
+    return
+
+  # large draws are split into chunks, these are resolved one after another so the order is kept
+  bb_size = np.minimum(np.ceil(tri_max[tri_indices]), (x1, y1)) - np.maximum(np.floor(tri_min[tri_indices]), (x0, y0))
+  chunk_ids = np.cumsum(bb_size[:, 0] * bb_size[:, 1]) // RASTER_CHUNK_PIXELS
+  for chunk in np.split(tri_indices, np.nonzero(np.diff(chunk_ids))[0] + 1):
+    tri, fx, fy, bary = _rasterize_triangles(draw.pos[chunk], x0, y0, x1, y1)
+    if len(tri) > 0:
+      _shade_fragments(draw, chunk[tri], fx - x0, fy - y0, bary, color, depth)
+
+# Fragment shader and depth/color resolve for the fragments of one draw (in triangle order)
+def _shade_fragments(draw: RasterDraw, tri: np.ndarray, fx: np.ndarray, fy: np.ndarray, bary: np.ndarray, color: np.ndarray, depth: np.ndarray):
+  # interpolation: 'no_perspective' for shade/NDC, perspective-correct for UVs
+  inv_w = np.sum(draw.inv_w[tri] * bary, axis=1)
+  shade = np.einsum('nk,nkc->nc', bary, draw.shade[tri])
+  ndc = np.einsum('nk,nkc->nc', bary, draw.ndc[tri])
+  bary_persp = bary * draw.inv_w[tri]
+  bary_persp /= np.sum(bary_persp, axis=1, keepdims=True)
+  uv = np.einsum('nk,nkc->nc', bary_persp, draw.uv[tri])
+
+  f64mat = draw.f64mat
+  ubo = draw.ubo
+  flags = int(ubo["modes"][3])
+  geo_mode = int(ubo["modes"][0])
+
+  if draw.color is not None:
+    cc_value = np.repeat(draw.color[None], len(tri), axis=0)
+  else:
+    tile_conf = ubo["tile_conf"]
+    if (int(ubo["modes"][2]) & G_TF_BILERP) == G_TF_BILERP:
+      tex_data0, tex_data1 = sample_filtered(draw.tex0, draw.tex1, uv, tile_conf, draw.tile_size)
+    else:
+      tex_data0, tex_data1 = sample_point(draw.tex0, draw.tex1, uv, tile_conf, draw.tile_size)
+
+    tex_data0 = tex_prepare(tex_data0, (flags & DRAW_FLAG_TEX0_MONO) != 0)
+    tex_data1 = tex_prepare(tex_data1, (flags & DRAW_FLAG_TEX1_MONO) != 0)
+
+    cc_shade = shade if (geo_mode & G_SHADE_SMOOTH) else draw.shade_flat[tri]
+    cc_value = cc_evaluate(f64mat, cc_shade, tex_data0, tex_data1, screen_pos=ndc)
+
+  # depth, see 'color_depth_blending'
+  zs_prim = (int(ubo["modes"][1]) & G_ZS_PRIM) != 0
+  curr_depth = np.full(len(tri), int(ubo["prim_depth"][0]), dtype=np.int64) if zs_prim else (inv_w * 0xFFFFF).astype(np.int64)
+  write_depth = curr_depth.copy()
+  if flags & (DRAW_FLAG_DECAL | DRAW_FLAG_ALPHA_BLEND):
+    write_depth[:] = DEPTH_NONE
+  alpha_failed = cc_value[:, 3] < ubo["light_dir"][0, 3]
+  write_depth[alpha_failed] = DEPTH_NONE
+
+  # Fragments of one pixel are resolved in triangle order, each pass handles at most one fragment per pixel
+  pixel = fy * color.shape[1] + fx
+  remaining = np.arange(len(tri))
+  while len(remaining) > 0:
+    _, first = np.unique(pixel[remaining], return_index=True)
+    frags = remaining[first]
+    remaining = np.delete(remaining, first)
+
+    py, px = fy[frags], fx[frags]
+    old_depth = depth[py, px]
+    depth[py, px] = np.maximum(old_depth, write_depth[frags])
+
+    if flags & DRAW_FLAG_DECAL:
+      depth_diff = np.full(len(frags), ubo["prim_depth"][1]) if zs_prim else np.abs(old_depth - curr_depth[frags])
+      depth_test = depth_diff <= DECAL_DEPTH_DELTA
+    else:
+      depth_test = curr_depth[frags] >= old_depth
+
+    old_color = color[py, px]
+    if draw.color is not None:
+      blended = cc_value[frags]
+    else:
+      blended = blender_evaluate(f64mat, cc_value[frags], old_color, shade[frags])
+
+    discard = alpha_failed[frags] | ~depth_test
+    new_color = np.where(discard[:, None], old_color, blended)
+    new_color[:, 3] = 1.0
+    color[py, px] = np.round(np.clip(np.nan_to_num(new_color), 0.0, 1.0) * 255.0) / 255.0 # 'packUnorm4x8'
+
+# Renders all draws into one tile, returns its RGBA pixels (bottom row first)
+def render_tile(draws: list[RasterDraw], x0: int, y0: int, width: int, height: int) -> np.ndarray:
+  color = np.empty((height, width, 4), dtype=np.float32)
+  color[:] = CLEAR_COLOR
+  depth = np.zeros((height, width), dtype=np.int64)
+  for draw in draws:
+    _draw_tile(draw, x0, y0, color, depth)
+  return color
+
+# Renders the full image by splitting it into tiles, each tile is rendered independently on the given pool.
+# A tile is a handful of large numpy operations per draw which release the GIL, so a thread-pool is enough.
+# 'progress' is called with the number of finished tiles, returning False from it cancels the rest.
+def render_image(draws: list[RasterDraw], width: int, height: int, pool, tile_size: int = 64, progress=None) -> np.ndarray:
+  tiles = [(x, y, min(tile_size, width - x), min(tile_size, height - y))
+    for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+
+  image = np.empty((height, width, 4), dtype=np.float32)
+  futures = [pool.submit(render_tile, draws, *tile) for tile in tiles]
+  for i, ((x, y, w, h), future) in enumerate(zip(tiles, futures)):
+    image[y:y+h, x:x+w] = future.result()
+    if progress is not None and progress(i + 1, len(tiles)) is False:
+      for f in futures: f.cancel()
+      break
+
+  return image
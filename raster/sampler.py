@@ -0,0 +1,73 @@
+import numpy as np
+
+# CPU version of the texture sampling in 'shader/utils.glsl' and 'shader/main3d.frag.glsl'.
+# UVs are in pixel-space with one column pair per texture (N x 4: tex0 S/T, tex1 S/T).
+# Textures are (height, width, 4) arrays with the bottom row first, same as on the GPU.
+
+def _mirror_uv(uv_end: np.ndarray, uv_in: np.ndarray) -> np.ndarray:
+  uv_mod2 = np.mod(uv_in, uv_end * 2.0 + 1.0)
+  return np.where(uv_mod2 >= uv_end, (uv_end * 2.0) - uv_mod2, uv_mod2)
+
+# Applies clamp/mirror/mask of the tile settings, see 'wrappedMirror'
+def wrapped_mirror(tex_size: np.ndarray, uv: np.ndarray, tile_conf: np.ndarray, tile_size: np.ndarray) -> np.ndarray:
+  mask, high = tile_conf[0:4], tile_conf[12:16]
+  mask_abs = np.abs(mask)
+
+  is_clamp = mask <= 1.0
+  is_mirror = high <= 0.0
+  mask_abs = np.where(mask_abs <= 1.0, 256.0, mask_abs) # mask == 0 forces clamping, ignore it then
+
+  uv = uv.astype(np.float32)
+  uv[:, 1::2] = tex_size[1::2] - uv[:, 1::2] # invert Y to have 0,0 in the top-left corner
+
+  uv_clamp = np.clip(uv, 0.0, tile_size)
+  uv = np.trunc(np.where(is_clamp, uv_clamp, uv))
+
+  uv = np.trunc(np.where(is_mirror, _mirror_uv(mask_abs - 0.5, uv), uv))
+
+  uv = np.trunc(np.mod(uv, np.minimum(tex_size + 1, mask_abs)))
+  uv[:, 1::2] = tex_size[1::2] - uv[:, 1::2] # invert Y back
+  return uv.astype(np.int32)
+
+def texel_fetch(texture: np.ndarray, uv: np.ndarray) -> np.ndarray:
+  x = np.clip(uv[:, 0], 0, texture.shape[1] - 1)
+  y = np.clip(uv[:, 1], 0, texture.shape[0] - 1)
+  return texture[y, x]
+
+def _tex_size(tex0: np.ndarray, tex1: np.ndarray) -> np.ndarray:
+  return np.array([tex0.shape[1], tex0.shape[0], tex1.shape[1], tex1.shape[0]], dtype=np.float32) - 1
+
+# Samples both textures with the N64 3-point filter, see 'fetchTex01Filtered'
+def sample_filtered(tex0, tex1, uv, tile_conf, tile_size) -> tuple[np.ndarray, np.ndarray]:
+  tex_size = _tex_size(tex0, tex1)
+  uv0 = np.floor(uv)
+  ratio = uv - uv0
+
+  lower_flag = (ratio[:, [0, 2]] - ratio[:, [1, 3]]) >= 0.0
+  corner = np.stack([lower_flag[:, 0], ~lower_flag[:, 0], lower_flag[:, 1], ~lower_flag[:, 1]], axis=1).astype(np.float32)
+
+  uv1 = wrapped_mirror(tex_size, uv0 + corner, tile_conf, tile_size)
+  uv2 = wrapped_mirror(tex_size, uv0 + 1, tile_conf, tile_size)
+  uv0 = wrapped_mirror(tex_size, uv0, tile_conf, tile_size)
+
+  v0 = -corner
+  v1 = 1.0 - corner
+  v2 = ratio - corner
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    den = v0[:, [0, 3]] * v1[:, [1, 2]] - v1[:, [0, 3]] * v0[:, [1, 2]]
+    lambda1 = np.abs((v2[:, [0, 2]] * v1[:, [1, 3]] - v1[:, [0, 2]] * v2[:, [1, 3]]) / den)
+    lambda2 = np.abs((v0[:, [0, 2]] * v2[:, [1, 3]] - v2[:, [0, 2]] * v0[:, [1, 3]]) / den)
+  lambda0 = 1.0 - lambda1 - lambda2
+
+  tex_data0 = (texel_fetch(tex0, uv1[:, 0:2]) * lambda0[:, 0:1]
+             + texel_fetch(tex0, uv0[:, 0:2]) * lambda1[:, 0:1]
+             + texel_fetch(tex0, uv2[:, 0:2]) * lambda2[:, 0:1])
+  tex_data1 = (texel_fetch(tex1, uv1[:, 2:4]) * lambda0[:, 1:2]
+             + texel_fetch(tex1, uv0[:, 2:4]) * lambda1[:, 1:2]
+             + texel_fetch(tex1, uv2[:, 2:4]) * lambda2[:, 1:2])
+  return tex_data0, tex_data1
+
+def sample_point(tex0, tex1, uv, tile_conf, tile_size) -> tuple[np.ndarray, np.ndarray]:
+  uv0 = wrapped_mirror(_tex_size(tex0, tex1), np.floor(uv + 0.5), tile_conf, tile_size)
+  return texel_fetch(tex0, uv0[:, 0:2]), texel_fetch(tex1, uv0[:, 2:4])
@@ -0,0 +1,115 @@
+import math
+import bpy
+import mathutils
+import numpy as np
+
+from ..material.parser import F64Material, f64_material_parse, node_material_parse, get_material_textures
+from ..material.texture import image_read_pixels
+from ..material.ubo import ubo_build_batch
+from ..mesh.mesh import MeshBuffers, get_mesh_key, mesh_read_arrays, mesh_arrays_to_buffers
+from .rasterizer import RasterDraw, EMPTY_TEXTURE, vertex_stage, material_from_ubo
+
+# Pixels of a material texture ((image, quantization) or None), read once per image and quantization
+def get_texture(tex, textures: dict[tuple, np.ndarray]) -> np.ndarray:
+  if tex is None:
+    return EMPTY_TEXTURE
+  image, quantize = tex
+  if image.size[0] == 0 or image.size[1] == 0: # no pixel data, e.g. the file is missing
+    return EMPTY_TEXTURE
+  key = (image.session_uid, quantize) # names are not unique with linked images
+  if key not in textures:
+    textures[key] = image_read_pixels(image, quantize).reshape((image.size[1], image.size[0], 4))
+  return textures[key]
+
+# Reads out everything needed to render the scene from the camera, this must run on the main thread.
+# Same order and logic as the viewport: opaque draws, transparent draws, then non-f3d objects.
+def build_render_draws(depsgraph: bpy.types.Depsgraph, width: int, height: int) -> list[RasterDraw]:
+  scene = depsgraph.scene
+  camera = scene.camera.evaluated_get(depsgraph) # animated/constrained cameras and lenses
+  fast64_rs = scene.fast64.renderSettings
+  f64render_rs = scene.f64render.render_settings
+
+  view_matrix = camera.matrix_world.inverted()
+  proj_matrix = camera.calc_matrix_camera(depsgraph, x=width, y=height,
+    scale_x=scene.render.pixel_aspect_x, scale_y=scene.render.pixel_aspect_y)
+
+  lightDir0, lightDir1 = fast64_rs.light0Direction, fast64_rs.light1Direction
+  if not fast64_rs.useWorldSpaceLighting:
+    view_rotation = (mathutils.Quaternion((1, 0, 0), math.radians(90.0)) @ view_matrix.to_quaternion()).to_matrix()
+    lightDir0, lightDir1 = lightDir0 @ view_rotation, lightDir1 @ view_rotation
+
+  lightColor = (tuple(fast64_rs.light0Color), tuple(fast64_rs.light1Color))
+  lightDir = (tuple(lightDir0), tuple(lightDir1))
+  ambientColor = tuple(fast64_rs.ambientColor)
+
+  meshes: dict[tuple, MeshBuffers] = {}
+  materials: dict[int, F64Material] = {} # by 'session_uid'
+  textures: dict[tuple, np.ndarray] = {} # by image 'session_uid' + quantization
+  objects = [] # (object, mesh, is f3d)
+  for obj in depsgraph.objects:
+    if obj.type not in {"MESH", "CURVE", "SURFACE", "FONT"} or obj.data is None: continue
+    meshKey = get_mesh_key(obj)
+    if meshKey not in meshes:
+      mesh = obj.evaluated_get(depsgraph).to_mesh()
+      meshes[meshKey] = mesh_arrays_to_buffers(mesh_read_arrays(mesh))
+      obj.to_mesh_clear()
+
+    is_f3d = any(slot.material and slot.material.is_f3d and slot.material.f3d_mat for slot in obj.material_slots)
+    objects.append((obj, meshes[meshKey], is_f3d))
+
+  # collect draws: (object, mesh, material uid, index-offset, index-count)
+  draws = []
+  for layer in range(2):
+    for obj, renderMesh, is_f3d in objects:
+      if not is_f3d: continue
+      for mat_idx, slot in enumerate(obj.material_slots):
+        indices_count = renderMesh.index_offsets[mat_idx+1] - renderMesh.index_offsets[mat_idx]
+        if indices_count == 0 or slot.material is None: continue
+
+        uid = slot.material.session_uid
+        if uid not in materials:
+          materials[uid] = f64_material_parse(slot.material.f3d_mat, None, upload_textures=False)
+        if materials[uid].queue != layer: continue
+        draws.append((obj, renderMesh, slot.material, renderMesh.index_offsets[mat_idx], indices_count))
+
+  mat_list = list(materials.values())
+  mat_index = {uid: i for i, uid in enumerate(materials.keys())}
+  ubo_data = ubo_build_batch(
+    mat_list, np.array([mat_index[draw[2].session_uid] for draw in draws], dtype=np.int32),
+    lightColor, lightDir, ambientColor,
+    tuple(f64render_rs.default_prim_color), tuple(f64render_rs.default_env_color),
+  )
+
+  raster_draws = []
+  for (obj, renderMesh, mat, elem_start, elem_count), ubo in zip(draws, ubo_data):
+    f64mat = materials[mat.session_uid]
+    tex0, tex1 = (get_texture(tex, textures) for tex in get_material_textures(mat.f3d_mat))
+    raster_draw = vertex_stage(
+      renderMesh.vert, renderMesh.norm, renderMesh.color, renderMesh.uv,
+      renderMesh.indices[elem_start // 3:(elem_start + elem_count) // 3],
+      np.array(proj_matrix @ view_matrix @ obj.matrix_world, dtype=np.float32),
+      np.array((view_matrix @ obj.matrix_world).to_3x3().inverted().transposed(), dtype=np.float32),
+      material_from_ubo(f64mat, ubo), ubo, tex0, tex1, (width, height), f64mat.cull,
+    )
+    if raster_draw is not None:
+      raster_draws.append(raster_draw)
+
+  # non-f3d objects are drawn with a single color, like the fallback shader in the viewport
+  fallback_ubo = np.zeros(1, dtype=ubo_data.dtype)[0]
+  fallback_ubo["light_dir"][0, 3] = -1.0 # no alpha clip
+  for obj, renderMesh, is_f3d in objects:
+    if is_f3d: continue
+    f64mat = F64Material()
+    if obj.material_slots and obj.material_slots[0].material:
+      f64mat = node_material_parse(obj.material_slots[0].material)
+
+    raster_draw = vertex_stage(
+      renderMesh.vert, renderMesh.norm, renderMesh.color, renderMesh.uv, renderMesh.indices,
+      np.array(proj_matrix @ view_matrix @ obj.matrix_world, dtype=np.float32),
+      np.eye(3, dtype=np.float32), f64mat, fallback_ubo, EMPTY_TEXTURE, EMPTY_TEXTURE, (width, height), 'NONE',
+    )
+    if raster_draw is not None:
+      raster_draw.color = np.asarray(f64mat.color_prim, dtype=np.float32)
+      raster_draws.append(raster_draw)
+
+  return raster_draws
@@ -1,44 +1,308 @@
 import math
-import struct
 import bpy
+from bpy_extras.io_utils import ExportHelper
 import mathutils
 import gpu
 from .utils.addon import addon_set_fast64_path
+from .utils.profiler import f64render_profiler
 from .mesh.gpu_batch import batch_for_shader
-from .material.parser import F64Material, f64_material_parse, node_material_parse
+from .material.parser import F64Material, node_material_parse, DRAW_FLAG_DECAL, DRAW_FLAG_ALPHA_BLEND
+from .material.cache import MaterialCacheEntry, material_cache_get, material_cache_mark_dirty, material_cache_mark_all_dirty, material_cache_mark_image_dirty, material_cache_prune_textures, material_cache_clear
+from .material.ubo import ubo_build_batch
+from .material.texture import texture_cache_mark_dirty, texture_cache_clear, texture_cache_stats
+from .material.variant import get_variant_key, get_variant_defines
+import os
 import pathlib
+import tempfile
 import time
+import hashlib
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from .mesh.mesh import MeshArrays, MeshBuffers, ObjRenderInfo, get_mesh_key, mesh_read_arrays, mesh_arrays_hash, mesh_arrays_to_buffers
+from .mesh.disk_cache import MeshDiskCache
+from .mesh.cache import MeshCache
+from .mesh.culling import corners_in_frustum
+from .mesh.static_batch import obj_is_static, merge_static_meshes
+from .raster.rasterizer import render_image
+from .raster.scene import build_render_draws
+from .raster.preview import PreviewDiskCache, preview_hash
 
-from .mesh.mesh import MeshBuffers, mesh_to_buffers
-
-f64render_materials_dirty = True
 f64render_instance = None
-f64render_meshCache: dict[MeshBuffers] = {}
+f64render_meshCache = MeshCache() # shared mesh buffers, see 'get_mesh_key'
+f64render_objCache: dict[str, ObjRenderInfo] = {} # per-object state, keyed by object name
+f64render_meshPool: ThreadPoolExecutor = None
+f64render_drawStats = {"draws": 0, "state_changes": 0, "state_changes_saved": 0} # of the last frame
+# static batching: merged world-space meshes per material (keyed by 'session_uid')
+f64render_staticBatches: dict[int, MeshBuffers] = {}
+f64render_staticSignature: tuple = () # names of all objects in the current batches
+f64render_staticMatrices: dict[str, mathutils.Matrix] = {} # world matrix of each object at build time
+f64render_staticExcluded: set[str] = set() # objects that moved, these are drawn on their own from then on
+f64render_staticDirty = True
+f64render_meshPoolSize = 0
+f64render_shaderCache: dict[str, gpu.types.GPUShader] = {} # compiled shaders, see 'get_cached_shader'
+f64render_shaderSources: dict[str, str] = {} # GLSL files by name
+f64render_shaderVariants: dict[tuple, gpu.types.GPUShader] = {} # specialized shaders, see 'get_variant_key'
+f64render_renderTargets: OrderedDict[tuple[int, int], tuple] = OrderedDict() # (depth, color) textures by size, see 'get_render_targets'
+f64render_sceneVersion = 0 # bumped on each depsgraph update, draw lists of older versions are rebuilt
+f64render_drawList = None # view independent part of the last frame, shared by all viewports
+f64render_meshConvertCost = {False: 0.2e-6, True: 1.0e-6} # seconds per triangle corner (non-indexed / indexed), measured during loading
+f64render_userSettings: tuple[str | None, int] = (None, 0) # (disk cache dir if enabled, mesh threads), see 'store_user_settings'
+f64render_imageCount = 0 # number of images in the last frame, a lower count means images got deleted
 current_ucode = None
 
 # N64 is y-up, blender is z-up
 yup_to_zup = mathutils.Quaternion((1, 0, 0), math.radians(90.0)).to_matrix().to_4x4()
 
 MISSING_TEXTURE_COLOR = (0, 0, 0, 1)
-
-UNIFORM_BUFFER_STRUCT = struct.Struct(
-  "8i"              # blender
-  "16f"             # tile settings (mask/shift/low/high)
-  "16i"             # color-combiner settings
-  "i i i i"         # geoMode, other-low, other-high, flags
-  "4f 4f 3f f 3f f" # light (first light direction W is alpha-clip)
-  "4f 4f 4f"        # prim, env, ambient
-  "2f 2f"           # prim_lod, prim-depth
-  "8f 6f"           # ck center/scale, k0-k5,
-)
-
-def cache_del_by_mesh(mesh_name):
+SHADER_VARIANT_COMPILES_PER_FRAME = 1 # compiling blocks the draw, so spread it over multiple frames
+MESH_CONVERT_MIN_CORNERS = 3000 # smaller loads are too noisy to measure the conversion cost
+RENDER_TARGET_POOL_SIZE = 4 # distinct viewport sizes to keep targets for, older ones get freed
+INTERNAL_RESOLUTIONS = {"320x240": (320, 240), "640x480": (640, 480)}
+
+# View independent draw data, built once per scene change and then shared by all viewports.
+# Draws reference 'draw_objs' by index (None for static batches), culling happens per view.
+@dataclass
+class FrameDrawList:
+  key: tuple
+  fallback_objs: list[bpy.types.Object]
+  draw_objs: list[tuple] # (object, mesh-key, mesh, is static)
+  draws: list[tuple] # (object index, mesh, material index, index-offset, index-count) in draw order
+  materials: list[MaterialCacheEntry]
+  ubo_data: np.ndarray # one record per draw, light directions are set per view
+
+# Size the scene is rasterized at, the resolve then scales it up to the whole viewport.
+# Fixed resolutions get stretched to the aspect ratio of the viewport, same as on a widescreen TV.
+def get_internal_resolution(f64render_rs, size_x: int, size_y: int) -> tuple[int, int]:
+  if f64render_rs.internal_resolution == 'SCALE':
+    scale = f64render_rs.resolution_scale
+    return max(1, round(size_x * scale)), max(1, round(size_y * scale))
+  if f64render_rs.internal_resolution in INTERNAL_RESOLUTIONS:
+    res_x, res_y = INTERNAL_RESOLUTIONS[f64render_rs.internal_resolution]
+    return min(res_x, size_x), min(res_y, size_y)
+  return size_x, size_y
+
+# Render targets are shared by all viewports of the same size, each draw clears and resolves them before the next one
+def get_render_targets(size_x: int, size_y: int) -> tuple[gpu.types.GPUTexture, gpu.types.GPUTexture]:
+  key = (size_x, size_y)
+  targets = f64render_renderTargets.get(key)
+  if targets is None:
+    targets = f64render_renderTargets[key] = (
+      gpu.types.GPUTexture(key, format='R32I'),
+      gpu.types.GPUTexture(key, format='R32UI'),
+    )
+    while len(f64render_renderTargets) > RENDER_TARGET_POOL_SIZE:
+      f64render_renderTargets.popitem(last=False)
+  f64render_renderTargets.move_to_end(key)
+  return targets
+
+def cache_del_by_mesh(mesh_uid: int):
   global f64render_meshCache
+  global f64render_objCache
   for key in list(f64render_meshCache.keys()):
-    if f64render_meshCache[key].mesh_name == mesh_name:
+    if f64render_meshCache[key].mesh_uid == mesh_uid:
       del f64render_meshCache[key]
 
+  # material slots are stored in the mesh too, so objects using it need to refresh their state
+  for key in list(f64render_objCache.keys()):
+    if f64render_objCache[key].mesh_key[1] == mesh_uid:
+      del f64render_objCache[key]
+
+# Location of the on-disk mesh cache, by default it's placed next to the blend file
+def get_disk_cache_dir(f64render_rs) -> str:
+  path = f64render_rs.disk_cache_dir
+  if path == "":
+    path = "//f64render_cache" if bpy.data.filepath else os.path.join(tempfile.gettempdir(), "f64render_cache")
+  return bpy.path.abspath(path)
+
+# Material previews are rendered with a scene of their own that only has default settings.
+# The settings needed there are taken from the scene last drawn in a viewport or rendered instead.
+def store_user_settings(scene: bpy.types.Scene):
+  global f64render_userSettings
+  f64render_rs = scene.f64render.render_settings
+  cache_dir = get_disk_cache_dir(f64render_rs) if f64render_rs.use_disk_cache else None
+  f64render_userSettings = (cache_dir, f64render_rs.mesh_workers)
+
+def get_disk_cache(f64render_rs) -> MeshDiskCache | None:
+  if not f64render_rs.use_disk_cache:
+    return None
+  return MeshDiskCache(get_disk_cache_dir(f64render_rs))
+
+# Converts raw mesh data into buffers (or loads them from the disk cache).
+# Only numpy and file access happens here, so this is safe to call from worker threads.
+def convert_mesh(arrays: MeshArrays, indexed: bool, disk_cache: MeshDiskCache | None) -> MeshBuffers:
+  if disk_cache is not None:
+    mesh_hash = mesh_arrays_hash(arrays, b"indexed" if indexed else b"")
+    buffers = disk_cache.load(mesh_hash)
+    if buffers is not None:
+      return buffers
+
+  buffers = mesh_arrays_to_buffers(arrays, indexed)
+  if disk_cache is not None:
+    disk_cache.store(mesh_hash, buffers)
+  return buffers
+
+# Thread-pool for mesh conversions, most of the numpy work releases the GIL.
+# (A process-pool would need to re-launch blender's python and copy all arrays twice)
+def get_mesh_pool(workers: int) -> ThreadPoolExecutor:
+  global f64render_meshPool
+  global f64render_meshPoolSize
+  workers = workers if workers > 0 else (os.cpu_count() or 1)
+  if f64render_meshPool is None or f64render_meshPoolSize != workers:
+    if f64render_meshPool is not None:
+      f64render_meshPool.shutdown(wait=False)
+    f64render_meshPool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="f64render_mesh")
+    f64render_meshPoolSize = workers
+  return f64render_meshPool
+
+def static_batching_update(self, context):
+  global f64render_staticDirty
+  f64render_staticDirty = True
+  f64render_staticExcluded.clear()
+
+# Merges all given objects into one batch per material, these are then drawn in world-space
+def build_static_batches(shader, objects: list[bpy.types.Object]):
+  global f64render_staticBatches
+  parts = {} # material uid -> [(mesh, material index, matrix), ...]
+  f64render_staticMatrices.clear()
+  for obj in objects:
+    renderMesh = f64render_meshCache[f64render_objCache[obj.name].mesh_key]
+    matrix = np.array(obj.matrix_world, dtype=np.float32)
+    f64render_staticMatrices[obj.name] = obj.matrix_world.copy()
+    for mat_idx, slot in enumerate(obj.material_slots):
+      if renderMesh.index_offsets[mat_idx+1] == renderMesh.index_offsets[mat_idx]: continue
+      parts.setdefault(slot.material.session_uid, []).append((renderMesh, mat_idx, matrix))
+
+  f64render_staticBatches = {}
+  for uid, mat_parts in parts.items():
+    staticMesh = f64render_staticBatches[uid] = merge_static_meshes(mat_parts)
+    staticMesh.batch = batch_for_shader(shader,
+      staticMesh.vert,
+      staticMesh.norm,
+      staticMesh.color,
+      staticMesh.uv,
+      staticMesh.indices
+    )
+
+# Returns the order in which to issue the draws, grouped by shader, texture, cull-mode and material.
+# Only plain opaque draws are sorted, decals and blending depend on what was drawn before them.
+# Those (and the transparent layer) follow afterwards in their original order.
+def sort_draws(draws: list[tuple], materials: list[MaterialCacheEntry], mat_shaders: list[gpu.types.GPUShader]) -> list[int]:
+  sortable, fixed_opaque, fixed_transparent = [], [], []
+  for i, draw in enumerate(draws):
+    f64mat = materials[draw[2]].f64mat
+    if f64mat.queue != 0:
+      fixed_transparent.append(i)
+    elif f64mat.flags & (DRAW_FLAG_DECAL | DRAW_FLAG_ALPHA_BLEND):
+      fixed_opaque.append(i)
+    else:
+      sortable.append(i)
+
+  def state_key(i):
+    matrices, _, mat_idx, _, _ = draws[i]
+    f64mat = materials[mat_idx].f64mat
+    return (id(mat_shaders[mat_idx]), id(f64mat.tex0Buff), id(f64mat.tex1Buff), f64mat.cull, mat_idx, id(matrices))
+
+  sortable.sort(key=state_key)
+  return sortable + fixed_opaque + fixed_transparent
+
+# Reads a file from the 'shader' directory, sources are only read from disk once
+def read_shader_file(name: str) -> str:
+  source = f64render_shaderSources.get(name)
+  if source is None:
+    shaderPath = (pathlib.Path(__file__).parent / "shader").resolve()
+    with open(shaderPath / name, "r", encoding="utf-8") as f:
+      source = f64render_shaderSources[name] = f.read()
+  return source
+
+# Returns the compiled shader for the given sources (+ defines), 'create' is only called if it wasn't compiled before
+def get_cached_shader(sources: tuple[str, ...], create) -> gpu.types.GPUShader:
+  key = hashlib.blake2b("\0".join(sources).encode(), digest_size=16).hexdigest()
+  shader = f64render_shaderCache.get(key)
+  if shader is None:
+    print("Compiling shader")
+    shader = f64render_shaderCache[key] = create()
+  return shader
+
+# 'defines' are used for specialized variants, see 'material/variant.py'
+def create_shader_3d(shaderVert: str, shaderFrag: str, shaderStructs: str, interlock: bool, defines: dict[str, str] = None) -> gpu.types.GPUShader:
+  shader_info = gpu.types.GPUShaderCreateInfo()
+  shader_info.typedef_source(shaderStructs)
+
+  # vertex -> fragment
+  vert_out = gpu.types.GPUStageInterfaceInfo("vert_interface")
+  vert_out.no_perspective("VEC4", "cc_shade")
+  vert_out.flat("VEC4", "cc_shade_flat")
+  vert_out.smooth("VEC4", "uv")
+  vert_out.no_perspective("VEC2", "posScreen")
+  vert_out.flat("VEC4", "tileSize")
+
+  shader_info.define("depth_unchanged", "depth_any")
+
+  if interlock:
+    shader_info.define("USE_SHADER_INTERLOCK", "1")
+
+  for name, value in (defines or {}).items():
+    shader_info.define(name, value)
+
+  shader_info.push_constant("MAT4", "matMVP")
+  shader_info.push_constant("MAT3", "matNorm")
+
+  shader_info.uniform_buf(0, "UBO_Material", "material")
+
+  shader_info.vertex_in(0, "VEC3", "pos") # keep blenders name keep for better compat.
+  shader_info.vertex_in(1, "VEC3", "inNormal")
+  shader_info.vertex_in(2, "VEC4", "inColor")
+  shader_info.vertex_in(3, "VEC2", "inUV")
+  shader_info.vertex_out(vert_out)
+
+  shader_info.sampler(0, "FLOAT_2D", "tex0")
+  shader_info.sampler(1, "FLOAT_2D", "tex1")
+
+  shader_info.image(2, 'R32UI', "UINT_2D_ATOMIC", "color_texture", qualifiers={"READ", "WRITE"})
+  shader_info.image(3, 'R32I',  "INT_2D_ATOMIC",  "depth_texture", qualifiers={"READ", "WRITE"})
+
+  shader_info.fragment_out(0, "VEC4", "FragColor")
+
+  shader_info.vertex_source(shaderVert)
+  shader_info.fragment_source(shaderFrag)
+
+  return gpu.shader.create_from_info(shader_info)
+
+SHADER_2D_VERT = """
+  void main() {
+    gl_Position = vec4(pos, 0.0, 1.0);
+    uv = pos.xy * 0.5 + 0.5;
+  }"""
+
+SHADER_2D_FRAG = """
+  void main() {
+    ivec2 textureSize2d = imageSize(color_texture);
+    ivec2 coord = ivec2(uv.xy * vec2(textureSize2d)); 
+    FragColor =  unpackUnorm4x8(imageLoad(color_texture, coord).r);
+    gl_FragDepth = 0.99999;
+  }"""
+
+# 2D shader (offscreen to viewport)
+def create_shader_2d() -> gpu.types.GPUShader:
+  shader_info = gpu.types.GPUShaderCreateInfo()
+  vert_out = gpu.types.GPUStageInterfaceInfo("vert_2d")
+  vert_out.smooth("VEC2", "uv")
+
+  # Hacky workaround for blender forcing an early depth test ('layout(depth_unchanged) out float gl_FragDepth;')
+  shader_info.define("depth_unchanged", "depth_any")
+  shader_info.image(2, 'R32UI', "UINT_2D_ATOMIC", "color_texture", qualifiers={"READ"})
+
+  shader_info.fragment_out(0, "VEC4", "FragColor")
+  shader_info.vertex_in(0, "VEC2", "pos")
+  shader_info.vertex_out(vert_out)
+
+  shader_info.vertex_source(SHADER_2D_VERT)
+  shader_info.fragment_source(SHADER_2D_FRAG)
+  return gpu.shader.create_from_info(shader_info)
+
 def obj_has_f3d_materials(obj):
   for slot in obj.material_slots:
     if slot.material.is_f3d and slot.material.f3d_mat:
@@ -48,7 +312,7 @@ def obj_has_f3d_materials(obj):
 class Fast64RenderEngine(bpy.types.RenderEngine):
   bl_idname = "FAST64_RENDER_ENGINE"
   bl_label = "Fast64 Renderer"
-  bl_use_preview = False
+  bl_use_preview = True
 
   def __init__(self):
     super().__init__()
@@ -56,180 +320,394 @@ class Fast64RenderEngine(bpy.types.RenderEngine):
 
     self.shader = None
     self.shader_fallback = None
+    self.shader_2d = None
+    self.shader_sources: tuple[str, str, str] = None # vertex, fragment, structs
+    self.batch_2d = None # fullscreen quad for the final resolve
     self.draw_handler = None
     self.last_ucode = None
-
-    self.time_count = 0
-    self.time_total = 0
         
+    # GPU resources are created on the first viewport draw, final renders (e.g. in background mode) don't use the GPU
     self.depth_texture: gpu.types.GPUTexture = None
     self.color_texture: gpu.types.GPUTexture = None
-    self.update_render_size(128, 128)
+    self.shader_interlock_support = False
     bpy.app.handlers.depsgraph_update_post.append(Fast64RenderEngine.mesh_change_listener)
 
     if "f64render_missing_texture" not in bpy.data.images:
       # Create a 1x1 image
       bpy.data.images.new("f64render_missing_texture", 1, 1).pixels = MISSING_TEXTURE_COLOR
 
-    ext_list = gpu.capabilities.extensions_get()
-    self.shader_interlock_support = 'GL_ARB_fragment_shader_interlock' in ext_list
-    if not self.shader_interlock_support:
-      print("\n\nWarning: GL_ARB_fragment_shader_interlock not supported!\n\n")
-
   def __del__(self):
     if Fast64RenderEngine.mesh_change_listener in bpy.app.handlers.depsgraph_update_post:
       bpy.app.handlers.depsgraph_update_post.remove(Fast64RenderEngine.mesh_change_listener)
     pass
   
   def update_render_size(self, size_x, size_y):
-    if not self.depth_texture or size_x != self.depth_texture.width or size_y != self.depth_texture.height:
-      self.depth_texture = gpu.types.GPUTexture((size_x, size_y), format='R32I')
-      self.color_texture = gpu.types.GPUTexture((size_x, size_y), format='R32UI')
+    self.depth_texture, self.color_texture = get_render_targets(size_x, size_y)
 
   def init_shader(self):
     if not self.shader:
-      print("Compiling shader")
-
-      shaderPath = (pathlib.Path(__file__).parent / "shader").resolve()
-      shaderVert = ""
-      shaderFrag = ""
-
-      with open(shaderPath / "utils.glsl", "r", encoding="utf-8") as f:
-        shaderUtils = f.read()
-        shaderVert += shaderUtils
-        shaderFrag += shaderUtils
-
-      with open(shaderPath / "defines.glsl", "r", encoding="utf-8") as f:
-        shaderDef = f.read()
-        shaderVert += shaderDef
-        shaderFrag += shaderDef
-
-      with open(shaderPath / "main3d.vert.glsl", "r", encoding="utf-8") as f:
-        shaderVert += f.read()
-
-      with open(shaderPath / "main3d.frag.glsl", "r", encoding="utf-8") as f:
-        shaderFrag += f.read()
-
-      shader_info = gpu.types.GPUShaderCreateInfo()
-      
-      with open(shaderPath / "structs.glsl", "r", encoding="utf-8") as f:
-        shader_info.typedef_source(f.read())
-      
-      # vertex -> fragment
-      vert_out = gpu.types.GPUStageInterfaceInfo("vert_interface")
-      vert_out.no_perspective("VEC4", "cc_shade")
-      vert_out.flat("VEC4", "cc_shade_flat")
-      vert_out.smooth("VEC4", "uv")
-      vert_out.no_perspective("VEC2", "posScreen")
-      vert_out.flat("VEC4", "tileSize")
-
-      shader_info.define("depth_unchanged", "depth_any")
-
-      if self.shader_interlock_support:
-        shader_info.define("USE_SHADER_INTERLOCK", "1")
-
-      shader_info.push_constant("MAT4", "matMVP")
-      shader_info.push_constant("MAT3", "matNorm")
-
-      shader_info.uniform_buf(0, "UBO_Material", "material")
-      
-      shader_info.vertex_in(0, "VEC3", "pos") # keep blenders name keep for better compat.
-      shader_info.vertex_in(1, "VEC3", "inNormal")
-      shader_info.vertex_in(2, "VEC4", "inColor")
-      shader_info.vertex_in(3, "VEC2", "inUV")
-      shader_info.vertex_out(vert_out)
-      
-      shader_info.sampler(0, "FLOAT_2D", "tex0")
-      shader_info.sampler(1, "FLOAT_2D", "tex1")
-      
-      shader_info.image(2, 'R32UI', "UINT_2D_ATOMIC", "color_texture", qualifiers={"READ", "WRITE"})
-      shader_info.image(3, 'R32I',  "INT_2D_ATOMIC",  "depth_texture", qualifiers={"READ", "WRITE"})
-
-      shader_info.fragment_out(0, "VEC4", "FragColor")
-
-      shader_info.vertex_source(shaderVert)
-      shader_info.fragment_source(shaderFrag)
-      
-      self.shader = gpu.shader.create_from_info(shader_info)      
+      ext_list = gpu.capabilities.extensions_get()
+      self.shader_interlock_support = 'GL_ARB_fragment_shader_interlock' in ext_list
+      if not self.shader_interlock_support:
+        print("\n\nWarning: GL_ARB_fragment_shader_interlock not supported!\n\n")
+
+      shaderUtils = read_shader_file("utils.glsl")
+      shaderDef = read_shader_file("defines.glsl")
+      shaderVert = shaderUtils + shaderDef + read_shader_file("main3d.vert.glsl")
+      shaderFrag = shaderUtils + shaderDef + read_shader_file("main3d.frag.glsl")
+      shaderStructs = read_shader_file("structs.glsl")
+      interlock = "1" if self.shader_interlock_support else ""
+
+      self.shader_sources = (shaderVert, shaderFrag, shaderStructs)
+      self.shader = get_cached_shader((*self.shader_sources, interlock),
+        lambda: create_shader_3d(*self.shader_sources, self.shader_interlock_support))
       self.shader_fallback = gpu.shader.from_builtin('UNIFORM_COLOR')
-
-      # 2D shader (offscreen to viewport)
-      shader_info = gpu.types.GPUShaderCreateInfo()
-      vert_out = gpu.types.GPUStageInterfaceInfo("vert_2d")
-      vert_out.smooth("VEC2", "uv")
-
-      # Hacky workaround for blender forcing an early depth test ('layout(depth_unchanged) out float gl_FragDepth;')
-      shader_info.define("depth_unchanged", "depth_any")
-      shader_info.image(2, 'R32UI', "UINT_2D_ATOMIC", "color_texture", qualifiers={"READ"})
-
-      shader_info.fragment_out(0, "VEC4", "FragColor")
-      shader_info.vertex_in(0, "VEC2", "pos")
-      shader_info.vertex_out(vert_out)
-
-      shader_info.vertex_source("""
-        void main() {
-          gl_Position = vec4(pos, 0.0, 1.0);
-          uv = pos.xy * 0.5 + 0.5;
-        }""")
-      
-      shader_info.fragment_source("""
-        void main() {
-          ivec2 textureSize2d = imageSize(color_texture);
-          ivec2 coord = ivec2(uv.xy * vec2(textureSize2d)); 
-          FragColor =  unpackUnorm4x8(imageLoad(color_texture, coord).r);
-          gl_FragDepth = 0.99999;
-        }""")
-      
-      self.shader_2d = gpu.shader.create_from_info(shader_info)                             
+      self.shader_2d = get_cached_shader((SHADER_2D_VERT, SHADER_2D_FRAG), create_shader_2d)
+
+    if not self.batch_2d:
+      vbo_2d = gpu.types.GPUVertBuf(self.shader_2d.format_calc(), 6)
+      vbo_2d.attr_fill("pos", [(-1, -1), (-1, 1), (1, 1), (1, 1), (1, -1), (-1, -1)])
+      self.batch_2d = gpu.types.GPUBatch(type="TRIS", buf=vbo_2d)
+
+  # Returns the shader for each material, this is the uber-shader unless a specialized variant exists.
+  # Only a few variants are compiled per frame, materials without one stay on the uber-shader until then.
+  def get_material_shaders(self, materials: list[MaterialCacheEntry]) -> list[gpu.types.GPUShader]:
+    mat_shaders = [self.shader] * len(materials)
+    compiles_left = SHADER_VARIANT_COMPILES_PER_FRAME
+    for i, matEntry in enumerate(materials):
+      key = get_variant_key(matEntry.f64mat)
+      shader = f64render_shaderVariants.get(key)
+      if shader is None:
+        if compiles_left == 0:
+          self.tag_redraw()
+          continue
+        compiles_left -= 1
+        defines = get_variant_defines(key)
+        interlock = "1" if self.shader_interlock_support else ""
+        shader = f64render_shaderVariants[key] = get_cached_shader(
+          (*self.shader_sources, interlock, *(f"{name}={value}" for name, value in defines.items())),
+          lambda: create_shader_3d(*self.shader_sources, self.shader_interlock_support, defines)
+        )
+      mat_shaders[i] = shader
+    return mat_shaders
 
   def mesh_change_listener(scene, depsgraph):
     global f64render_meshCache
-    global f64render_materials_dirty
+    global f64render_objCache
     global current_ucode
+    global f64render_staticDirty
+    global f64render_sceneVersion
     # print("################ MESH CHANGE LISTENER ################")  
+    f64render_sceneVersion += 1
 
     if depsgraph.id_type_updated('SCENE'):
       if current_ucode != depsgraph.scene.f3d_type:
-        f64render_materials_dirty = True
+        material_cache_mark_all_dirty()
         current_ucode = depsgraph.scene.f3d_type
 
     if depsgraph.id_type_updated('MATERIAL'):
       for update in depsgraph.updates:
-        # this seems to trigger for all materials if only one changed (@TODO: check if i can get proper updates)
-        f64render_materials_dirty = True
+        # only bump the changed materials, anything using them will be parsed again on the next draw
+        if isinstance(update.id, bpy.types.Material):
+          material_cache_mark_dirty(update.id)
+
+    if depsgraph.id_type_updated('IMAGE'):
+      for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Image):
+          texture_cache_mark_dirty(update.id)
+          material_cache_mark_image_dirty(update.id.session_uid)
 
     if depsgraph.id_type_updated('OBJECT'):
       for update in depsgraph.updates:
         if isinstance(update.id, bpy.types.Object) and update.id.type in {"MESH", "CURVE", "SURFACE", "FONT"}:
-          cache_del_by_mesh(update.id.data.name)
+          # moving an object only changes its matrix, which is read each frame anyway
+          if update.is_updated_geometry:
+            cache_del_by_mesh(update.id.data.session_uid)
+            f64render_staticDirty = True
+          elif not update.is_updated_transform: # e.g. material slots changed
+            f64render_objCache.pop(update.id.name, None)
+            f64render_staticDirty = True
 
   def view_update(self, context, depsgraph):
+    global f64render_sceneVersion
     if self.draw_handler is None:
       self.draw_handler = bpy.types.SpaceView3D.draw_handler_add(self.draw_scene, (context, depsgraph), 'WINDOW', 'POST_VIEW')
 
     # this causes the mesh to update during edit-mode
     for obj in depsgraph.objects:
       if obj.type == 'MESH' and obj.mode == 'EDIT':
-        meshID = obj.name + "#" + obj.data.name
-        if meshID in f64render_meshCache:
-          del f64render_meshCache[meshID]
+        meshKey = get_mesh_key(obj)
+        if meshKey in f64render_meshCache:
+          del f64render_meshCache[meshKey]
+          f64render_sceneVersion += 1
+
+  # Final render (F12 / command-line), done entirely on the CPU so it also works without a GPU
+  def render(self, depsgraph):
+    scene = depsgraph.scene
+    if scene.camera is None:
+      self.report({'ERROR'}, "No camera in scene")
+      return
+
+    scale = scene.render.resolution_percentage / 100
+    width, height = int(scene.render.resolution_x * scale), int(scene.render.resolution_y * scale)
+
+    if self.is_preview:
+      cache_dir, mesh_workers = f64render_userSettings
+    else:
+      store_user_settings(scene)
+      mesh_workers = scene.f64render.render_settings.mesh_workers
+
+    # material previews only depend on the material itself, so they are cached on disk across files (if enabled)
+    preview_cache = preview_key = None
+    if self.is_preview and cache_dir is not None:
+      preview_cache = PreviewDiskCache(cache_dir)
+      preview_key = preview_hash(depsgraph, width, height)
+      pixels = preview_cache.load(preview_key)
+      if pixels is not None and pixels.shape == (height, width, 4):
+        self.write_result(pixels, width, height)
+        return
+
+    self.update_stats("", "f64render: preparing scene")
+    draws = build_render_draws(depsgraph, width, height)
+
+    def progress(done: int, total: int) -> bool:
+      self.update_progress(done / total)
+      self.update_stats("", f"f64render: tile {done}/{total}")
+      return not self.test_break()
+
+    pixels = render_image(draws, width, height, get_mesh_pool(mesh_workers), progress=progress)
+    if not scene.render.film_transparent:
+      pixels[:, :, 3] = 1.0
+
+    if preview_cache is not None and not self.test_break():
+      preview_cache.store(preview_key, pixels)
+    self.write_result(pixels, width, height)
+
+  def write_result(self, pixels: np.ndarray, width: int, height: int):
+    result = self.begin_result(0, 0, width, height)
+    result.layers[0].passes["Combined"].rect = pixels.reshape((-1, 4))
+    self.end_result(result)
+
+  # Everything that doesn't depend on the view: visible objects, mesh conversion, static batches,
+  # materials and UBOs of all draws (before culling). The result is shared by all viewports.
+  def build_draw_list(self, depsgraph, space_view_3d, key: tuple) -> FrameDrawList:
+    global f64render_staticBatches
+    global f64render_staticSignature
+    global f64render_staticDirty
+
+    prof = f64render_profiler
+    f64render_rs: F64RenderSettings = depsgraph.scene.f64render.render_settings
+
+    prof.start("gather")
+    # get hidden objects, this cannot be done in despgraph objects for whatever reason
+    hidden_obj = {ob.name for ob in bpy.context.view_layer.objects if not ob.visible_get() and ob.data is not None}
+
+    pending_meshes = {} # meshKey -> (mesh uid, raw arrays), converted once all objects are visited
+    use_static = f64render_rs.use_static_batching
+    static_candidates = []
+    # anything over the time budget is deferred to the next redraw, so the viewport never freezes for long.
+    # This includes the conversion after the loop, which is estimated from the cost measured in previous loads.
+    load_budget = f64render_rs.mesh_load_budget / 1000
+    load_start = time.perf_counter()
+    load_deferred = False
+    indexed = f64render_rs.use_indexed_meshes
+    convert_estimate = 0.0
+    convert_corners = 0
+    fallback_objs = []
+    visible_objs = [] # all visible objects with f3d materials, in depsgraph order
+    for obj in depsgraph.objects:
+      if obj.type in {"MESH", "CURVE", "SURFACE", "FONT"} and obj.data is not None:
+        # don't convert what can't be seen, otherwise the cache would fill up with hidden meshes
+        if space_view_3d.local_view and not obj.local_view_get(space_view_3d): continue
+        if obj.name in hidden_obj: continue
+
+        meshKey = get_mesh_key(obj)
+        mat_count = len(obj.material_slots)
+
+        # check for objects that changed their mesh or material slots (e.g. transitioned from non-f3d to f3d materials)
+        objInfo = f64render_objCache.get(obj.name)
+        if objInfo is not None and (objInfo.mesh_key != meshKey or objInfo.mat_count != mat_count):
+          del f64render_objCache[obj.name]
+            
+        # Mesh not cached: parse & convert mesh data, then prepare a GPU batch
+        # (only the blender data is read here, the conversion itself happens in parallel below)
+        if meshKey not in pending_meshes and f64render_meshCache.get(meshKey) is None:
+          if load_budget > 0 and len(pending_meshes) > 0 and (time.perf_counter() - load_start + convert_estimate) > load_budget:
+            load_deferred = True
+            continue
+          # print("    -> Update mesh", meshKey)
+          prof.start("mesh conversion")
+          if obj.mode == 'EDIT':
+            mesh = obj.evaluated_get(depsgraph).to_mesh()
+          else:
+            mesh = obj.evaluated_get(depsgraph).to_mesh(preserve_all_data_layers=True, depsgraph=depsgraph)
+
+          arrays = mesh_read_arrays(mesh)
+          pending_meshes[meshKey] = (obj.data.session_uid, arrays)
+          obj.to_mesh_clear()
+          convert_corners += len(arrays.tri_verts)
+          convert_estimate = convert_corners * f64render_meshConvertCost[indexed]
+          prof.stop("mesh conversion")
+
+        # Object state not cached: the mesh can be shared, but the material slots are per object
+        if obj.name not in f64render_objCache:
+          f64render_objCache[obj.name] = ObjRenderInfo(meshKey, mat_count)
+        
+        if not obj_has_f3d_materials(obj):
+          fallback_objs.append(obj)
+          continue
+
+        visible_objs.append(obj)
+        if use_static and obj.name not in f64render_staticExcluded and obj_is_static(obj):
+          static_candidates.append(obj)
+    prof.stop("gather")
+
+    prof.start("mesh conversion")
+    if len(pending_meshes) > 0:
+      convert_start = time.perf_counter()
+      diskCache = get_disk_cache(f64render_rs)
+      mesh_args = [(arrays, indexed, diskCache) for _, arrays in pending_meshes.values()]
+      if len(pending_meshes) > 1:
+        results = get_mesh_pool(f64render_rs.mesh_workers).map(convert_mesh, *zip(*mesh_args))
+      else:
+        results = [convert_mesh(*mesh_args[0])]
+
+      # GPU uploads can only happen here on the main thread
+      for (meshKey, (mesh_uid, _)), renderMesh in zip(pending_meshes.items(), results):
+        renderMesh.mesh_uid = mesh_uid
+        renderMesh.batch = batch_for_shader(self.shader,
+          renderMesh.vert,
+          renderMesh.norm,
+          renderMesh.color,
+          renderMesh.uv,
+          renderMesh.indices
+        )
+        f64render_meshCache[meshKey] = renderMesh
+
+      # wall-clock time including uploads and disk cache hits, so the estimate follows what loading actually costs
+      if convert_corners >= MESH_CONVERT_MIN_CORNERS:
+        cost = (time.perf_counter() - convert_start) / convert_corners
+        f64render_meshConvertCost[indexed] = (f64render_meshConvertCost[indexed] + cost) * 0.5
+    prof.stop("mesh conversion")
+    prof.count("meshes converted", len(pending_meshes))
+
+    prof.start("gather")
+    # (Re-)build static batches if any object in them changed, got added or removed
+    static_objs = set()
+    if use_static:
+      static_list = []
+      for obj in static_candidates:
+        if f64render_objCache[obj.name].mesh_key not in f64render_meshCache: continue # deferred
+        built_matrix = f64render_staticMatrices.get(obj.name)
+        if built_matrix is not None and built_matrix != obj.matrix_world:
+          f64render_staticExcluded.add(obj.name) # got moved, don't rebuild every time this happens
+          continue
+        static_list.append(obj)
+
+      signature = tuple(obj.name for obj in static_list)
+      if f64render_staticDirty or signature != f64render_staticSignature:
+        build_static_batches(self.shader, static_list)
+        f64render_staticSignature = signature
+        f64render_staticDirty = False
+      static_objs = set(signature)
+
+    elif len(f64render_staticBatches) > 0:
+      f64render_staticBatches = {}
+      f64render_staticSignature = ()
+      f64render_staticMatrices.clear()
+
+    # Resolve meshes once, both layers below only walk over this list
+    draw_objs = [] # (object, mesh-key, mesh, is static)
+    for obj in visible_objs:
+      meshKey = f64render_objCache[obj.name].mesh_key
+      if meshKey not in f64render_meshCache: continue # deferred
+      draw_objs.append((obj, meshKey, f64render_meshCache[meshKey], obj.name in static_objs))
+
+    # Collect all draws, opaque objects first, then transparent ones
+    draws = [] # (object index, mesh, material index, index-offset, index-count) in draw order
+    materials = [] # each used material once
+    material_idx = {} # id of a material cache entry -> index in 'materials'
+    static_emitted = set() # materials whose static batch was already added to the draws
+    for layer in range(2):
+      for obj_idx, (obj, _, renderMesh, is_static) in enumerate(draw_objs):
+        # static objects are drawn via the merged batch of each material, where the first object using it is
+        if is_static:
+          for slot in obj.material_slots:
+            uid = slot.material.session_uid
+            staticMesh = f64render_staticBatches.get(uid)
+            if staticMesh is None or uid in static_emitted: continue
+
+            matEntry = material_cache_get(slot.material)
+            if matEntry.f64mat.queue != layer: continue
+            static_emitted.add(uid)
+
+            draw_mat_idx = material_idx.get(id(matEntry))
+            if draw_mat_idx is None:
+              draw_mat_idx = material_idx[id(matEntry)] = len(materials)
+              materials.append(matEntry)
+
+            draws.append((None, staticMesh, draw_mat_idx, 0, staticMesh.index_offsets[1]))
+          continue
+
+        for mat_idx, slot in enumerate(obj.material_slots):
+          indices_count = renderMesh.index_offsets[mat_idx+1] - renderMesh.index_offsets[mat_idx]
+          if indices_count == 0: # ignore unused materials
+            continue
+          
+          matEntry = material_cache_get(slot.material)
+          if matEntry.f64mat.queue != layer: # skip if not in current layer
+            continue
+
+          draw_mat_idx = material_idx.get(id(matEntry))
+          if draw_mat_idx is None:
+            draw_mat_idx = material_idx[id(matEntry)] = len(materials)
+            materials.append(matEntry)
+
+          draws.append((obj_idx, renderMesh, draw_mat_idx, renderMesh.index_offsets[mat_idx], indices_count))
+
+    prof.stop("gather")
+
+    # UBOs of all draws, this resolves the prim/env/... values inherited from previous draws.
+    # Culled draws are included as well, so the inherited values don't depend on the view.
+    with prof.scope("ubo pack"):
+      fast64_rs = depsgraph.scene.fast64.renderSettings
+      ubo_data = ubo_build_batch(
+        [entry.f64mat for entry in materials], np.array([draw[2] for draw in draws], dtype=np.int32),
+        (tuple(fast64_rs.light0Color), tuple(fast64_rs.light1Color)),
+        (tuple(fast64_rs.light0Direction), tuple(fast64_rs.light1Direction)),
+        tuple(fast64_rs.ambientColor),
+        tuple(f64render_rs.default_prim_color), tuple(f64render_rs.default_env_color),
+      )
+
+    draw_list = FrameDrawList(key, fallback_objs, draw_objs, draws, materials, ubo_data)
+    if load_deferred: # incomplete, the next redraw has to continue loading
+      self.tag_redraw()
+      draw_list.key = None
+    return draw_list
 
   def view_draw(self, context, depsgraph):
     self.draw_scene(context, depsgraph)
 
   def draw_scene(self, context, depsgraph):
     global f64render_meshCache
-    global f64render_materials_dirty
+    global f64render_objCache
+    global f64render_drawList
+    global f64render_imageCount
     
     # TODO: fixme, after reloading this script during dev, something calls this function
     #       with an invalid reference (viewport?)
     if repr(self).endswith("invalid>"):
         return
 
-    t = time.process_time()
+    prof = f64render_profiler
+    prof.enabled = depsgraph.scene.f64render.render_settings.use_profiler
+    prof.begin_frame()
+    cache_hits, cache_misses = f64render_meshCache.hits, f64render_meshCache.misses
 
     space_view_3d = context.space_data
-    self.update_render_size(context.region.width, context.region.height)
+    f64render_rs: F64RenderSettings = depsgraph.scene.f64render.render_settings
+    store_user_settings(depsgraph.scene)
+    self.update_render_size(*get_internal_resolution(f64render_rs, context.region.width, context.region.height))
     self.color_texture.clear(format='UINT', value=[0x080808])
     self.depth_texture.clear(format='INT', value=[0])
 
@@ -242,221 +720,204 @@ class Fast64RenderEngine(bpy.types.RenderEngine):
 
     # global params
     fast64_rs = depsgraph.scene.fast64.renderSettings
-    f64render_rs: F64RenderSettings = depsgraph.scene.f64render.render_settings
     lightDir0, lightDir1 = fast64_rs.light0Direction, fast64_rs.light1Direction
     if not fast64_rs.useWorldSpaceLighting:
       view_rotation = (mathutils.Quaternion((1, 0, 0), math.radians(90.0)) @ context.region_data.view_matrix.to_quaternion()).to_matrix()
       lightDir0, lightDir1 = lightDir0 @ view_rotation, lightDir1 @ view_rotation
 
     # Note: space conversion to Y-up happens indirectly during the normal matrix calculation
-    lightColor0 = fast64_rs.light0Color
-    lightColor1 = fast64_rs.light1Color
-    ambientColor = fast64_rs.ambientColor
+    lightDir = (tuple(lightDir0), tuple(lightDir1))
+
+    # the draw list only changes with the scene (or local view), all other viewports reuse it
+    draw_list_key = (f64render_sceneVersion, depsgraph.as_pointer(), space_view_3d.as_pointer() if space_view_3d.local_view else None)
+    draw_list = f64render_drawList
+    if draw_list is None or draw_list.key != draw_list_key:
+      draw_list = f64render_drawList = self.build_draw_list(depsgraph, space_view_3d, draw_list_key)
+    else:
+      prof.count("draw lists reused")
+
+    prof.start("culling")
+    region_data = context.region_data
+    static_matrices = (region_data.perspective_matrix, region_data.view_matrix.to_3x3().inverted().transposed())
+    static_mvp = np.array(static_matrices[0], dtype=np.float32)
+
+    # matrices of each object, 'None' if outside the view
+    obj_matrices = []
+    for obj, meshKey, renderMesh, is_static in draw_list.draw_objs:
+      # culled meshes are kept as well, otherwise they get evicted and converted again on each rebuild of the draw list
+      f64render_meshCache.touch(meshKey)
+      if is_static:
+        obj_matrices.append(None)
+        continue
+
+      mvp_matrix = region_data.perspective_matrix @ obj.matrix_world
+      if not corners_in_frustum(np.array(mvp_matrix, dtype=np.float32), renderMesh.bounds):
+        obj_matrices.append(None)
+        continue
+
+      normal_matrix = (region_data.view_matrix @ obj.matrix_world).to_3x3().inverted().transposed()
+      obj_matrices.append((mvp_matrix, normal_matrix))
+
+    draws = [] # (matrices, mesh, material index, index-offset, index-count) in draw order
+    draw_visible = [] # index of each visible draw in the shared draw list
+    for i, (obj_idx, renderMesh, mat_idx, elem_start, elem_count) in enumerate(draw_list.draws):
+      if obj_idx is None: # static batches are culled as a whole
+        if not corners_in_frustum(static_mvp, renderMesh.bounds): continue
+        matrices = static_matrices
+      else:
+        matrices = obj_matrices[obj_idx]
+        if matrices is None: continue
+      draws.append((matrices, renderMesh, mat_idx, elem_start, elem_count))
+      draw_visible.append(i)
+
+    materials = draw_list.materials
+    ubo_data = draw_list.ubo_data[np.array(draw_visible, dtype=np.int32)]
+    ubo_data["light_dir"][:, 0, :3] = lightDir[0]
+    ubo_data["light_dir"][:, 1, :3] = lightDir[1]
+    prof.stop("culling")
 
-    lastPrimColor = f64render_rs.default_prim_color
-    last_prim_lod = np.array([0, 0], dtype=np.float32)
-    lastEnvColor = f64render_rs.default_env_color
-    last_ck = np.array([0, 0, 0, 0, 0, 0, 0, 0], dtype=np.float32)
-    last_convert = np.array([0, 0, 0, 0, 0, 0], dtype=np.float32)
-
-    fallback_objs = []
-    for obj in depsgraph.objects:
-      if obj.type in {"MESH", "CURVE", "SURFACE", "FONT"} and obj.data is not None:
-
-        meshID = obj.name + "#" + obj.data.name
-
-        # check for objects that transitioned from non-f3d to f3d materials
-        if meshID in f64render_meshCache:
-          renderObj = f64render_meshCache[meshID]
-          if len(renderObj.mat_data) == 0 and obj_has_f3d_materials(obj):
-            del f64render_meshCache[meshID]
-            
-        # Mesh not cached: parse & convert mesh data, then prepare a GPU batch
-        if meshID not in f64render_meshCache:
-          # print("    -> Update object", meshID)
-          if obj.mode == 'EDIT':
-            mesh = obj.evaluated_get(depsgraph).to_mesh()
-          else:
-            mesh = obj.evaluated_get(depsgraph).to_mesh(preserve_all_data_layers=True, depsgraph=depsgraph)
-
-          renderObj = f64render_meshCache[meshID] = mesh_to_buffers(mesh)
-          renderObj.mesh_name = obj.data.name
-
-          mat_count = len(obj.material_slots)
-          renderObj.batch = batch_for_shader(self.shader,
-            renderObj.vert,
-            renderObj.norm,
-            renderObj.color,
-            renderObj.uv,
-            renderObj.indices
-          )
-
-          ubo_size = UNIFORM_BUFFER_STRUCT.size
-          ubo_size = (ubo_size + 15) & ~15 # force 16-byte alignment
-
-          renderObj.mat_data = [bytes(ubo_size)] * mat_count
-
-          renderObj.ubo_mat_data = [None] * mat_count
-          renderObj.materials = [None] * mat_count
-
-          for i in range(mat_count):
-            renderObj.ubo_mat_data[i] = gpu.types.GPUUniformBuf(renderObj.mat_data[i])
-
-          obj.to_mesh_clear()
-        
-        if not obj_has_f3d_materials(obj):
-          fallback_objs.append(obj)
-          continue
-        
     self.shader.image('depth_texture', self.depth_texture)
     self.shader.image('color_texture', self.color_texture)
 
+    # rasterize into the lower-left part of the viewport, fragments then map 1:1 onto the (smaller) targets
+    viewport = gpu.state.viewport_get()
+    gpu.state.viewport_set(viewport[0], viewport[1], self.color_texture.width, self.color_texture.height)
+
     gpu.state.depth_test_set('NONE')
     gpu.state.depth_mask_set(False)
     gpu.state.blend_set("NONE")
 
-    # get visible objects, this cannot be done in despgraph objects for whatever reason
-    hidden_obj = [ob.name for ob in bpy.context.view_layer.objects if not ob.visible_get() and ob.data is not None]
-
-    # Draw opaque objects first, then transparent ones
-    #for obj in object_queue[0] + object_queue[1]:
-    for layer in range(2):
-      for obj in depsgraph.objects:
-        if obj.data is None: continue
-        # Handle "Local View" (pressing '/')
-        if space_view_3d.local_view and not obj.local_view_get(space_view_3d): continue
-        if obj.name in hidden_obj: continue
-        # print("Draw object", obj.data.session_uid, visible_obj_ids)
-  
-        # print("space_view_3d.local_view", space_view_3d.clip_start, space_view_3d.clip_end)
-
-        meshID = obj.name + "#" + obj.data.name
-        if meshID not in f64render_meshCache: continue
-        # print("  -> Draw object", meshID)
-        renderObj: MeshBuffers = f64render_meshCache[meshID]
-
-        modelview_matrix = obj.matrix_world
-        projection_matrix = context.region_data.perspective_matrix
-        mvp_matrix = projection_matrix @ modelview_matrix
-        normal_matrix = (context.region_data.view_matrix @ obj.matrix_world).to_3x3().inverted().transposed()
-
-        self.shader.uniform_float("matMVP", mvp_matrix)
-        self.shader.uniform_float("matNorm", normal_matrix)
-
-        mat_idx = 0        
-        for slot in obj.material_slots:
-          indices_count = renderObj.index_offsets[mat_idx+1] - renderObj.index_offsets[mat_idx]
-          if indices_count == 0: # ignore unused materials
-            mat_idx += 1
-            continue
-          
-          f3d_mat = slot.material.f3d_mat                    
-          if f64render_materials_dirty or renderObj.materials[mat_idx] is None:
-            renderObj.materials[mat_idx] = f64_material_parse(f3d_mat, renderObj.materials[mat_idx])
-
-          f64mat = renderObj.materials[mat_idx]
-          if f64mat.queue != layer: # skip if not in current layer
-            mat_idx += 1
-            continue
-
-          gpu.state.face_culling_set(f64mat.cull)
-
-          if f64mat.tex0Buff: self.shader.uniform_sampler("tex0", f64mat.tex0Buff)
-          if f64mat.tex1Buff: self.shader.uniform_sampler("tex1", f64mat.tex1Buff)
-
-          renderObj.mat_data[mat_idx] = UNIFORM_BUFFER_STRUCT.pack(
-            *f64mat.blender,
-            *f64mat.tile_conf,
-            *f64mat.cc,
-            f64mat.geo_mode,
-            f64mat.othermode_l,
-            f64mat.othermode_h,
-            f64mat.flags,
-            *(f64mat.color_light if f64mat.set_light      else lightColor0),
-            *lightColor1,
-            *lightDir0,
-            f64mat.alphaClip,
-            *lightDir1,
-            0,
-            *(f64mat.color_prim    if f64mat.set_prim     else lastPrimColor),
-            *(f64mat.color_env     if f64mat.set_env      else lastEnvColor),
-            *(f64mat.color_ambient if f64mat.set_ambient  else ambientColor),
-            *(f64mat.ck            if f64mat.set_ck       else last_ck),
-            *(f64mat.lod_prim      if f64mat.set_prim     else last_prim_lod),
-            *f64mat.prim_depth,
-            *(f64mat.convert       if f64mat.set_convert  else last_convert),
-          )
-
-          if f64mat.set_prim: lastPrimColor, last_prim_lod = f64mat.color_prim, f64mat.lod_prim
-          if f64mat.set_env: lastEnvColor = f64mat.color_env
-          if f64mat.set_ck: last_ck = f64mat.ck
-          if f64mat.set_convert: last_convert = f64mat.convert
-          
-          renderObj.ubo_mat_data[mat_idx].update(renderObj.mat_data[mat_idx])                        
-          self.shader.uniform_block("material", renderObj.ubo_mat_data[mat_idx])
-          
-          # @TODO: frustum-culling (blender doesn't do it)
-          
-          renderObj.batch.draw_range(self.shader, elem_start=renderObj.index_offsets[mat_idx], elem_count=indices_count)
-          mat_idx += 1  
-
-    f64render_materials_dirty = False
-    draw_time = (time.process_time() - t) * 1000
-    self.time_total += draw_time
-    self.time_count += 1
-    #print("Time F3D (ms)", draw_time)
-
-    if self.time_count > 20:
-      print("Time F3D AVG (ms)", self.time_total / self.time_count, self.time_count)
-      self.time_total = 0
-      self.time_count = 0
-          
-    if len(fallback_objs) > 0:
-      t = time.process_time()
+    prof.start("draw submission")
+
+    if f64render_rs.use_shader_variants:
+      mat_shaders = self.get_material_shaders(materials)
+    else:
+      mat_shaders = [self.shader] * len(materials)
+
+    # UBOs are resolved in scene order above, so the draws themselves can now be re-ordered by state
+    draw_order = sort_draws(draws, materials, mat_shaders)
+
+    last_matrices = last_cull = last_tex0 = last_tex1 = last_ubo = None
+    last_shader = self.shader
+    state_changes = state_changes_unsorted = 0
+    for i in draw_order:
+      matrices, renderMesh, mat_idx, elem_start, elem_count = draws[i]
+
+      # uniforms are stored per shader, so everything needs to be set again after switching
+      shader = mat_shaders[mat_idx]
+      if shader is not last_shader:
+        shader.bind()
+        shader.image('depth_texture', self.depth_texture)
+        shader.image('color_texture', self.color_texture)
+        last_shader = shader
+        last_matrices = last_tex0 = last_tex1 = last_ubo = None
+        state_changes += 1
+
+      if matrices is not last_matrices:
+        shader.uniform_float("matMVP", matrices[0])
+        shader.uniform_float("matNorm", matrices[1])
+        last_matrices = matrices
+
+      matEntry = materials[mat_idx]
+      f64mat = matEntry.f64mat
+      # (without sorting & checks, all of these were set for every draw)
+      state_changes_unsorted += 2 + (f64mat.tex0Buff is not None) + (f64mat.tex1Buff is not None)
+
+      if f64mat.cull != last_cull:
+        gpu.state.face_culling_set(f64mat.cull)
+        last_cull = f64mat.cull
+        state_changes += 1
+
+      if f64mat.tex0Buff and f64mat.tex0Buff is not last_tex0:
+        shader.uniform_sampler("tex0", f64mat.tex0Buff)
+        last_tex0 = f64mat.tex0Buff
+        state_changes += 1
+      if f64mat.tex1Buff and f64mat.tex1Buff is not last_tex1:
+        shader.uniform_sampler("tex1", f64mat.tex1Buff)
+        last_tex1 = f64mat.tex1Buff
+        state_changes += 1
+
+      # only upload if the content changed, which for static scenes is almost never the case
+      mat_data = ubo_data[i].tobytes()
+      if matEntry.mat_data != mat_data:
+        matEntry.mat_data = mat_data
+        matEntry.ubo.update(mat_data)
+
+      if matEntry.ubo is not last_ubo:
+        shader.uniform_block("material", matEntry.ubo)
+        last_ubo = matEntry.ubo
+        state_changes += 1
+
+      renderMesh.batch.draw_range(shader, elem_start=elem_start, elem_count=elem_count)
+
+    gpu.state.viewport_set(*viewport)
+    f64render_drawStats["draws"] = len(draws)
+    f64render_drawStats["state_changes"] = state_changes
+    f64render_drawStats["state_changes_saved"] = state_changes_unsorted - state_changes
+    prof.stop("draw submission")
+    prof.count("draw calls", len(draws))
+    prof.count("triangles", sum(draw[4] for draw in draws) // 3)
+    prof.count("state changes", state_changes)
+
+    if len(draw_list.fallback_objs) > 0:
+      prof.start("fallback")
       self.shader_fallback.bind()
 
-      for obj in fallback_objs:
-        meshID = obj.name + "#" + obj.data.name
-        renderObj = f64render_meshCache[meshID]
-
-        if obj.name in hidden_obj: continue
+      for obj in draw_list.fallback_objs:
+        objInfo = f64render_objCache[obj.name]
+        if objInfo.mesh_key not in f64render_meshCache: continue # deferred
+        renderMesh = f64render_meshCache[objInfo.mesh_key]
+        f64render_meshCache.touch(objInfo.mesh_key)
 
         # get material (we don't expect any changes here, so caching is fine)
-        if renderObj.materials is None or len(renderObj.materials) == 0:
-          renderObj.materials = [F64Material()]
-          if obj.material_slots:
-            mat = obj.material_slots[0].materials[0]
-            renderObj.materials[0] = node_material_parse(mat)
+        if objInfo.materials is None or len(objInfo.materials) == 0:
+          objInfo.materials = [F64Material()]
+          if obj.material_slots and obj.material_slots[0].material:
+            objInfo.materials[0] = node_material_parse(obj.material_slots[0].material)
 
-        self.shader_fallback.uniform_float("color", renderObj.materials[0].color_prim)
+        self.shader_fallback.uniform_float("color", objInfo.materials[0].color_prim)
 
         modelview_matrix = obj.matrix_world
         projection_matrix = context.region_data.perspective_matrix
         mvp_matrix = projection_matrix @ modelview_matrix
         self.shader_fallback.uniform_float("ModelViewProjectionMatrix", mvp_matrix)
 
-        renderObj.batch.draw(self.shader_fallback)
+        renderMesh.batch.draw(self.shader_fallback)
+        prof.count("draw calls")
         obj.to_mesh_clear()
 
-      #print("Time fallback (ms)", (time.process_time() - t) * 1000)
+      prof.stop("fallback")
 
-    #t = time.process_time()
+    prof.start("resolve")
     gpu.state.face_culling_set('NONE')
     gpu.state.blend_set("ALPHA")
     gpu.state.depth_test_set('LESS')
     gpu.state.depth_mask_set(False)
 
+    # covers the whole viewport, lower internal resolutions are upscaled with nearest sampling here
     self.shader_2d.bind()
-    
-    # @TODO: why can't i cache this?
-    vbo_2d = gpu.types.GPUVertBuf(self.shader_2d.format_calc(), 6)
-    vbo_2d.attr_fill("pos", [(-1, -1), (-1, 1), (1, 1), (1, 1), (1, -1), (-1, -1)])
-    batch_2d = gpu.types.GPUBatch(type="TRIS", buf=vbo_2d)
-
     self.shader_2d.image('color_texture', self.color_texture)
-    batch_2d.draw(self.shader_2d)
-
-    #print("Time 2D (ms)", (time.process_time() - t) * 1000)
+    self.batch_2d.draw(self.shader_2d)
+    prof.stop("resolve")
+
+    # free meshes that haven't been drawn in a while (deleted, hidden, ...)
+    evicted = set(f64render_meshCache.evict(f64render_rs.mesh_cache_budget * 1024 * 1024))
+    if len(evicted) > 0:
+      for key in list(f64render_objCache.keys()):
+        if f64render_objCache[key].mesh_key in evicted:
+          del f64render_objCache[key]
+      f64render_drawList = None # may reference evicted meshes
+
+    # free textures of deleted images (and images no material uses anymore), like evicted meshes
+    image_count = len(bpy.data.images)
+    if len(evicted) > 0 or image_count < f64render_imageCount:
+      material_cache_prune_textures()
+    f64render_imageCount = image_count
+    f64render_meshCache.next_frame()
+
+    prof.count("mesh cache hits", f64render_meshCache.hits - cache_hits)
+    prof.count("mesh cache misses", f64render_meshCache.misses - cache_misses)
+    prof.end_frame()
 
 class F64RenderSettings(bpy.types.PropertyGroup):
   default_prim_color: bpy.props.FloatVectorProperty(
@@ -475,6 +936,113 @@ class F64RenderSettings(bpy.types.PropertyGroup):
     min=0,
     max=1,
   )
+  internal_resolution: bpy.props.EnumProperty(
+    name="Resolution",
+    description="Resolution the scene is rendered at, lower ones are faster and get upscaled to the viewport",
+    items=[
+      ("VIEWPORT", "Viewport", "Render at the full viewport resolution"),
+      ("SCALE", "Scaled", "Render at a fraction of the viewport resolution"),
+      ("320x240", "320x240", "Low resolution of most N64 games"),
+      ("640x480", "640x480", "High resolution of N64 games"),
+    ],
+    default="VIEWPORT",
+  )
+  resolution_scale: bpy.props.FloatProperty(
+    name="Resolution Scale",
+    description="Fraction of the viewport resolution to render at",
+    default=0.5,
+    min=0.05,
+    max=1.0,
+    subtype="FACTOR",
+  )
+  mesh_cache_budget: bpy.props.IntProperty(
+    name="Mesh Cache (MB)",
+    description="Memory budget for converted meshes, least recently drawn meshes are freed above it",
+    default=1024,
+    min=16,
+  )
+  use_indexed_meshes: bpy.props.BoolProperty(
+    name="Indexed Meshes",
+    description="Merge identical face-corners into shared vertices, uses less memory but takes longer to convert",
+    default=False,
+    update=lambda self, context: f64render_meshCache.clear(),
+  )
+  mesh_load_budget: bpy.props.IntProperty(
+    name="Mesh Load Budget (ms)",
+    description="Time per redraw spent on converting new meshes, the rest is loaded in the following redraws. 0 loads everything at once",
+    default=100,
+    min=0,
+  )
+  use_static_batching: bpy.props.BoolProperty(
+    name="Static Batching",
+    description="Merge non-animated objects into one mesh per material to reduce draw calls. Lighting is calculated in world-space for them",
+    default=False,
+    update=static_batching_update,
+  )
+  use_shader_variants: bpy.props.BoolProperty(
+    name="Shader Variants",
+    description="Compile specialized shaders per color-combiner/blender setup, faster to render but each new setup takes a moment to compile",
+    default=False,
+  )
+  use_profiler: bpy.props.BoolProperty(
+    name="Profiler",
+    description="Record timings and counters of each redraw, shown here and exportable to a file",
+    default=False,
+  )
+  mesh_workers: bpy.props.IntProperty(
+    name="Mesh Threads",
+    description="Number of threads used to convert meshes and render tiles, 0 uses all cores",
+    default=0,
+    min=0,
+  )
+  use_disk_cache: bpy.props.BoolProperty(
+    name="Disk Cache",
+    description="Store converted meshes on disk, this speeds up opening large files",
+    default=False,
+  )
+  disk_cache_dir: bpy.props.StringProperty(
+    name="Cache Directory",
+    description="Location of the disk cache, defaults to a 'f64render_cache' folder next to the blend file",
+    default="",
+    subtype="DIR_PATH",
+  )
+
+class F64RENDER_OT_clear_disk_cache(bpy.types.Operator):
+  bl_idname = "f64render.clear_disk_cache"
+  bl_label = "Clear Disk Cache"
+  bl_description = "Deletes all meshes and material previews stored in the disk cache"
+
+  def execute(self, context):
+    f64render_rs: F64RenderSettings = context.scene.f64render.render_settings
+    cache_dir = get_disk_cache_dir(f64render_rs)
+    PreviewDiskCache(cache_dir).clear()
+    MeshDiskCache(cache_dir).clear()
+    return {'FINISHED'}
+
+class F64RENDER_OT_export_profile(bpy.types.Operator, ExportHelper):
+  bl_idname = "f64render.export_profile"
+  bl_label = "Export Profile"
+  bl_description = "Writes the timings and counters of the recorded frames to a CSV or JSON file"
+
+  filename_ext = ".csv"
+  filter_glob: bpy.props.StringProperty(default="*.csv;*.json", options={'HIDDEN'})
+
+  def execute(self, context):
+    if self.filepath.lower().endswith(".json"):
+      f64render_profiler.export_json(self.filepath)
+    else:
+      f64render_profiler.export_csv(self.filepath)
+    self.report({'INFO'}, f"Exported {len(f64render_profiler.history)} frames")
+    return {'FINISHED'}
+
+class F64RENDER_OT_clear_profile(bpy.types.Operator):
+  bl_idname = "f64render.clear_profile"
+  bl_label = "Clear Profile"
+  bl_description = "Removes all recorded frames"
+
+  def execute(self, context):
+    f64render_profiler.clear()
+    return {'FINISHED'}
 
 class F64RenderProperties(bpy.types.PropertyGroup):
   render_settings: bpy.props.PointerProperty(type=F64RenderSettings)
@@ -490,6 +1058,42 @@ class F64RenderSettingsPanel(bpy.types.Panel):
     f64render_rs: F64RenderSettings = context.scene.f64render.render_settings
     layout.prop(f64render_rs, "default_prim_color")
     layout.prop(f64render_rs, "default_env_color")
+    layout.prop(f64render_rs, "internal_resolution")
+    if f64render_rs.internal_resolution == 'SCALE':
+      layout.prop(f64render_rs, "resolution_scale")
+    layout.prop(f64render_rs, "mesh_cache_budget")
+    layout.prop(f64render_rs, "use_indexed_meshes")
+    layout.prop(f64render_rs, "use_static_batching")
+    layout.prop(f64render_rs, "use_shader_variants")
+    layout.prop(f64render_rs, "mesh_workers")
+    layout.prop(f64render_rs, "mesh_load_budget")
+    layout.prop(f64render_rs, "use_disk_cache")
+    if f64render_rs.use_disk_cache:
+      layout.prop(f64render_rs, "disk_cache_dir")
+      layout.operator(F64RENDER_OT_clear_disk_cache.bl_idname)
+
+    cache = f64render_meshCache
+    layout.label(text=f"Meshes: {len(cache)} ({cache.total_size / (1024 * 1024):.1f} MB)")
+    layout.label(text=f"Hits: {cache.hits}, Misses: {cache.misses}, Evictions: {cache.evictions}")
+    tex_count, tex_size = texture_cache_stats()
+    layout.label(text=f"Textures: {tex_count} ({tex_size / (1024 * 1024):.1f} MB)")
+    if f64render_rs.use_shader_variants:
+      layout.label(text=f"Shader Variants: {len(f64render_shaderVariants)}")
+    stats = f64render_drawStats
+    layout.label(text=f"Draws: {stats['draws']}, State changes: {stats['state_changes']} ({stats['state_changes_saved']} saved)")
+
+    layout.prop(f64render_rs, "use_profiler")
+    if f64render_rs.use_profiler:
+      times, counters = f64render_profiler.averages()
+      col = layout.column(align=True)
+      col.label(text="Average of the last 20 redraws:")
+      for name, value in times.items():
+        col.label(text=f"{name}: {value:.2f} ms")
+      for name, value in counters.items():
+        col.label(text=f"{name}: {value:.0f}")
+      row = layout.row()
+      row.operator(F64RENDER_OT_export_profile.bl_idname)
+      row.operator(F64RENDER_OT_clear_profile.bl_idname)
 
 def draw_render_settings(self, context):
   if context.scene.render.engine == Fast64RenderEngine.bl_idname:
@@ -519,7 +1123,11 @@ def get_panels():
 
 def register():
   global f64render_meshCache
-  f64render_meshCache = {}
+  global f64render_objCache
+  f64render_meshCache = MeshCache()
+  f64render_objCache = {}
+  material_cache_clear()
+  texture_cache_clear()
 
   bpy.types.RenderEngine.f64_render_engine = bpy.props.PointerProperty(type=Fast64RenderEngine)
   for panel in get_panels():
@@ -531,7 +1139,24 @@ def register():
 
 def unregister():
   global f64render_meshCache
-  f64render_meshCache = {}
+  global f64render_objCache
+  global f64render_meshPool
+  global f64render_staticBatches
+  global f64render_drawList
+  f64render_meshCache = MeshCache()
+  f64render_objCache = {}
+  f64render_staticBatches = {}
+  material_cache_clear()
+  texture_cache_clear()
+  f64render_shaderCache.clear()
+  f64render_shaderSources.clear()
+  f64render_shaderVariants.clear()
+  f64render_renderTargets.clear()
+  f64render_drawList = None
+
+  if f64render_meshPool is not None:
+    f64render_meshPool.shutdown(wait=False)
+    f64render_meshPool = None
 
   bpy.types.VIEW3D_HT_header.remove(draw_render_settings)
 
@@ -6,23 +6,25 @@
 
 #define DECAL_DEPTH_DELTA 100
 
-vec4 quantize3Bit(in vec4 color) {
-  return vec4(round(color.rgb * 8.0) / 8.0, step(0.5, color.a));
-}
-
-vec4 quantize4Bit(in vec4 color) {
-  return round(color * 16.0) / 16.0; // (16 seems more accurate than 15)
-}
+// Specialized variants (see 'material/variant.py') define these as constants,
+// which lets the compiler remove all branches of the CC/blender input selection.
+// The uber-shader reads them from the material instead.
+#ifndef VARIANT_CC
+  #define CC0_COLOR material.cc0Color
+  #define CC0_ALPHA material.cc0Alpha
+  #define CC1_COLOR material.cc1Color
+  #define CC1_ALPHA material.cc1Alpha
+#endif
 
-vec4 quantizeTexture0(vec4 color) {
-  vec4 colorQuant = flagSelect(DRAW_FLAG_TEX0_4BIT, color, quantize4Bit(color));
-  return flagSelect(DRAW_FLAG_TEX0_3BIT, colorQuant, quantize3Bit(colorQuant));
-}
+#ifndef VARIANT_BLENDER
+  #define BLENDER_CYCLE0 material.blender[0]
+  #define BLENDER_CYCLE1 material.blender[1]
+#endif
 
-vec4 quantizeTexture1(vec4 color) {
-  vec4 colorQuant = flagSelect(DRAW_FLAG_TEX1_4BIT, color, quantize4Bit(color));
-  return flagSelect(DRAW_FLAG_TEX1_3BIT, colorQuant, quantize3Bit(colorQuant));
-}
+#ifndef VARIANT_OTHER_MODE_H
+  #define CYCLE_2 ((OTHER_MODE_H & G_CYC_2CYCLE) != 0)
+  #define FILTER_3POINT (texFilter() == G_TF_BILERP)
+#endif
 
 void fetchTex01Filtered(in ivec4 texSize, out vec4 texData0, out vec4 texData1)
 {
@@ -53,13 +55,14 @@ void fetchTex01Filtered(in ivec4 texSize, out vec4 texData0, out vec4 texData1)
   vec2 lambda2 = abs((v0.xz * v2.yw - v2.xz * v0.yw) / den);
   vec2 lambda0 = 1.0 - lambda1 - lambda2;
 
-  texData0 =  quantizeTexture0(texelFetch(tex0, uv1.xy, 0)) * lambda0.x
-            + quantizeTexture0(texelFetch(tex0, uv0.xy, 0)) * lambda1.x
-            + quantizeTexture0(texelFetch(tex0, uv2.xy, 0)) * lambda2.x;
+  // Note: textures are already quantized to their format during upload (see 'material/texture.py')
+  texData0 =  texelFetch(tex0, uv1.xy, 0) * lambda0.x
+            + texelFetch(tex0, uv0.xy, 0) * lambda1.x
+            + texelFetch(tex0, uv2.xy, 0) * lambda2.x;
   
-  texData1 =  quantizeTexture1(texelFetch(tex1, uv1.zw, 0)) * lambda0.y
-            + quantizeTexture1(texelFetch(tex1, uv0.zw, 0)) * lambda1.y
-            + quantizeTexture1(texelFetch(tex1, uv2.zw, 0)) * lambda2.y;
+  texData1 =  texelFetch(tex1, uv1.zw, 0) * lambda0.y
+            + texelFetch(tex1, uv0.zw, 0) * lambda1.y
+            + texelFetch(tex1, uv2.zw, 0) * lambda2.y;
 }
 
 vec3 cc_fetchColor(in int val, in vec4 shade, in vec4 comb, in vec4 texData0, in vec4 texData1)
@@ -140,18 +143,18 @@ vec4 blendColor(in vec4 oldColor, vec4 newColor)
   vec4 colorBlend = vec4(0.0); // @TODO
   vec4 colorFog = vec4(1.0, 0.0, 0.0, 1.0); // @TODO
 
-  vec4 P = blender_fetch(material.blender[0][0], colorBlend, colorFog, oldColor, newColor, vec4(0.0));
-  vec4 A = blender_fetch(material.blender[0][1], colorBlend, colorFog, oldColor, newColor, vec4(0.0));
-  vec4 M = blender_fetch(material.blender[0][2], colorBlend, colorFog, oldColor, newColor, A);
-  vec4 B = blender_fetch(material.blender[0][3], colorBlend, colorFog, oldColor, newColor, A);
+  vec4 P = blender_fetch(BLENDER_CYCLE0[0], colorBlend, colorFog, oldColor, newColor, vec4(0.0));
+  vec4 A = blender_fetch(BLENDER_CYCLE0[1], colorBlend, colorFog, oldColor, newColor, vec4(0.0));
+  vec4 M = blender_fetch(BLENDER_CYCLE0[2], colorBlend, colorFog, oldColor, newColor, A);
+  vec4 B = blender_fetch(BLENDER_CYCLE0[3], colorBlend, colorFog, oldColor, newColor, A);
 
   vec4 res = ((P * A) + (M * B)) / (A + B);
   res.a = gammaToLinear(newColor.aaa).r; // preserve for 'A_IN'
 
-  P = blender_fetch(material.blender[1][0], colorBlend, colorFog, oldColor, res, vec4(0.0));
-  A = blender_fetch(material.blender[1][1], colorBlend, colorFog, oldColor, res, vec4(0.0));
-  M = blender_fetch(material.blender[1][2], colorBlend, colorFog, oldColor, res, A);
-  B = blender_fetch(material.blender[1][3], colorBlend, colorFog, oldColor, res, A);
+  P = blender_fetch(BLENDER_CYCLE1[0], colorBlend, colorFog, oldColor, res, vec4(0.0));
+  A = blender_fetch(BLENDER_CYCLE1[1], colorBlend, colorFog, oldColor, res, vec4(0.0));
+  M = blender_fetch(BLENDER_CYCLE1[2], colorBlend, colorFog, oldColor, res, A);
+  B = blender_fetch(BLENDER_CYCLE1[3], colorBlend, colorFog, oldColor, res, A);
 
   return ((P * A) + (M * B)) / (A + B);
 }
@@ -205,15 +208,15 @@ void main()
   vec4 texData0, texData1;
   ivec4 texSize = ivec4(textureSize(tex0, 0), textureSize(tex1, 0)) - 1;
 
-  if(texFilter() == G_TF_BILERP)
+  if(FILTER_3POINT)
   {
     fetchTex01Filtered(texSize, texData0, texData1);
   } else {
     ivec4 uv0 = ivec4(floor(uv + 0.5));
     uv0 = wrappedMirror(texSize, uv0);
 
-    texData0 = quantizeTexture0(texelFetch(tex0, uv0.xy, 0));
-    texData1 = quantizeTexture0(texelFetch(tex1, uv0.zw, 0));
+    texData0 = texelFetch(tex0, uv0.xy, 0);
+    texData1 = texelFetch(tex1, uv0.zw, 0);
   }
 
   // handle I4/I8
@@ -224,28 +227,28 @@ void main()
 
   // @TODO: emulate other formats, e.g. quantization?
 
-  cc0[0].rgb = cc_fetchColor(material.cc0Color.x, ccShade, ccValue, texData0, texData1);
-  cc0[1].rgb = cc_fetchColor(material.cc0Color.y, ccShade, ccValue, texData0, texData1);
-  cc0[2].rgb = cc_fetchColor(material.cc0Color.z, ccShade, ccValue, texData0, texData1);
-  cc0[3].rgb = cc_fetchColor(material.cc0Color.w, ccShade, ccValue, texData0, texData1);
+  cc0[0].rgb = cc_fetchColor(CC0_COLOR.x, ccShade, ccValue, texData0, texData1);
+  cc0[1].rgb = cc_fetchColor(CC0_COLOR.y, ccShade, ccValue, texData0, texData1);
+  cc0[2].rgb = cc_fetchColor(CC0_COLOR.z, ccShade, ccValue, texData0, texData1);
+  cc0[3].rgb = cc_fetchColor(CC0_COLOR.w, ccShade, ccValue, texData0, texData1);
 
-  cc0[0].a = cc_fetchAlpha(material.cc0Alpha.x, ccShade, ccValue, texData0, texData1);
-  cc0[1].a = cc_fetchAlpha(material.cc0Alpha.y, ccShade, ccValue, texData0, texData1);
-  cc0[2].a = cc_fetchAlpha(material.cc0Alpha.z, ccShade, ccValue, texData0, texData1);
-  cc0[3].a = cc_fetchAlpha(material.cc0Alpha.w, ccShade, ccValue, texData0, texData1);
+  cc0[0].a = cc_fetchAlpha(CC0_ALPHA.x, ccShade, ccValue, texData0, texData1);
+  cc0[1].a = cc_fetchAlpha(CC0_ALPHA.y, ccShade, ccValue, texData0, texData1);
+  cc0[2].a = cc_fetchAlpha(CC0_ALPHA.z, ccShade, ccValue, texData0, texData1);
+  cc0[3].a = cc_fetchAlpha(CC0_ALPHA.w, ccShade, ccValue, texData0, texData1);
 
   ccValue = cc_overflowValue((cc0[0] - cc0[1]) * cc0[2] + cc0[3]);
 
-  if((OTHER_MODE_H & G_CYC_2CYCLE) != 0) {
-    cc1[0].rgb = cc_fetchColor(material.cc1Color.x, ccShade, ccValue, texData0, texData1);
-    cc1[1].rgb = cc_fetchColor(material.cc1Color.y, ccShade, ccValue, texData0, texData1);
-    cc1[2].rgb = cc_fetchColor(material.cc1Color.z, ccShade, ccValue, texData0, texData1);
-    cc1[3].rgb = cc_fetchColor(material.cc1Color.w, ccShade, ccValue, texData0, texData1);
+  if(CYCLE_2) {
+    cc1[0].rgb = cc_fetchColor(CC1_COLOR.x, ccShade, ccValue, texData0, texData1);
+    cc1[1].rgb = cc_fetchColor(CC1_COLOR.y, ccShade, ccValue, texData0, texData1);
+    cc1[2].rgb = cc_fetchColor(CC1_COLOR.z, ccShade, ccValue, texData0, texData1);
+    cc1[3].rgb = cc_fetchColor(CC1_COLOR.w, ccShade, ccValue, texData0, texData1);
     
-    cc1[0].a = cc_fetchAlpha(material.cc1Alpha.x, ccShade, ccValue, texData0, texData1);
-    cc1[1].a = cc_fetchAlpha(material.cc1Alpha.y, ccShade, ccValue, texData0, texData1);
-    cc1[2].a = cc_fetchAlpha(material.cc1Alpha.z, ccShade, ccValue, texData0, texData1);
-    cc1[3].a = cc_fetchAlpha(material.cc1Alpha.w, ccShade, ccValue, texData0, texData1);
+    cc1[0].a = cc_fetchAlpha(CC1_ALPHA.x, ccShade, ccValue, texData0, texData1);
+    cc1[1].a = cc_fetchAlpha(CC1_ALPHA.y, ccShade, ccValue, texData0, texData1);
+    cc1[2].a = cc_fetchAlpha(CC1_ALPHA.z, ccShade, ccValue, texData0, texData1);
+    cc1[3].a = cc_fetchAlpha(CC1_ALPHA.w, ccShade, ccValue, texData0, texData1);
 
     ccValue = (cc1[0] - cc1[1]) * cc1[2] + cc1[3];
   }
@@ -0,0 +1,68 @@
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import blender_stubs # noqa: F401
+from f64render.mesh.mesh import MeshArrays, mesh_arrays_hash, mesh_arrays_to_buffers
+from f64render.mesh.disk_cache import MeshDiskCache
+
+# Cold vs. warm loading of a mesh: converting it (cold) against hashing + loading it from the disk cache (warm).
+# Usage: python tests/bench_disk_cache.py [grid size], a grid of N x N quads is used as the mesh.
+
+def grid_mesh_arrays(size: int, mat_count: int = 2) -> MeshArrays:
+  rng = np.random.default_rng(1)
+  x, y = np.meshgrid(np.arange(size + 1, dtype=np.float32), np.arange(size + 1, dtype=np.float32))
+  positions = np.stack([x.ravel(), y.ravel(), rng.random(x.size, dtype=np.float32)], axis=1)
+
+  # two triangles per quad, each quad has its own 4 face-corners (like blender loops)
+  qx, qy = np.meshgrid(np.arange(size), np.arange(size))
+  v0 = (qy * (size + 1) + qx).ravel()
+  quad_verts = np.stack([v0, v0 + 1, v0 + size + 2, v0 + size + 1], axis=1)
+  quad_loops = np.arange(quad_verts.size).reshape(-1, 4)
+  tri_corners = [0, 1, 2, 0, 2, 3]
+  tri_verts = quad_verts[:, tri_corners].ravel().astype(np.int32)
+  tri_loops = quad_loops[:, tri_corners].ravel().astype(np.int32)
+
+  loop_verts = quad_verts.ravel()
+  normals = np.tile(np.array([0, 0, 1], dtype=np.float32), (len(loop_verts), 1))
+  uvs = positions[loop_verts, :2] / size
+  colors = np.ones((len(loop_verts), 4), dtype=np.float32)
+  colors[:, :3] = positions[loop_verts, 2:3]
+
+  tri_count = len(tri_verts) // 3
+  return MeshArrays(
+    positions, tri_verts, tri_loops, normals, uvs, colors, None,
+    np.zeros(tri_count, dtype=np.int32), (np.arange(tri_count) % mat_count).astype(np.int8), mat_count,
+  )
+
+def measure(func, repeat: int = 3) -> float:
+  best = float("inf")
+  for _ in range(repeat):
+    start = time.perf_counter()
+    func()
+    best = min(best, time.perf_counter() - start)
+  return best * 1000
+
+def main():
+  size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+  arrays = grid_mesh_arrays(size)
+  print(f"{len(arrays.tri_verts) // 3} triangles")
+
+  with tempfile.TemporaryDirectory() as cache_dir:
+    cache = MeshDiskCache(cache_dir)
+    for indexed in (False, True):
+      salt = b"indexed" if indexed else b""
+      key = mesh_arrays_hash(arrays, salt)
+      cache.store(key, mesh_arrays_to_buffers(arrays, indexed))
+
+      cold = measure(lambda: mesh_arrays_to_buffers(arrays, indexed))
+      hash_time = measure(lambda: mesh_arrays_hash(arrays, salt))
+      load_time = measure(lambda: cache.load(key))
+      label = "indexed" if indexed else "non-indexed"
+      print(f"  {label:12s} cold (convert): {cold:8.1f} ms, warm (hash + load): {hash_time + load_time:8.1f} ms"
+        f" ({hash_time:.1f} + {load_time:.1f})")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,116 @@
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+import blender_stubs # noqa: F401
+from f64render import renderer
+from f64render.material import cache as material_cache
+from f64render.material.parser import F64Material
+from f64render.mesh.culling import aabb_corners
+from f64render.mesh.mesh import MeshBuffers
+
+# Times the per-frame object gather ('build_draw_list') with mock objects at different scene sizes.
+# For comparison, the visibility checks as done before (hidden objects in a list, checked in three walks
+# over the depsgraph) are timed on the same objects.
+# Usage: python tests/bench_gather.py [object counts...]
+
+MATERIAL_COUNT = 16
+MESH_COUNT = 64
+HIDDEN_EVERY = 10 # every n-th object is hidden
+
+class MockObject:
+  def __init__(self, index: int, mesh, slots: list, hidden: bool):
+    self.name = f"Object.{index:05d}"
+    self.session_uid = 100000 + index
+    self.type = "MESH"
+    self.mode = "OBJECT"
+    self.modifiers = ()
+    self.data = mesh
+    self.material_slots = slots
+    self.hidden = hidden
+
+  def visible_get(self) -> bool:
+    return not self.hidden
+
+  def local_view_get(self, space) -> bool:
+    return True
+
+def build_scene(object_count: int) -> list[MockObject]:
+  renderer.f64render_meshCache.clear()
+  renderer.f64render_objCache.clear()
+  material_cache.material_cache_clear()
+
+  materials = []
+  for i in range(MATERIAL_COUNT):
+    mat = SimpleNamespace(session_uid=1000 + i, is_f3d=True, f3d_mat=True)
+    f64mat = F64Material(cc=np.zeros(16, dtype=np.int32), blender=(0,) * 8, tile_conf=np.zeros(16, dtype=np.float32), queue=i % 2)
+    material_cache.f64render_materialCache[mat.session_uid] = material_cache.MaterialCacheEntry(
+      f64mat, (material_cache.f64render_mat_epoch, 0), b"", None)
+    materials.append(SimpleNamespace(material=mat))
+
+  meshes = []
+  for i in range(MESH_COUNT):
+    mesh = SimpleNamespace(name=f"Mesh.{i:03d}", session_uid=2000 + i)
+    vert = np.zeros((6, 3), dtype=np.float32)
+    buffers = MeshBuffers(vert, np.ones((6, 4), dtype=np.float32), np.zeros((6, 2), dtype=np.float32), vert,
+      np.arange(6, dtype=np.int32).reshape(-1, 3), np.array([0, 3, 6]), aabb_corners(np.zeros((2, 3), dtype=np.float32)), None)
+    renderer.f64render_meshCache[("MESH", mesh.session_uid)] = buffers
+    meshes.append(mesh)
+
+  return [
+    MockObject(i, meshes[i % MESH_COUNT], [materials[i % MATERIAL_COUNT], materials[(i * 7 + 1) % MATERIAL_COUNT]], i % HIDDEN_EVERY == 0)
+    for i in range(object_count)
+  ]
+
+def make_depsgraph(objects: list[MockObject]) -> SimpleNamespace:
+  render_settings = SimpleNamespace(
+    mesh_load_budget=0, use_static_batching=False, use_indexed_meshes=False, mesh_workers=1,
+    use_disk_cache=False, default_prim_color=(1, 1, 1, 1), default_env_color=(0.5, 0.5, 0.5, 0.5),
+  )
+  fast64_settings = SimpleNamespace(
+    light0Color=(1, 1, 1, 1), light1Color=(0, 0, 0, 1), light0Direction=(0, 0, 1), light1Direction=(0, 0, 1),
+    ambientColor=(0.5, 0.5, 0.5, 1),
+  )
+  scene = SimpleNamespace(f64render=SimpleNamespace(render_settings=render_settings), fast64=SimpleNamespace(renderSettings=fast64_settings))
+  return SimpleNamespace(objects=objects, scene=scene)
+
+# Visibility checks of the previous gather: a hidden list, checked once while loading and once per layer
+def previous_visibility_checks(objects: list[MockObject]) -> int:
+  hidden_obj = [ob.name for ob in objects if not ob.visible_get() and ob.data is not None]
+  visible = 0
+  for _ in range(3):
+    for obj in objects:
+      if obj.name in hidden_obj: continue
+      visible += 1
+  return visible
+
+def measure(func, repeat: int = 3) -> float:
+  best = float("inf")
+  for _ in range(repeat):
+    start = time.perf_counter()
+    func()
+    best = min(best, time.perf_counter() - start)
+  return best * 1000
+
+def main():
+  counts = [int(arg) for arg in sys.argv[1:]] or [1000, 5000, 10000]
+  engine = SimpleNamespace(shader=None, tag_redraw=lambda: None)
+  space = SimpleNamespace(local_view=None)
+
+  print(f"{'objects':>8} {'gather (ms)':>12} {'per object (us)':>16} {'previous checks (ms)':>21}")
+  for count in counts:
+    objects = build_scene(count)
+    depsgraph = make_depsgraph(objects)
+    renderer.bpy.context = SimpleNamespace(view_layer=SimpleNamespace(objects=objects))
+
+    draw_list = renderer.Fast64RenderEngine.build_draw_list(engine, depsgraph, space, None)
+    assert len(draw_list.draw_objs) == count - (count + HIDDEN_EVERY - 1) // HIDDEN_EVERY
+
+    gather = measure(lambda: renderer.Fast64RenderEngine.build_draw_list(engine, depsgraph, space, None))
+    previous = measure(lambda: previous_visibility_checks(objects), repeat=1)
+    print(f"{count:8d} {gather:12.1f} {gather * 1000 / count:16.2f} {previous:21.1f}")
+
+if __name__ == "__main__":
+  main()
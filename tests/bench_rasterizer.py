@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import blender_stubs # noqa: F401
+from f64render.material.parser import F64Material, DRAW_FLAG_ALPHA_BLEND
+from f64render.material.ubo import ubo_build_batch
+from f64render.raster.rasterizer import vertex_stage, render_image, material_from_ubo, EMPTY_TEXTURE
+
+# Renders a synthetic scene with the software rasterizer, once per thread count.
+# Usage: python tests/bench_rasterizer.py [triangles] [width] [height]
+
+G_TF_BILERP = 2 << 12
+G_SHADE_SMOOTH = 1 << 17
+
+def build_scene(tri_count: int, width: int, height: int, seed: int = 1) -> list:
+  rng = np.random.default_rng(seed)
+  tile_conf = np.array([32, 32, 32, 32, 1, 1, 1, 1, 0, 0, 0, 0, 31, 31, 31, 31], dtype=np.float32)
+  materials = [
+    # textured & shaded opaque
+    F64Material(cc=np.array([3, 0, 6, 0] * 4, dtype=np.int32), blender=(2, 6, 3, 9) * 2, othermode_h=G_TF_BILERP,
+      tile_conf=tile_conf, geo_mode=G_SHADE_SMOOTH, alphaClip=-1),
+    # vertex colors, alpha blended
+    F64Material(cc=np.array([0, 0, 0, 6] * 4, dtype=np.int32), blender=(2, 6, 3, 9) * 2,
+      tile_conf=tile_conf, geo_mode=G_SHADE_SMOOTH, flags=DRAW_FLAG_ALPHA_BLEND, alphaClip=-1),
+  ]
+  draw_mat = np.arange(8) % len(materials)
+  ubo = ubo_build_batch(materials, draw_mat, ((1, 1, 1, 1), (0, 0, 0, 0)), ((0, 0, 1), (0, 0, 1)),
+    (0.5, 0.5, 0.5, 1), (1, 1, 1, 1), (0.5, 0.5, 0.5, 0.5))
+  tex = rng.random((32, 32, 4), dtype=np.float32)
+
+  draws = []
+  per_draw = tri_count // len(draw_mat)
+  for i, mat_idx in enumerate(draw_mat):
+    # random triangles between 2% and 20% of the screen in size, in front of the camera
+    center = rng.uniform(-1, 1, (per_draw, 1, 3)) * (1, 1, 0)
+    vert = (center + rng.uniform(-1, 1, (per_draw, 3, 3)) * rng.uniform(0.02, 0.2, (per_draw, 1, 1))).reshape(-1, 3)
+    vert[:, 2] = rng.uniform(-0.9, 0.9, (per_draw, 1)).repeat(3)
+    vert = vert.astype(np.float32)
+    count = len(vert)
+    norm = np.tile(np.array([0, 0, 1], dtype=np.float32), (count, 1))
+    color = rng.random((count, 4), dtype=np.float32)
+    uv = rng.random((count, 2), dtype=np.float32)
+    tris = np.arange(count, dtype=np.int32).reshape(-1, 3)
+
+    f64mat = materials[mat_idx]
+    draw = vertex_stage(vert, norm, color, uv, tris, np.eye(4, dtype=np.float32), np.eye(3, dtype=np.float32),
+      material_from_ubo(f64mat, ubo[i]), ubo[i], tex, EMPTY_TEXTURE, (width, height), 'NONE')
+    if draw is not None:
+      draws.append(draw)
+  return draws
+
+def main():
+  tri_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+  width = int(sys.argv[2]) if len(sys.argv) > 2 else 640
+  height = int(sys.argv[3]) if len(sys.argv) > 3 else 480
+  draws = build_scene(tri_count, width, height)
+
+  cores = os.cpu_count() or 1
+  print(f"{tri_count} triangles, {width}x{height}, {cores} cores")
+  workers = 1
+  while True:
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+      start = time.perf_counter()
+      render_image(draws, width, height, pool)
+      print(f"  {workers:2d} threads: {(time.perf_counter() - start) * 1000:8.1f} ms")
+    if workers >= cores:
+      break
+    workers = min(workers * 2, cores)
+
+if __name__ == "__main__":
+  main()
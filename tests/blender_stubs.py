@@ -0,0 +1,31 @@
+import pathlib
+import sys
+import types
+
+# Stand-ins for the blender modules, so the numpy-only parts of the addon can be tested without blender.
+# The addon itself is registered as the package 'f64render' without running its '__init__' (auto_load).
+
+class _StubModule(types.ModuleType):
+  def __getattr__(self, name):
+    if name.startswith("__"):
+      raise AttributeError(name)
+    return _StubModule(name)
+
+  def __call__(self, *args, **kwargs):
+    return _StubModule("call")
+
+  def __mro_entries__(self, bases):
+    return (type(self.__name__, (), {}),) # e.g. 'bpy.types.Operator' as a base class
+
+for name in ("bpy", "bpy.types", "bpy.props", "bpy.path", "gpu", "gpu.types", "bmesh", "mathutils", "addon_utils", "bpy_extras", "bpy_extras.io_utils"):
+  sys.modules.setdefault(name, _StubModule(name))
+
+ADDON_PATH = pathlib.Path(__file__).resolve().parent.parent
+
+if "f64render" not in sys.modules:
+  package = types.ModuleType("f64render")
+  package.__path__ = [str(ADDON_PATH)]
+  package.__file__ = str(ADDON_PATH / "__init__.py")
+  sys.modules["f64render"] = package
+  # pytest imports the '__init__' of the addon folder by its directory name, this makes it use the same package
+  sys.modules.setdefault(ADDON_PATH.name, package)
@@ -0,0 +1 @@
+import blender_stubs # noqa: F401, needs to be imported before any addon module
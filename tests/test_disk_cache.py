@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bench_disk_cache import grid_mesh_arrays
+from f64render.mesh import disk_cache
+from f64render.mesh.mesh import mesh_arrays_hash, mesh_arrays_to_buffers
+from f64render.mesh.disk_cache import MeshDiskCache, DISK_CACHE_ARRAYS
+
+def test_store_load_roundtrip(tmp_path):
+  arrays = grid_mesh_arrays(4)
+  buffers = mesh_arrays_to_buffers(arrays)
+  cache = MeshDiskCache(str(tmp_path))
+  key = mesh_arrays_hash(arrays)
+
+  assert cache.load(key) is None
+  cache.store(key, buffers)
+  loaded = cache.load(key)
+  for name in DISK_CACHE_ARRAYS:
+    np.testing.assert_array_equal(getattr(loaded, name), getattr(buffers, name))
+
+def test_clear_keeps_other_files(tmp_path):
+  (tmp_path / "level.blend").write_bytes(b"BLENDER")
+  cache = MeshDiskCache(str(tmp_path))
+  arrays = grid_mesh_arrays(2)
+  cache.store(mesh_arrays_hash(arrays), mesh_arrays_to_buffers(arrays))
+
+  cache.clear()
+  assert not cache.path.exists()
+  assert (tmp_path / "level.blend").read_bytes() == b"BLENDER"
+
+def test_clear_removes_empty_base_dir(tmp_path):
+  base = tmp_path / "f64render_cache"
+  cache = MeshDiskCache(str(base))
+  arrays = grid_mesh_arrays(2)
+  cache.store(mesh_arrays_hash(arrays), mesh_arrays_to_buffers(arrays))
+
+  cache.clear()
+  assert not base.exists()
+
+def test_store_keeps_existing_entry(tmp_path):
+  cache = MeshDiskCache(str(tmp_path))
+  arrays = grid_mesh_arrays(2)
+  key = mesh_arrays_hash(arrays)
+  cache.store(key, mesh_arrays_to_buffers(arrays))
+  entry_file = cache.entry_path(key) / "vert.npy"
+  inode = entry_file.stat().st_ino
+
+  cache.store(key, mesh_arrays_to_buffers(arrays))
+  assert entry_file.stat().st_ino == inode
+  assert [p.name for p in cache.entry_path(key).parent.iterdir()] == [key] # no temp. directories left
+
+def test_store_race_lost_is_success(tmp_path, monkeypatch, capsys):
+  cache = MeshDiskCache(str(tmp_path))
+  arrays = grid_mesh_arrays(2)
+  buffers = mesh_arrays_to_buffers(arrays)
+  key = mesh_arrays_hash(arrays)
+
+  # another writer publishes the same entry while this one is writing its temp. directory
+  os_replace = disk_cache.os.replace
+  def replace_after_other_writer(src, dst):
+    monkeypatch.setattr(disk_cache.os, "replace", os_replace)
+    cache.store(key, buffers)
+    os_replace(src, dst)
+  monkeypatch.setattr(disk_cache.os, "replace", replace_after_other_writer)
+
+  cache.store(key, buffers)
+  assert capsys.readouterr().out == ""
+  assert cache.load(key) is not None
+  assert [p.name for p in cache.entry_path(key).parent.iterdir()] == [key]
+
+def test_concurrent_stores(tmp_path):
+  cache = MeshDiskCache(str(tmp_path))
+  arrays = grid_mesh_arrays(8)
+  buffers = mesh_arrays_to_buffers(arrays)
+  key = mesh_arrays_hash(arrays)
+
+  with ThreadPoolExecutor(max_workers=8) as pool:
+    for future in [pool.submit(cache.store, key, buffers) for _ in range(32)]:
+      future.result()
+  loaded = cache.load(key)
+  np.testing.assert_array_equal(loaded.indices, buffers.indices)
+  assert [p.name for p in cache.entry_path(key).parent.iterdir()] == [key]
+
+def test_corrupted_entry_is_replaced(tmp_path):
+  cache = MeshDiskCache(str(tmp_path))
+  arrays = grid_mesh_arrays(2)
+  key = mesh_arrays_hash(arrays)
+  cache.store(key, mesh_arrays_to_buffers(arrays))
+  (cache.entry_path(key) / "vert.npy").write_bytes(b"broken")
+
+  assert cache.load(key) is None
+  cache.store(key, mesh_arrays_to_buffers(arrays))
+  assert cache.load(key) is not None
@@ -0,0 +1,42 @@
+import numpy as np
+
+from bench_disk_cache import grid_mesh_arrays
+from f64render.mesh.mesh import mesh_arrays_to_buffers
+
+# Triangles of each material as (T, 3, attributes), this is what the renderer draws from the buffers
+def material_triangles(buffers) -> list[np.ndarray]:
+  attributes = np.concatenate([buffers.vert, buffers.norm, buffers.color, buffers.uv], axis=1)
+  offsets = buffers.index_offsets // 3
+  return [attributes[buffers.indices[offsets[i]:offsets[i + 1]]] for i in range(len(offsets) - 1)]
+
+def split_normal_arrays(size: int):
+  arrays = grid_mesh_arrays(size, mat_count=3)
+  # split normals on every other quad: corners sharing a vertex with a neighboring quad differ then
+  quad_normals = np.where((np.arange(size * size) % 2 == 0)[:, None], [0, 0, 1], [0, 1, 0]).astype(np.float32)
+  arrays.normals = np.repeat(quad_normals, 4, axis=0)
+  arrays.tri_hidden[::7] = 1
+  return arrays
+
+def test_indexed_matches_non_indexed():
+  arrays = split_normal_arrays(6)
+  flat = mesh_arrays_to_buffers(arrays, deduplicate=False)
+  indexed = mesh_arrays_to_buffers(arrays, deduplicate=True)
+
+  np.testing.assert_array_equal(indexed.index_offsets, flat.index_offsets)
+  for tris_indexed, tris_flat in zip(material_triangles(indexed), material_triangles(flat)):
+    np.testing.assert_array_equal(tris_indexed, tris_flat)
+  np.testing.assert_array_equal(indexed.bounds, flat.bounds)
+
+def test_deduplicate_keeps_split_corners():
+  size = 6
+  arrays = split_normal_arrays(size)
+  indexed = mesh_arrays_to_buffers(arrays, deduplicate=True)
+
+  # corners with the same attributes are merged, corners of a shared vertex with split normals are not
+  vertex_count = (size + 1) ** 2
+  assert vertex_count < len(indexed.vert) < len(arrays.tri_verts)
+  unique = np.unique(np.concatenate([indexed.vert, indexed.norm, indexed.color, indexed.uv], axis=1), axis=0)
+  assert len(unique) == len(indexed.vert)
+
+  smooth = mesh_arrays_to_buffers(grid_mesh_arrays(size, mat_count=3), deduplicate=True)
+  assert len(smooth.vert) == vertex_count
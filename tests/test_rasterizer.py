@@ -0,0 +1,191 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from f64render.material.parser import F64Material, DRAW_FLAG_DECAL
+from f64render.material.texture import TEX_QUANTIZE_NONE
+from f64render.material.ubo import UBO_DTYPE
+from f64render.raster.rasterizer import vertex_stage, render_tile, _clip_near, EMPTY_TEXTURE, NEAR_W
+from f64render.raster.sampler import sample_point, sample_filtered
+from f64render.raster.scene import get_texture
+
+WIDTH, HEIGHT = 64, 48
+
+def perspective(fov_y: float, aspect: float, near: float = 0.1, far: float = 100.0) -> np.ndarray:
+  f = 1.0 / np.tan(fov_y / 2)
+  return np.array([
+    [f / aspect, 0, 0, 0],
+    [0, f, 0, 0],
+    [0, 0, (far + near) / (near - far), 2 * far * near / (near - far)],
+    [0, 0, -1, 0],
+  ], dtype=np.float32)
+
+def fallback_ubo(flags: int = 0) -> np.void:
+  ubo = np.zeros(1, dtype=UBO_DTYPE)[0]
+  ubo["light_dir"][0, 3] = -1.0 # no alpha clip
+  ubo["modes"][3] = flags
+  return ubo
+
+# Single colored draw (the path of non-f3d objects)
+def color_draw(vert: np.ndarray, tris: np.ndarray, mvp: np.ndarray, color=(1, 0, 0, 1), cull: str = 'NONE', flags: int = 0):
+  count = len(vert)
+  draw = vertex_stage(np.asarray(vert, dtype=np.float32), np.tile(np.float32([0, 0, 1]), (count, 1)), np.ones((count, 4), dtype=np.float32),
+    np.zeros((count, 2), dtype=np.float32), np.asarray(tris, dtype=np.int32), mvp, np.eye(3, dtype=np.float32), F64Material(),
+    fallback_ubo(flags), EMPTY_TEXTURE, EMPTY_TEXTURE, (WIDTH, HEIGHT), cull)
+  if draw is not None:
+    draw.color = np.float32(color)
+  return draw
+
+# Returns the coverage of each pixel
+def render_coverage(vert: np.ndarray, tris: np.ndarray, mvp: np.ndarray, cull: str = 'NONE') -> np.ndarray:
+  draw = color_draw(vert, tris, mvp, cull=cull)
+  if draw is None:
+    return np.zeros((HEIGHT, WIDTH), dtype=bool)
+  return render_tile([draw], 0, 0, WIDTH, HEIGHT)[:, :, 3] == 1.0
+
+def test_ground_crossing_camera_plane():
+  # ground 1 unit below the camera, reaching from behind the camera to 20 units in front of it
+  vert = np.array([[-50, -1, 20], [50, -1, 20], [50, -1, -20], [-50, -1, -20]])
+  tris = np.array([[0, 1, 2], [0, 2, 3]], dtype=np.int32)
+  coverage = render_coverage(vert, tris, perspective(np.pi / 2, WIDTH / HEIGHT))
+
+  # the far edge is at NDC y = -1/20, everything below it is ground
+  row_ndc = (np.arange(HEIGHT) + 0.5) / HEIGHT * 2 - 1
+  assert coverage[row_ndc < -0.06].all()
+  assert not coverage[row_ndc > -0.04].any()
+
+def test_clip_near_split():
+  # corners: clip-space position + one varying, the first corner is behind the camera
+  corners = np.array([[
+    [0, 0, 0, -1, 0],
+    [1, 0, 0, 1, 1],
+    [0, 1, 0, 3, 2],
+  ]], dtype=np.float64)
+  clipped, source = _clip_near(corners)
+
+  assert len(clipped) == 2 and list(source) == [0, 0]
+  assert (clipped[:, :, 3] >= NEAR_W * 0.999).all()
+  # new corners lie on the edges, with the varying interpolated the same way as the position
+  np.testing.assert_allclose(clipped[:, :, 4], clipped[:, :, 0] + 2 * clipped[:, :, 1])
+  np.testing.assert_allclose(clipped[:, :, 3], clipped[:, :, 4] * 2 - 1)
+
+  # winding is kept (signed area in x/y)
+  def area(tri):
+    a, b, c = tri[:, :2]
+    return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+  assert all(np.sign(area(tri)) == np.sign(area(corners[0])) for tri in clipped)
+
+def test_clip_near_shorten_and_drop():
+  corners = np.array([
+    [[0, 0, 0, 1, 0], [1, 0, 0, -1, 0], [0, 1, 0, -1, 0]], # two corners behind
+    [[0, 0, 0, -1, 0], [1, 0, 0, -1, 0], [0, 1, 0, -1, 0]], # fully behind
+    [[0, 0, 0, 1, 0], [1, 0, 0, 1, 0], [0, 1, 0, 1, 0]], # fully in front
+  ], dtype=np.float64)
+  clipped, source = _clip_near(corners)
+
+  assert list(source) == [0, 2]
+  np.testing.assert_array_equal(clipped[0, 0], corners[0, 0])
+  np.testing.assert_allclose(clipped[0, 1:, 3], NEAR_W)
+  np.testing.assert_array_equal(clipped[1], corners[2])
+
+def test_tex1_uv_uses_tex0_size():
+  tex0, tex1 = np.zeros((32, 16, 4), dtype=np.float32), np.zeros((8, 8, 4), dtype=np.float32)
+  ubo = fallback_ubo()
+  ubo["tile_conf"][4:8] = 1.0 # shift
+  uv = np.float32([[0.5, 0.25], [0.75, 0.25], [0.5, 0.5]])
+  vert = np.float32([[0, 0, 0], [0.5, 0, 0], [0, 0.5, 0]])
+  draw = vertex_stage(vert, np.tile(np.float32([0, 0, 1]), (3, 1)), np.ones((3, 4), dtype=np.float32), uv, np.int32([[0, 1, 2]]),
+    np.eye(4, dtype=np.float32), np.eye(3, dtype=np.float32), F64Material(), ubo, tex0, tex1, (WIDTH, HEIGHT), 'NONE')
+
+  expected = uv * (16, 32) - 0.5
+  np.testing.assert_allclose(draw.uv[0, :, 0:2], expected)
+  np.testing.assert_allclose(draw.uv[0, :, 2:4], expected) # not scaled by the 8x8 size of tex1
+
+class MockPixels:
+  def __init__(self, values: np.ndarray):
+    self.values = values
+
+  def foreach_get(self, out: np.ndarray):
+    out[:] = self.values
+
+def mock_image(name: str, uid: int, width: int, height: int, value: float = 0.0):
+  return SimpleNamespace(name=name, session_uid=uid, size=(width, height), is_float=True,
+    colorspace_settings=SimpleNamespace(name='Non-Color'), pixels=MockPixels(np.full(width * height * 4, value, dtype=np.float32)))
+
+def test_zero_size_image_is_empty_texture():
+  textures = {}
+  assert get_texture((mock_image("missing.png", 1, 0, 0), TEX_QUANTIZE_NONE), textures) is EMPTY_TEXTURE
+  assert get_texture(None, textures) is EMPTY_TEXTURE
+  assert len(textures) == 0
+
+def test_textures_keyed_by_session_uid():
+  textures = {}
+  local, linked = mock_image("wall.png", 1, 2, 2, 0.25), mock_image("wall.png", 2, 4, 2, 0.75)
+  pixels_local = get_texture((local, TEX_QUANTIZE_NONE), textures)
+  pixels_linked = get_texture((linked, TEX_QUANTIZE_NONE), textures)
+
+  assert pixels_local.shape == (2, 2, 4) and (pixels_local == 0.25).all()
+  assert pixels_linked.shape == (2, 4, 4) and (pixels_linked == 0.75).all()
+
+def test_backface_culling():
+  ccw = [[-0.5, -0.5, 0], [0.5, -0.5, 0], [0, 0.5, 0]] # counter-clockwise on screen (y up)
+  cw = ccw[::-1]
+  mvp = np.eye(4, dtype=np.float32)
+
+  assert render_coverage(ccw, [[0, 1, 2]], mvp, 'BACK').any()
+  assert not render_coverage(cw, [[0, 1, 2]], mvp, 'BACK').any()
+  assert not render_coverage(ccw, [[0, 1, 2]], mvp, 'FRONT').any()
+  assert render_coverage(cw, [[0, 1, 2]], mvp, 'FRONT').any()
+  assert render_coverage(cw, [[0, 1, 2]], mvp, 'NONE').any()
+
+# Screen covering triangle at a distance in front of the camera
+def full_screen_tri(distance: float) -> np.ndarray:
+  return np.float32([[-4 * distance, -4 * distance, -distance], [4 * distance, -4 * distance, -distance], [0, 4 * distance, -distance]])
+
+def test_depth_resolve():
+  mvp = perspective(np.pi / 2, WIDTH / HEIGHT)
+  near = color_draw(full_screen_tri(2), [[0, 1, 2]], mvp, color=(1, 0, 0, 1))
+  far = color_draw(full_screen_tri(5), [[0, 1, 2]], mvp, color=(0, 0, 1, 1))
+
+  for draws in ([near, far], [far, near]):
+    image = render_tile(draws, 0, 0, WIDTH, HEIGHT)
+    np.testing.assert_array_equal(image[:, :, :3], np.broadcast_to([1, 0, 0], (HEIGHT, WIDTH, 3)))
+
+def test_decal_resolve():
+  mvp = perspective(np.pi / 2, WIDTH / HEIGHT)
+  ground = color_draw(full_screen_tri(2), [[0, 1, 2]], mvp, color=(1, 0, 0, 1))
+  decal = color_draw(full_screen_tri(2), [[0, 1, 2]], mvp, color=(0, 1, 0, 1), flags=DRAW_FLAG_DECAL)
+  decal_off = color_draw(full_screen_tri(3), [[0, 1, 2]], mvp, color=(0, 0, 1, 1), flags=DRAW_FLAG_DECAL)
+  far = color_draw(full_screen_tri(5), [[0, 1, 2]], mvp, color=(1, 1, 0, 1))
+
+  # a decal only shows on a surface at (almost) the same depth, and writes no depth itself
+  image = render_tile([ground, decal, decal_off], 0, 0, WIDTH, HEIGHT)
+  assert (image[:, :, :3] == (0, 1, 0)).all()
+  image = render_tile([decal, far], 0, 0, WIDTH, HEIGHT)
+  assert (image[:, :, :3] == (1, 1, 0)).all()
+
+# 4x4 texture with unique texels, tile settings as in 'tile_conf': mask, shift, low, high (S/T for both textures)
+SAMPLE_TEX = (np.arange(64, dtype=np.float32) / 64).reshape((4, 4, 4))
+
+def sample_tile_conf(mask: float, high: float) -> np.ndarray:
+  return np.float32([mask] * 4 + [1] * 4 + [0] * 4 + [high] * 4)
+
+def sample(sampler, uv, mask: float, high: float) -> np.ndarray:
+  tile_conf = sample_tile_conf(mask, high)
+  uv = np.tile(np.float32([uv]), (1, 2))
+  return sampler(SAMPLE_TEX, SAMPLE_TEX, uv, tile_conf, np.abs(tile_conf[12:16]))[0][0]
+
+def test_point_sampling():
+  np.testing.assert_array_equal(sample(sample_point, (1.2, 2.4), 4, 3), SAMPLE_TEX[2, 1])
+  np.testing.assert_array_equal(sample(sample_point, (1.6, 2.4), 4, 3), SAMPLE_TEX[2, 2]) # rounds to the nearest texel
+  np.testing.assert_array_equal(sample(sample_point, (5.0, 1.0), 4, 3), SAMPLE_TEX[1, 1]) # wrap
+  np.testing.assert_array_equal(sample(sample_point, (5.0, 1.0), 4, -3), SAMPLE_TEX[1, 2]) # mirror
+  np.testing.assert_array_equal(sample(sample_point, (5.0, 1.0), 0, 2), SAMPLE_TEX[1, 2]) # clamp
+
+def test_filtered_sampling():
+  np.testing.assert_allclose(sample(sample_filtered, (1.0, 2.0), 4, 3), SAMPLE_TEX[2, 1])
+  np.testing.assert_allclose(sample(sample_filtered, (1.5, 2.0), 4, 3), (SAMPLE_TEX[2, 1] + SAMPLE_TEX[2, 2]) / 2)
+  # across the edge of the tile
+  np.testing.assert_allclose(sample(sample_filtered, (3.5, 1.0), 4, 3), (SAMPLE_TEX[1, 3] + SAMPLE_TEX[1, 0]) / 2) # wrap
+  np.testing.assert_allclose(sample(sample_filtered, (3.5, 1.0), 4, -3), SAMPLE_TEX[1, 3]) # mirror
+  np.testing.assert_allclose(sample(sample_filtered, (3.5, 1.0), 0, 2), SAMPLE_TEX[1, 2]) # clamp
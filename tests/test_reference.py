@@ -0,0 +1,102 @@
+import numpy as np
+
+from f64render.material.parser import F64Material
+from f64render.material.reference import (
+  cc_evaluate, cc_fetch_color, cc_overflow, blender_evaluate, tex_prepare, CCConstants, GAMMA_FACTOR,
+  CC_C_0, CC_C_COMB, CC_C_PRIM, CC_C_SHADE, CC_C_ENV, CC_C_SHADE_ALPHA,
+  CC_A_0, CC_A_1, CC_A_COMB, CC_A_PRIM, CC_A_ENV,
+  BLENDER_0, BLENDER_1, BLENDER_CLR_IN, BLENDER_CLR_MEM, BLENDER_A_IN, BLENDER_A_SHADE, BLENDER_1MA, BLENDER_A_MEM,
+)
+from f64render.material.variant import G_CYC_2CYCLE
+
+# Checks the reference against the formulas of 'main3d.frag.glsl'
+
+PRIM = (0.8, 0.4, 0.2, 0.6)
+ENV = (0.5, 0.25, 1.0, 0.3)
+
+def glsl_mod(x, y):
+  return x - y * np.floor(x / y)
+
+def cc_material(cycle0: tuple, cycle1: tuple = None, two_cycle: bool = False) -> F64Material:
+  cycle1 = cycle1 or cycle0
+  return F64Material(
+    color_prim=PRIM, color_env=ENV, cc=np.array(cycle0 + cycle1, dtype=np.int32),
+    othermode_h=G_CYC_2CYCLE if two_cycle else 0,
+  )
+
+def test_cc_overflow():
+  values = np.array([-2.0, -0.6, -0.5, -0.4, 0.0, 0.5, 1.0, 1.4, 1.5, 1.6, 3.2], dtype=np.float32)
+  np.testing.assert_allclose(cc_overflow(values), glsl_mod(values + 0.5, 2.0) - 0.5, atol=1e-6)
+  # -0.5 to 1.5 is kept as is (clamped later), outside of that it wraps around
+  np.testing.assert_allclose(cc_overflow(values)[[2, 3, 4, 5, 6, 7]], values[[2, 3, 4, 5, 6, 7]], atol=1e-6)
+  np.testing.assert_allclose(cc_overflow(values)[[1, 8, 9]], [1.4, -0.5, -0.4], atol=1e-6)
+
+def test_cc_cycle_selection():
+  shade = np.ones((1, 4), dtype=np.float32)
+  cycle0 = (CC_C_0, CC_C_0, CC_C_0, CC_C_PRIM, CC_A_0, CC_A_0, CC_A_0, CC_A_PRIM) # prim
+  cycle1 = (CC_C_COMB, CC_C_0, CC_C_ENV, CC_C_0, CC_A_COMB, CC_A_0, CC_A_ENV, CC_A_0) # comb * env
+
+  one_cycle = cc_evaluate(cc_material(cycle0, cycle1, two_cycle=False), shade)
+  two_cycle = cc_evaluate(cc_material(cycle0, cycle1, two_cycle=True), shade)
+
+  prim, env = np.array(PRIM), np.array(ENV)
+  np.testing.assert_allclose(one_cycle[0, :3], prim[:3] ** GAMMA_FACTOR, rtol=1e-5)
+  np.testing.assert_allclose(one_cycle[0, 3], prim[3], rtol=1e-5)
+  np.testing.assert_allclose(two_cycle[0, :3], (prim[:3] * env[:3]) ** GAMMA_FACTOR, rtol=1e-5)
+  np.testing.assert_allclose(two_cycle[0, 3], prim[3] * env[3], rtol=1e-5)
+
+def test_shade_alpha_is_gamma_corrected():
+  shade = np.array([[0.2, 0.3, 0.4, 0.25]], dtype=np.float32)
+  consts = CCConstants(cc_material((CC_C_0,) * 4 + (CC_A_0,) * 4))
+  zero = np.zeros((1, 4), dtype=np.float32)
+  fetched = cc_fetch_color(CC_C_SHADE_ALPHA, consts, shade, zero, zero, zero, np.zeros(1))
+  np.testing.assert_allclose(fetched, np.full((1, 3), 0.25 ** (1.0 / GAMMA_FACTOR)), rtol=1e-5)
+
+  # shade color is used as is, shade alpha in gamma space: only the latter survives the final 'gammaToLinear'
+  alpha_as_color = cc_evaluate(cc_material((CC_C_0, CC_C_0, CC_C_0, CC_C_SHADE_ALPHA, CC_A_0, CC_A_0, CC_A_0, CC_A_1)), shade)
+  color = cc_evaluate(cc_material((CC_C_0, CC_C_0, CC_C_0, CC_C_SHADE, CC_A_0, CC_A_0, CC_A_0, CC_A_1)), shade)
+  np.testing.assert_allclose(alpha_as_color[0, :3], 0.25, rtol=1e-5)
+  np.testing.assert_allclose(color[0, :3], shade[0, :3] ** GAMMA_FACTOR, rtol=1e-5)
+
+def test_tex_prepare():
+  texels = np.array([[0.25, 0.5, 0.75, 0.6]], dtype=np.float32)
+  gamma = texels[0, :3] ** (1.0 / GAMMA_FACTOR)
+
+  np.testing.assert_allclose(tex_prepare(texels, mono=False)[0], [*gamma, 0.6], rtol=1e-5)
+  np.testing.assert_allclose(tex_prepare(texels, mono=True)[0], [gamma[0]] * 4, rtol=1e-5) # 'rrrr' after the gamma conversion
+  np.testing.assert_array_equal(texels, np.float32([[0.25, 0.5, 0.75, 0.6]])) # input is left untouched
+
+def blend(cycle0: tuple, cycle1: tuple, cc_value, framebuffer, shade=(1, 1, 1, 1)) -> np.ndarray:
+  f64mat = F64Material(blender=cycle0 + cycle1)
+  return blender_evaluate(f64mat, np.array([cc_value], dtype=np.float32), np.array([framebuffer], dtype=np.float32),
+    np.array([shade], dtype=np.float32))[0]
+
+PASS_THROUGH = (BLENDER_CLR_IN, BLENDER_0, BLENDER_CLR_IN, BLENDER_1) # second cycle returning the first one
+
+def test_blender_a_in():
+  cc_value, framebuffer = np.array([0.8, 0.6, 0.4, 0.3]), np.array([0.1, 0.2, 0.3, 1.0])
+  res = blend((BLENDER_CLR_IN, BLENDER_A_IN, BLENDER_CLR_MEM, BLENDER_1MA), PASS_THROUGH, cc_value, framebuffer)
+
+  alpha = cc_value[3] ** (1.0 / GAMMA_FACTOR) # the blender sees the CC alpha in gamma space
+  np.testing.assert_allclose(res[:3], cc_value[:3] * alpha + framebuffer[:3] * (1 - alpha), rtol=1e-5)
+
+def test_blender_1ma_uses_first_operand():
+  cc_value, framebuffer, shade = np.array([0.8, 0.6, 0.4, 0.3]), np.array([0.1, 0.2, 0.3, 1.0]), np.array([1, 1, 1, 0.7])
+  res = blend((BLENDER_CLR_IN, BLENDER_A_SHADE, BLENDER_CLR_MEM, BLENDER_1MA), PASS_THROUGH, cc_value, framebuffer, shade)
+  np.testing.assert_allclose(res[:3], cc_value[:3] * 0.7 + framebuffer[:3] * 0.3, rtol=1e-5)
+
+def test_blender_a_mem_is_zero():
+  cc_value, framebuffer = np.array([0.8, 0.6, 0.4, 0.3]), np.array([0.1, 0.2, 0.3, 1.0])
+  # with the framebuffer alpha (1.0) this would be an average of both colors
+  res = blend((BLENDER_CLR_IN, BLENDER_1, BLENDER_CLR_MEM, BLENDER_A_MEM), PASS_THROUGH, cc_value, framebuffer)
+  np.testing.assert_allclose(res[:3], cc_value[:3], rtol=1e-5)
+
+def test_blender_second_cycle_alpha():
+  cc_value, framebuffer = np.array([0.8, 0.6, 0.4, 0.3]), np.array([0.1, 0.2, 0.3, 1.0])
+  # first cycle result is passed on with the linear CC alpha, which the second cycle reads via 'A_IN'
+  res = blend((BLENDER_CLR_MEM, BLENDER_0, BLENDER_CLR_MEM, BLENDER_1), PASS_THROUGH, cc_value, framebuffer)
+  np.testing.assert_allclose(res, [*framebuffer[:3], 0.3], rtol=1e-5)
+
+  res = blend((BLENDER_CLR_MEM, BLENDER_0, BLENDER_CLR_MEM, BLENDER_1), (BLENDER_1, BLENDER_A_IN, BLENDER_0, BLENDER_1MA),
+    cc_value, framebuffer)
+  np.testing.assert_allclose(res[:3], 0.3, rtol=1e-5)
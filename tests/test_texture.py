@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from f64render.material import cache as material_cache
+from f64render.material import texture
+from f64render.material.parser import F64Material
+from f64render.material.texture import quantize_pixels, get_tex_quantize, TEX_QUANTIZE_NONE, TEX_QUANTIZE_4BIT, TEX_QUANTIZE_3BIT
+
+# 'quantize_pixels' replaces the per-fetch quantization of the fragment shader, these are the GLSL versions:
+#   vec4 quantize4Bit(in vec4 color) { return round(color * 16.0) / 16.0; }
+#   vec4 quantize3Bit(in vec4 color) { return vec4(round(color.rgb * 8.0) / 8.0, step(0.5, color.a)); }
+# (GLSL leaves the direction of 'round' for .5 to the implementation, exact halves are not tested)
+
+def glsl_quantize4Bit(color):
+  return [round(c * 16.0) / 16.0 for c in color]
+
+def glsl_quantize3Bit(color):
+  return [round(c * 8.0) / 8.0 for c in color[:3]] + [0.0 if color[3] < 0.5 else 1.0]
+
+def random_pixels(count: int, seed: int = 1) -> np.ndarray:
+  pixels = np.random.default_rng(seed).random((count, 4), dtype=np.float32)
+  # move values away from exact halves, see above
+  for steps in (16, 8):
+    scaled = pixels * steps
+    tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-3
+    pixels[tie] += 0.01
+  return pixels
+
+@pytest.mark.parametrize("quantize, reference", [
+  (TEX_QUANTIZE_4BIT, glsl_quantize4Bit),
+  (TEX_QUANTIZE_3BIT, glsl_quantize3Bit),
+])
+def test_matches_glsl(quantize, reference):
+  pixels = random_pixels(1000)
+  result = quantize_pixels(pixels, quantize)
+  expected = np.array([reference(texel.tolist()) for texel in pixels], dtype=np.float32)
+  np.testing.assert_allclose(result, expected, atol=1e-6)
+
+def test_levels_are_kept():
+  levels = np.arange(17, dtype=np.float32) / 16.0
+  pixels = np.repeat(levels[:, None], 4, axis=1)
+  np.testing.assert_array_equal(quantize_pixels(pixels, TEX_QUANTIZE_4BIT), pixels)
+
+  levels = np.arange(9, dtype=np.float32) / 8.0
+  pixels = np.stack([levels, levels, levels, np.where(levels >= 0.5, 1.0, 0.0)], axis=1).astype(np.float32)
+  np.testing.assert_array_equal(quantize_pixels(pixels, TEX_QUANTIZE_3BIT), pixels)
+
+def test_alpha_threshold():
+  pixels = np.array([[0, 0, 0, 0.4999], [0, 0, 0, 0.5], [0, 0, 0, 1.0]], dtype=np.float32)
+  assert quantize_pixels(pixels, TEX_QUANTIZE_3BIT)[:, 3].tolist() == [0.0, 1.0, 1.0]
+
+def test_input_not_modified():
+  pixels = random_pixels(16)
+  original = pixels.copy()
+  quantize_pixels(pixels, TEX_QUANTIZE_3BIT)
+  quantize_pixels(pixels, TEX_QUANTIZE_4BIT)
+  np.testing.assert_array_equal(pixels, original)
+
+def test_formats():
+  assert get_tex_quantize('I4') == TEX_QUANTIZE_4BIT
+  assert get_tex_quantize('IA8') == TEX_QUANTIZE_4BIT
+  assert get_tex_quantize('IA4') == TEX_QUANTIZE_3BIT
+  for tex_format in ('I8', 'IA16', 'RGBA16', 'RGBA32', 'CI4', 'CI8'):
+    assert get_tex_quantize(tex_format) == TEX_QUANTIZE_NONE
+  pixels = random_pixels(16)
+  assert quantize_pixels(pixels, TEX_QUANTIZE_NONE) is pixels
+
+@pytest.fixture
+def texture_caches():
+  material_cache.material_cache_clear()
+  texture.texture_cache_clear()
+  yield
+  material_cache.material_cache_clear()
+  texture.texture_cache_clear()
+
+def cache_texture(image_uid: int, quantize: int = TEX_QUANTIZE_NONE):
+  texture.f64render_textureCache[(image_uid, quantize)] = texture.TextureCacheEntry(None, (), 64)
+  texture.f64render_tex_versions[image_uid] = 1
+
+def cache_material(mat_uid: int, tex0_image: int = None, tex1_image: int = None):
+  material_cache.f64render_materialCache[mat_uid] = material_cache.MaterialCacheEntry(
+    F64Material(tex0_image=tex0_image, tex1_image=tex1_image), (0, 0), b"", None)
+
+def test_prune_deleted_and_unused_images(texture_caches, monkeypatch):
+  cache_material(1, tex0_image=10, tex1_image=11)
+  cache_material(2, tex0_image=12)
+  cache_material(3, tex0_image=13) # material got deleted
+  for image_uid in (10, 11, 12, 13, 14):
+    cache_texture(image_uid)
+  cache_texture(10, TEX_QUANTIZE_4BIT)
+
+  # image 11 got deleted, 14 is not used by any material
+  images = [SimpleNamespace(session_uid=uid) for uid in (10, 12, 13, 14)]
+  materials = [SimpleNamespace(session_uid=uid) for uid in (1, 2)]
+  monkeypatch.setattr(material_cache.bpy, "data", SimpleNamespace(images=images, materials=materials), raising=False)
+
+  material_cache.material_cache_mark_all_dirty()
+  assert sorted(texture.f64render_textureCache) == [(10, TEX_QUANTIZE_NONE), (10, TEX_QUANTIZE_4BIT), (12, TEX_QUANTIZE_NONE)]
+  assert sorted(texture.f64render_tex_versions) == [10, 12]
+  assert texture.texture_cache_stats() == (3, 3 * 64)
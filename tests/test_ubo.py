@@ -0,0 +1,86 @@
+import random
+
+import numpy as np
+import pytest
+
+from f64render.material.parser import F64Material
+from f64render.material.ubo import ubo_build_batch, UNIFORM_BUFFER_STRUCT, UBO_SIZE
+
+# 'ubo_build_batch' has to produce the same bytes as packing each draw with 'UNIFORM_BUFFER_STRUCT',
+# which is how the UBOs were built per draw before (including the values inherited from previous draws).
+
+def random_values(rng: random.Random, count: int) -> tuple:
+  return tuple(rng.random() for _ in range(count))
+
+def random_material(rng: random.Random) -> F64Material:
+  return F64Material(
+    color_prim=random_values(rng, 4), lod_prim=random_values(rng, 2), prim_depth=random_values(rng, 2),
+    color_env=random_values(rng, 4), ck=random_values(rng, 8), convert=random_values(rng, 6),
+    color_ambient=random_values(rng, 4), color_light=random_values(rng, 4),
+    set_prim=rng.random() < 0.5, set_env=rng.random() < 0.5, set_ck=rng.random() < 0.5,
+    set_convert=rng.random() < 0.5, set_ambient=rng.random() < 0.5, set_light=rng.random() < 0.5,
+    cc=np.array([rng.randint(0, 20) for _ in range(16)], dtype=np.int32),
+    blender=tuple(rng.randint(0, 10) for _ in range(8)),
+    tile_conf=np.array(random_values(rng, 16), dtype=np.float32),
+    flags=rng.randint(0, 511), geo_mode=rng.randint(0, 1 << 18),
+    othermode_l=rng.randint(0, 1 << 16), othermode_h=rng.randint(0, 1 << 24), alphaClip=rng.random(),
+  )
+
+def pack_reference(materials, draw_mat_idx, light_color, light_dir, ambient_color, default_prim, default_env) -> list[bytes]:
+  last_prim, last_prim_lod, last_env = default_prim, (0, 0), default_env
+  last_ck, last_convert = (0,) * 8, (0,) * 6
+  result = []
+  for mat_idx in draw_mat_idx:
+    f64mat = materials[mat_idx]
+    result.append(UNIFORM_BUFFER_STRUCT.pack(
+      *f64mat.blender,
+      *f64mat.tile_conf,
+      *f64mat.cc,
+      f64mat.geo_mode,
+      f64mat.othermode_l,
+      f64mat.othermode_h,
+      f64mat.flags,
+      *(f64mat.color_light if f64mat.set_light      else light_color[0]),
+      *light_color[1],
+      *light_dir[0],
+      f64mat.alphaClip,
+      *light_dir[1],
+      0,
+      *(f64mat.color_prim    if f64mat.set_prim     else last_prim),
+      *(f64mat.color_env     if f64mat.set_env      else last_env),
+      *(f64mat.color_ambient if f64mat.set_ambient  else ambient_color),
+      *(f64mat.ck            if f64mat.set_ck       else last_ck),
+      *(f64mat.lod_prim      if f64mat.set_prim     else last_prim_lod),
+      *f64mat.prim_depth,
+      *(f64mat.convert       if f64mat.set_convert  else last_convert),
+    ))
+    if f64mat.set_prim: last_prim, last_prim_lod = f64mat.color_prim, f64mat.lod_prim
+    if f64mat.set_env: last_env = f64mat.color_env
+    if f64mat.set_ck: last_ck = f64mat.ck
+    if f64mat.set_convert: last_convert = f64mat.convert
+  return result
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_struct_pack(seed):
+  rng = random.Random(seed)
+  materials = [random_material(rng) for _ in range(rng.randint(1, 12))]
+  draw_mat_idx = np.array([rng.randrange(len(materials)) for _ in range(200)], dtype=np.int32)
+  args = (
+    (random_values(rng, 4), random_values(rng, 4)), (random_values(rng, 3), random_values(rng, 3)),
+    random_values(rng, 4), random_values(rng, 4), random_values(rng, 4),
+  )
+
+  ubo = ubo_build_batch(materials, draw_mat_idx, *args)
+  expected = pack_reference(materials, draw_mat_idx, *args)
+
+  assert len(ubo) == len(expected)
+  for i, ref in enumerate(expected):
+    data = ubo[i].tobytes()
+    assert len(data) == UBO_SIZE
+    assert data[:len(ref)] == ref, f"draw {i}"
+    assert data[len(ref):] == bytes(UBO_SIZE - len(ref)), f"padding of draw {i}"
+
+def test_no_draws():
+  ubo = ubo_build_batch([F64Material(blender=(0,) * 8, cc=np.zeros(16), tile_conf=np.zeros(16))], np.zeros(0, dtype=np.int32),
+    ((1, 1, 1, 1), (0, 0, 0, 0)), ((0, 0, 1), (0, 0, 1)), (0, 0, 0, 1), (1, 1, 1, 1), (0.5, 0.5, 0.5, 0.5))
+  assert len(ubo) == 0
@@ -0,0 +1,106 @@
+import random
+import re
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from blender_stubs import ADDON_PATH
+from f64render.material.parser import F64Material
+from f64render.material.ubo import ubo_build_batch
+from f64render.material.variant import get_variant_key, get_variant_defines, G_CYC_2CYCLE, G_TF_BILERP
+
+# A shader variant has to select the same CC/blender inputs and code paths as the uber-shader does via the UBO.
+# The macros the uber-shader falls back to (the '#ifndef VARIANT_...' blocks in main3d.frag.glsl) are evaluated
+# here in python against the UBO of a material, and compared with the values the variant defines bake in.
+
+SHADER_PATH = ADDON_PATH / "shader"
+
+def read_defines(source: str) -> dict[str, str]:
+  defines = {}
+  for name, body in re.findall(r"^\s*#define\s+(\w+(?:\(\))?)[ \t]+(.*?)\s*(?://.*)?$", source, re.MULTILINE):
+    defines[name] = body
+  return defines
+
+# Fallback macros of the uber-shader, by the 'VARIANT_...' define that replaces them
+def read_variant_blocks(source: str) -> dict[str, dict[str, str]]:
+  blocks = re.findall(r"#ifndef\s+(VARIANT_\w+)\n(.*?)#endif", source, re.DOTALL)
+  return {variant: read_defines(body) for variant, body in blocks}
+
+GLSL_DEFINES = {}
+for file in ("defines.glsl", "utils.glsl", "structs.glsl"):
+  GLSL_DEFINES.update(read_defines((SHADER_PATH / file).read_text()))
+VARIANT_BLOCKS = read_variant_blocks((SHADER_PATH / "main3d.frag.glsl").read_text())
+
+def expand(expr: str, defines: dict[str, str]) -> str:
+  for _ in range(16): # nested macros
+    expanded = expr
+    for name, body in defines.items():
+      pattern = re.escape(name) if name.endswith("()") else rf"\b{name}\b"
+      expanded = re.sub(pattern, lambda _: f"({body})", expanded)
+    if expanded == expr:
+      return expr
+    expr = expanded
+  raise RecursionError(expr)
+
+# Evaluates a GLSL expression of ints/bools/ivec4s, 'material' is the UBO as the shader sees it
+def glsl_eval(expr: str, material: SimpleNamespace):
+  expr = expand(expr, GLSL_DEFINES)
+  expr = expr.replace("true", "True").replace("false", "False")
+  return eval(expr, {"ivec4": lambda *v: tuple(v), "material": material})
+
+def ubo_to_material(ubo: np.void) -> SimpleNamespace:
+  cc = tuple(int(v) for v in ubo["cc"])
+  blender = tuple(int(v) for v in ubo["blender"])
+  return SimpleNamespace(
+    cc0Color=cc[0:4], cc0Alpha=cc[4:8], cc1Color=cc[8:12], cc1Alpha=cc[12:16],
+    blender=[blender[0:4], blender[4:8]],
+    modes=SimpleNamespace(**dict(zip("xyzw", (int(v) for v in ubo["modes"])))),
+  )
+
+def random_material(rng: random.Random) -> F64Material:
+  tex_filter = rng.choice([0, 2, 3]) << 12 # point, bilerp, average
+  othermode_h = (rng.randint(0, 1 << 24) & ~(3 << 12)) | tex_filter
+  return F64Material(
+    cc=np.array([rng.randint(0, 20) for _ in range(16)], dtype=np.int32),
+    blender=tuple(rng.randint(0, 10) for _ in range(8)),
+    tile_conf=np.zeros(16, dtype=np.float32),
+    othermode_h=othermode_h, othermode_l=rng.randint(0, 1 << 16), geo_mode=rng.randint(0, 1 << 18),
+  )
+
+def test_variant_covers_all_fallbacks():
+  defines = get_variant_defines(get_variant_key(random_material(random.Random(0))))
+  assert len(VARIANT_BLOCKS) > 0
+  for variant, fallbacks in VARIANT_BLOCKS.items():
+    assert variant in defines
+    for name in fallbacks:
+      assert name in defines, f"{name} of {variant} is not set by the variant"
+
+@pytest.mark.parametrize("seed", range(5))
+def test_variant_matches_uber_shader(seed):
+  rng = random.Random(seed)
+  materials = [random_material(rng) for _ in range(40)]
+  ubo = ubo_build_batch(materials, np.arange(len(materials), dtype=np.int32),
+    ((1, 1, 1, 1), (0, 0, 0, 0)), ((0, 0, 1), (0, 0, 1)), (0, 0, 0, 1), (1, 1, 1, 1), (0.5, 0.5, 0.5, 0.5))
+
+  for f64mat, ubo_mat in zip(materials, ubo):
+    material = ubo_to_material(ubo_mat)
+    defines = get_variant_defines(get_variant_key(f64mat))
+    for fallbacks in VARIANT_BLOCKS.values():
+      for name, uber_expr in fallbacks.items():
+        assert glsl_eval(defines[name], material) == glsl_eval(uber_expr, material), name
+
+def test_key_flags_match_shader():
+  rng = random.Random(1)
+  for _ in range(200):
+    f64mat = random_material(rng)
+    _, _, cycle_2, filter_3point = get_variant_key(f64mat)
+    material = SimpleNamespace(modes=SimpleNamespace(x=0, y=0, z=f64mat.othermode_h, w=0))
+
+    assert cycle_2 == glsl_eval("(OTHER_MODE_H & G_CYC_2CYCLE) != 0", material)
+    assert filter_3point == glsl_eval("texFilter() == G_TF_BILERP", material)
+
+def test_python_constants_match_shader():
+  material = SimpleNamespace()
+  assert G_CYC_2CYCLE == glsl_eval("G_CYC_2CYCLE", material)
+  assert G_TF_BILERP == glsl_eval("G_TF_BILERP", material)
@@ -0,0 +1,88 @@
+from collections import deque
+from contextlib import contextmanager
+import csv
+import json
+import time
+
+# Collects timings (named scopes, in ms) and counters per frame.
+# Scopes with the same name add up within a frame, nested scopes are measured inclusively.
+class Profiler:
+  def __init__(self, history_size: int = 1000):
+    self.enabled = False
+    self.history: deque[dict] = deque(maxlen=history_size) # finished frames, oldest first
+    self.frame = 0
+    self.times: dict[str, float] = {}
+    self.counters: dict[str, int] = {}
+    self.started: dict[str, float] = {}
+
+  # start/stop a scope, for code where a 'with' block would not fit
+  def start(self, name: str):
+    if self.enabled:
+      self.started[name] = time.perf_counter()
+
+  def stop(self, name: str):
+    t = self.started.pop(name, None)
+    if t is not None:
+      self.times[name] = self.times.get(name, 0.0) + (time.perf_counter() - t) * 1000
+
+  @contextmanager
+  def scope(self, name: str):
+    self.start(name)
+    try:
+      yield
+    finally:
+      self.stop(name)
+
+  def count(self, name: str, value: int = 1):
+    if self.enabled:
+      self.counters[name] = self.counters.get(name, 0) + value
+
+  def begin_frame(self):
+    self.times = {}
+    self.counters = {}
+    self.started = {}
+
+  def end_frame(self):
+    if not self.enabled:
+      return
+    self.history.append({"frame": self.frame, "times": self.times, "counters": self.counters})
+    self.frame += 1
+
+  def clear(self):
+    self.history.clear()
+    self.frame = 0
+
+  # Average of each scope and counter over the last 'frames' frames
+  def averages(self, frames: int = 20) -> tuple[dict[str, float], dict[str, float]]:
+    records = list(self.history)[-frames:]
+    times, counters = {}, {}
+    for record in records:
+      for name, value in record["times"].items():
+        times[name] = times.get(name, 0.0) + value / len(records)
+      for name, value in record["counters"].items():
+        counters[name] = counters.get(name, 0.0) + value / len(records)
+    return times, counters
+
+  def _columns(self) -> tuple[list[str], list[str]]:
+    time_names, counter_names = {}, {}
+    for record in self.history:
+      time_names.update(dict.fromkeys(record["times"]))
+      counter_names.update(dict.fromkeys(record["counters"]))
+    return list(time_names), list(counter_names)
+
+  # One row per frame, times are in ms
+  def export_csv(self, path: str):
+    time_names, counter_names = self._columns()
+    with open(path, "w", newline="", encoding="utf-8") as f:
+      writer = csv.writer(f)
+      writer.writerow(["frame"] + [f"{name} (ms)" for name in time_names] + counter_names)
+      for record in self.history:
+        writer.writerow([record["frame"]]
+          + [record["times"].get(name, 0.0) for name in time_names]
+          + [record["counters"].get(name, 0) for name in counter_names])
+
+  def export_json(self, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+      json.dump(list(self.history), f, indent=2)
+
+f64render_profiler = Profiler()